@@ -0,0 +1,194 @@
+'''benchmark is the script which measures overhead of ffmpeg_queue itself, without ffmpeg. ffmpeg (and ffprobe) is
+replaced by stub, which works for given wall and CPU time, writes output of given size and exits with given code.
+Each mode of the queue is run by main() of ffmpeg_queue in a separate process on every number of empty input files
+(with splitting into segments turned off, so there is one stub run per file).
+Usage: python benchmark.py [parameters]
+	"--jobs=<int,...>" - numbers of jobs to run ("10,1000,100000" by default)
+	"--modes=<mode,...>" - modes of the queue to run, all by default: "sequential" (one thread), "pooled" ("threads"
+	    threads), "journal" (pooled with journal), "longest" (pooled with files ordered by probed duration),
+	    "adaptive" (adaptive mode up to "threads" threads), "recursive" (pooled, files are in subdirectories)
+	"--threads=<int>" - set number of threads for pooled modes (number of CPUs by default)
+	"--wall=<seconds>" - set wall time of each stub (0 by default)
+	"--cpu=<seconds>" - set CPU time which each stub spends in busy loop (0 by default)
+	"--size=<bytes>" - set size of output file written by stub (0 by default)
+	"--exit=<int>" - set exit code of stub (0 by default)
+	"--json=<path>" - append results to the file as JSON lines, so they can be compared run to run
+For each run there are printed: wall time and jobs per second of the queue, dispatch latency (time from the end of
+one job to the start of the stub which takes its thread, including launch of the stub), percent of time when
+threads were idle and peak RSS of the queue process (not available on Windows).'''
+import sys
+import os
+import time
+import json
+import subprocess
+
+STUB = '''import sys, os, time, json
+started = time.time()
+args = sys.argv[1:]
+if '-show_entries' in args:
+	print(json.dumps({'packets': []}))
+	sys.exit(0)
+if '-show_format' in args:
+	print(json.dumps({'format': {'duration': str(len(args[-1]) * 10.0)}, 'streams': []}))
+	sys.exit(0)
+cpu = float(os.environ.get('STUB_CPU', '0'))
+while time.process_time() < cpu:
+	pass
+time.sleep(max(0.0, started + float(os.environ.get('STUB_WALL', '0')) - time.time()))
+if '-progress' in args:
+	print(f'out_time_us={int((time.time() - started) * 1000000)}\\nspeed=1.0x\\nprogress=end', flush=True)
+if len(args) > 0:
+	with open(args[-1], 'wb') as f:
+		f.write(bytes(int(os.environ.get('STUB_SIZE', '0'))))
+with open(os.environ['STUB_LOG'], 'a') as f:
+	f.write(f'{started} {time.time()}\\n')
+sys.exit(int(os.environ.get('STUB_EXIT', '0')))
+'''
+
+MODES = {
+	'sequential': ['-threads', '1'],
+	'pooled': ['-threads', '{threads}'],
+	'journal': ['-threads', '{threads}', '-journal', 'journal.sqlite'],
+	'longest': ['-threads', '{threads}', '-schedule', 'longest'],
+	'adaptive': ['-threads', '1', '-adaptive', '-max_threads', '{threads}', '--adapt_interval=1'],
+	'recursive': ['-threads', '{threads}', '-r']
+}
+
+def write_stub(directory: str):
+	'''write_stub writes stub executable to the directory and returns its path.'''
+	with open(os.path.join(directory, 'stub.py'), 'w') as f:
+		f.write(STUB)
+	if sys.platform == 'win32':
+		path = os.path.join(directory, 'stub.cmd')
+		with open(path, 'w') as f:
+			f.write(f'@"{sys.executable}" -S "%~dp0stub.py" %*\n')
+	else:
+		path = os.path.join(directory, 'stub')
+		with open(path, 'w') as f:
+			f.write(f'#!{sys.executable} -S\n{STUB}')
+		os.chmod(path, 0o755)
+	return path
+
+def make_inputs(directory: str, count: int, recursive: bool):
+	'''make_inputs creates given number of empty input files in the directory (by 100 in subdirectories,
+	if recursive is set).'''
+	for i in range(count):
+		subdirectory = os.path.join(directory, f'{i // 100:04}') if recursive else directory
+		if recursive and i % 100 == 0:
+			os.makedirs(subdirectory, exist_ok=True)
+		open(os.path.join(subdirectory, f'{i:06}.avi'), 'w').close()
+
+def run_queue(argv: list, result: str):
+	'''run_queue runs main() of ffmpeg_queue with given arguments in this process and writes its wall time
+	and peak RSS to result file. Output of the queue goes to null device.'''
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	import ffmpeg_queue
+	devnull = open(os.devnull, 'w')
+	stdout, sys.stdout = sys.stdout, devnull
+	started = time.time()
+	try:
+		returncode = ffmpeg_queue.main(argv)
+	finally:
+		sys.stdout = stdout
+	ended = time.time()
+	try:
+		import resource
+		rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+	except ImportError:
+		rss = None
+	with open(result, 'w') as f:
+		json.dump({'started': started, 'ended': ended, 'returncode': returncode, 'rss': rss}, f)
+
+def percentile(values: list, part: float):
+	if len(values) == 0:
+		return 0.0
+	return sorted(values)[min(len(values) - 1, int(len(values) * part))]
+
+def measure(mode: str, count: int, threads: int, stub: str, env: dict, workdir: str):
+	'''measure runs the queue in given mode on given number of jobs and returns dictionary of results.'''
+	import shutil
+	shutil.rmtree(workdir, ignore_errors=True)
+	input_dir = os.path.join(workdir, 'input')
+	os.makedirs(input_dir)
+	make_inputs(input_dir, count, mode == 'recursive')
+	log = os.path.join(workdir, 'stub.log')
+	result = os.path.join(workdir, 'result.json')
+	argv = ['ffmpeg_queue', '-no_user', '-ffpath', stub, '-fppath', stub, '-id', input_dir,
+		'-od', os.path.join(workdir, 'output'), '-journal', '', '-cache', '', '--history=', '--pause_file=',
+		'-progress', '0', '-no_segments',
+		*map(lambda arg: arg.format(threads=threads), MODES[mode])]
+	subprocess.run([sys.executable, os.path.abspath(__file__), '--run_queue', json.dumps(argv), result],
+		cwd=workdir, env={**os.environ, **env, 'STUB_LOG': log}, check=True)
+	with open(result) as f:
+		queue = json.load(f)
+	spans = []
+	if os.path.isfile(log):
+		with open(log) as f:
+			spans = sorted(map(lambda line: tuple(map(float, line.split())), f))
+	slots = 1 if mode == 'sequential' else min(threads, count)
+	starts = tuple(map(lambda span: span[0], spans))
+	ends = sorted(map(lambda span: span[1], spans))
+	latencies = [starts[i] - (queue['started'] if i < slots else ends[i - slots]) for i in range(len(starts))]
+	last = ends[-1] if len(ends) > 0 else queue['ended']
+	busy = sum(map(lambda span: span[1] - span[0], spans))
+	idle = max(0.0, slots * (last - queue['started']) - busy)
+	wall = queue['ended'] - queue['started']
+	return {'mode': mode, 'jobs': count, 'threads': slots, 'finished': len(spans), 'wall': wall,
+		'jobs_per_second': count / wall if wall > 0 else 0.0,
+		'dispatch_p50': percentile(latencies, 0.5), 'dispatch_p99': percentile(latencies, 0.99),
+		'idle': idle, 'idle_percent': 100 * idle / (slots * wall) if wall > 0 else 0.0,
+		'peak_rss': queue['rss'], 'returncode': queue['returncode'], 'time': int(time.time())}
+
+def main(argv):
+	if len(argv) == 4 and argv[1] == '--run_queue':
+		run_queue(json.loads(argv[2]), argv[3])
+		return 0
+	import tempfile
+	counts = [10, 1000, 100000]
+	modes = list(MODES)
+	threads = os.cpu_count() or 1
+	env = {}
+	output = None
+	for arg in argv[1:]:
+		name, _, value = arg.partition('=')
+		try:
+			if name == '--jobs':
+				counts = list(map(int, value.split(',')))
+			elif name == '--modes':
+				modes = value.split(',')
+			elif name == '--threads':
+				threads = max(1, int(value))
+			elif name in ('--wall', '--cpu'):
+				env['STUB_' + name[2:].upper()] = str(float(value))
+			elif name in ('--size', '--exit'):
+				env['STUB_' + name[2:].upper()] = str(int(value))
+			elif name == '--json':
+				output = value
+			elif name in ('--help', '-h'):
+				print(__doc__)
+				return 0
+			else:
+				print(f'Warning: Unknown console parameter: \'{arg}\'')
+		except ValueError:
+			print(f'Warning: Error with parameter: \'{arg}\'')
+	for mode in filter(lambda mode: mode not in MODES, modes):
+		print(f'Error: Unknown mode \'{mode}\', available modes: {", ".join(MODES)}')
+		return 1
+	print(f'{"mode":<12}{"jobs":>8}{"wall, s":>10}{"jobs/s":>10}{"dispatch p50/p99, ms":>22}{"idle, %":>9}'
+		f'{"peak RSS, MB":>14}{"launched":>10}')
+	with tempfile.TemporaryDirectory(prefix='ffmpeg_queue_benchmark_') as directory:
+		stub = write_stub(directory)
+		for count in counts:
+			for mode in modes:
+				result = measure(mode, count, threads, stub, env, os.path.join(directory, 'run'))
+				rss = f'{result["peak_rss"] / 1024 / 1024:.1f}' if result['peak_rss'] is not None else '-'
+				print(f'{mode:<12}{count:>8}{result["wall"]:>10.2f}{result["jobs_per_second"]:>10.1f}'
+					f'{result["dispatch_p50"] * 1000:>11.1f} / {result["dispatch_p99"] * 1000:<8.1f}'
+					f'{result["idle_percent"]:>9.1f}{rss:>14}{result["finished"]:>10}', flush=True)
+				if output is not None:
+					with open(output, 'a') as f:
+						f.write(json.dumps(result) + '\n')
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
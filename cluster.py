@@ -0,0 +1,100 @@
+'''cluster is the script which runs coordinator and several workers of ffmpeg_queue on localhost, with ffmpeg (and
+ffprobe) replaced by stub of benchmark.py, to check sharing of the queue between machines without the machines.
+Coordinator and each worker are separate processes using the same input and output directories. One of workers
+can be killed while it runs, then its jobs must be given to the others when their leases expire.
+Usage: python cluster.py [parameters]
+	"--jobs=<int>" - number of jobs (20 by default)
+	"--workers=<int>" - number of workers (2 by default)
+	"--threads=<int>" - number of threads of each worker (2 by default)
+	"--wall=<seconds>" - set wall time of each stub (1 by default)
+	"--lease=<seconds>" - set lease time given by coordinator (5 by default)
+	"--kill=<seconds>" - kill the first worker (SIGKILL on POSIX) after given time since start (it is not killed
+	    by default)
+At the end there are printed exit codes of coordinator and workers, number of outputs and temporary outputs left
+in output directory. Exit code of the script is 0 only if all the jobs are finished and no temporary output is left.'''
+import sys
+import os
+import time
+import socket
+import subprocess
+
+def free_port():
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+def main(argv):
+	import tempfile
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	from benchmark import write_stub, make_inputs
+	jobs, workers, threads, wall, lease, kill = 20, 2, 2, 1.0, 5.0, None
+	for arg in argv[1:]:
+		name, _, value = arg.partition('=')
+		try:
+			if name == '--jobs':
+				jobs = max(1, int(value))
+			elif name == '--workers':
+				workers = max(1, int(value))
+			elif name == '--threads':
+				threads = max(1, int(value))
+			elif name == '--wall':
+				wall = float(value)
+			elif name == '--lease':
+				lease = float(value)
+			elif name == '--kill':
+				kill = float(value)
+			elif name in ('--help', '-h'):
+				print(__doc__)
+				return 0
+			else:
+				print(f'Warning: Unknown console parameter: \'{arg}\'')
+		except ValueError:
+			print(f'Warning: Error with parameter: \'{arg}\'')
+	queue = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ffmpeg_queue.py')
+	with tempfile.TemporaryDirectory(prefix='ffmpeg_queue_cluster_') as directory:
+		stub = write_stub(directory)
+		input_dir = os.path.join(directory, 'input')
+		output_dir = os.path.join(directory, 'output')
+		os.makedirs(input_dir)
+		make_inputs(input_dir, jobs, False)
+		env = {**os.environ, 'STUB_WALL': str(wall), 'STUB_SIZE': '1000', 'STUB_LOG': os.path.join(directory, 'stub.log')}
+		common = [sys.executable, queue, '-no_user', '-ffpath', stub, '-fppath', stub, '-id', input_dir,
+			'-od', output_dir, '--journal=', '--cache=', '--history=', '--progress=0']
+		address = f'127.0.0.1:{free_port()}'
+		logs = []
+		def start(name, args):
+			log = open(os.path.join(directory, f'{name}.log'), 'w')
+			logs.append((name, log))
+			workdir = os.path.join(directory, name)
+			os.makedirs(workdir)
+			return subprocess.Popen([*common, *args], cwd=workdir, env=env, stdin=subprocess.DEVNULL, stdout=log,
+				stderr=subprocess.STDOUT)
+		started = time.time()
+		coordinator = start('coordinator', ['-serve', address, '-lease', str(lease)])
+		time.sleep(1)
+		children = [start(f'worker{i + 1}', ['-worker', address, '-threads', str(threads)]) for i in range(workers)]
+		if kill is not None:
+			time.sleep(max(0.0, started + kill - time.time()))
+			if children[0].poll() is None:
+				children[0].kill()
+				print(f'Worker 1 is killed after {time.time() - started:.1f} seconds')
+		codes = [child.wait() for child in children]
+		coordinator_code = coordinator.wait()
+		for _, log in logs:
+			log.close()
+		names = os.listdir(output_dir) if os.path.isdir(output_dir) else []
+		outputs = tuple(filter(lambda name: '.part.' not in name, names))
+		parts = tuple(filter(lambda name: '.part.' in name, names))
+		print(f'Coordinator has exited with code {coordinator_code} after {time.time() - started:.1f} seconds')
+		for i, code in enumerate(codes):
+			print(f'Worker {i + 1} has exited with code {code}')
+		print(f'{len(outputs)} of {jobs} outputs are made, {len(parts)} temporary outputs are left' +
+			(f': {", ".join(sorted(parts))}' if len(parts) > 0 else ''))
+		if len(outputs) != jobs or len(parts) > 0:
+			with open(os.path.join(directory, 'coordinator.log')) as f:
+				print(f.read())
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
@@ -15,7 +15,23 @@ Usage:
 	"--input_parameters=<string>" or "-ip <string>" - set string which will be put before input file path
 	    (it should end with "-i" or else ffmpeg error will occur)
 	"--output_parameters=<string>" or "-op <string>" - set string which will be put before output file path
-	"--threads=<int>" or "-threads <int>" - change number of ffmpegs running at one time
+	"--threads=<int>" or "-threads <int>" - change number of ffmpegs running at one time. With more than one
+	    thread ffmpegs are detached from the console, and exit status of each of them is reported
+	"--adaptive" or "-adaptive" - tune number of threads during the run, starting from "threads": one is added while
+	    it increases total encoding speed, and their number is halved when load average per CPU exceeds "max_load"
+	"--max_threads=<int>" or "-max_threads <int>" - set the upper limit for adaptive mode (number of CPUs by default)
+	"--max_load=<float>" or "-max_load <float>" - set load average per CPU for adaptive mode to back off (1.0)
+	"--adapt_interval=<seconds>" - set time between changes of number of threads in adaptive mode (30 seconds)
+	"--affinity" or "-affinity" - divide available CPUs between threads and pin each ffmpeg to CPUs of its thread,
+	    "-threads <number of its CPUs>" is added before output file unless ffmpeg parameters contain "-threads".
+	    Works only on Linux
+	"--no_segments" or "-no_segments" - don't split long files into segments encoded at the same time when there
+	    are fewer files than threads (only files with one video stream and audio streams are split, "-map" of output
+	    parameters is replaced for them)
+	"--nice=<int>" or "-nice <int>" - set nice value of ffmpegs (-20..19), on Windows positive values lower
+	    priority class of ffmpegs
+	"--ionice=<class>" or "-ionice <class>" - set I/O scheduling class of ffmpegs on Linux: "idle",
+	    "best-effort[:<level 0-7>]" or "realtime[:<level 0-7>]"
 	"--config_file=<path>" or "-cfg <path>" - load configuration from <path>. By default, script tries to
 	    load config file "default.ini" in directory of launching. More information on config files in 2.
 	"--shutdown" or "-s" - computer will be shut down after the script is finished
@@ -23,11 +39,133 @@ Usage:
 	"--shutdown_time=<int>" or "-time <int>" - set time which passes from the end of the job to
 	    shutdown/hibernation of the PC.
 	"--no_user" or "-no_user" - no interface will be shown, only commands passed with command line or configuration file
+	"--journal=<path>" or "-journal <path>" - set path to SQLite journal of jobs ("journal.sqlite" by default, empty
+	    string turns it off). Jobs finished successfully are skipped on the next launch, failed or interrupted ones
+	    are run again. Jobs are found by their commands with {time} left as it is, so output directory can depend
+	    on it
+	"--progress=<seconds>" or "-progress <seconds>" - set interval of printing progress of running jobs (time of
+	    output, speed, fps and size of each job, their total throughput and ETA of the queue), 10 seconds by default.
+	    0 turns it off, and then "-progress pipe:1 -nostats" is not added to ffmpeg parameters
+	"--ffprobe_path=<path/to/ffprobe>" or "-fppath <path/to/ffprobe>" - set path to ffprobe executable
+	"--schedule=<fifo|longest|largest|cost>" or "-schedule <fifo|longest|largest|cost>" - set order of jobs: "fifo"
+	    keeps order of files in directory, "longest" probes durations of files and starts longest ones first,
+	    "largest" starts largest files first, "cost" starts first the files which take longest to encode according
+	    to history of jobs (see "--history"). Files which cannot be probed get duration estimated from their size
+	"--no_size_fallback" or "-no_size_fallback" - put files which cannot be probed to the end of the queue
+	    instead of estimating their duration from size
+	"--cache=<path>" or "-cache <path>" - set path to SQLite cache of ffprobe descriptions of files ("cache.sqlite"
+	    by default, empty string turns it off). With cache, total duration of files is shown in interface
+	"--cache_size=<int>" - set maximum number of files in cache, least recently used ones are evicted (100000)
+	"--probe_threads=<int>" or "-probe_threads <int>" - change number of ffprobes running at one time (8)
+	"--history=<path>" or "-history <path>" - set path to SQLite history of finished jobs (empty by default, which
+	    turns it off). Wall time per second of content for output parameters (or renditions) and resolution of input
+	    is learned from it and gives ETA of jobs, estimate of the batch in interface and "cost" schedule. Input of each
+	    job is probed (or taken from cache) before it is started when history is on
+	"--recursive" or "-r" - look for input files in subdirectories of input directory too. Structure of
+	    subdirectories is repeated in output directory. Files are found while jobs are already running
+	"--include=<patterns>" or "-include <patterns>" - take only files matching one of comma-separated glob patterns.
+	    Patterns are matched against path relative to input directory with "/" as separator: -include "Season */*"
+	"--exclude=<patterns>" or "-exclude <patterns>" - skip files and directories matching one of comma-separated
+	    glob patterns: -exclude "*sample*,Output *"
+	"--watch" or "-watch" - keep running and encode new files as soon as they appear in input directory (noticed
+	    with inotify on Linux, by rescanning directory elsewhere). Hit Ctrl+C to stop
+	"--watch_stable=<seconds>" or "-watch_stable <seconds>" - set time for which size and modification time of new
+	    file must stay unchanged before it is encoded in watch mode (10 seconds by default)
+	"--manifest=<path>" or "-manifest <path>" - take jobs from manifest file instead of input directory: JSON lines,
+	    or CSV with header if the name ends with ".csv". It is read while jobs are running. Each row has "file"
+	    (absolute or relative to input directory of the row), optional "profile" (name of profile from configuration
+	    file, see 2) and parameters which override the ones of the profile (or main ones) for this row, like
+	    {"file": "a.avi", "profile": "720p", "output_dir": "/mnt/out"}: ffmpeg_path, ffprobe_path, input_dir,
+	    input_params, output_dir, output_params, output_format, params_order, renditions, copy_video, copy_audio,
+	    nice, logs, log_size, log_lines, verify, verify_tolerance. Rows with errors (or other parameters) are
+	    reported and skipped, and exit code is nonzero then. Preflight, schedule and segments are not used with
+	    manifest
+	"--max_jobs=<int>" or "-max_jobs <int>" - set maximum number of jobs of one profile running at one time (0, which
+	    is unlimited, by default). Profile can set its own "max_jobs", and all the jobs share "threads" slots
+	"--preflight" or "-preflight" - before encoding, probe all the input files and run ffmpeg command of each of them
+	    on the first second to null muxer ("probe_threads" at one time). Files which fail are reported and not encoded,
+	    and exit code of the script is 1 then. It is not used in watch mode
+	"--copy_video=<constraints>" or "-copy_video <constraints>" - copy video streams of input without encoding
+	    (with "-c:v copy", video codec and filters are dropped) if all of them match comma-separated constraints, like
+	    "codec=h264|hevc,pix_fmt=yuv420p,max_bitrate=8M,max_height=1080". Constraints are: codec, pix_fmt (one
+	    of "|"-separated values), max_bitrate (with "k" or "M"), max_width, max_height, max_channels. Streams are
+	    read with ffprobe before the job is started. Empty string (by default) turns it off
+	"--copy_audio=<constraints>" or "-copy_audio <constraints>" - copy audio streams of input without encoding
+	    (with "-c:a copy", audio codec and filters are dropped) if all of them match the constraints, like
+	    "codec=aac,max_bitrate=192k,max_channels=2"
+	"--pause_window=<HH:MM-HH:MM,...>" or "-pause_window <HH:MM-HH:MM,...>" - suspend running ffmpegs (with SIGSTOP
+	    to their process groups) during comma-separated periods of the day, like "09:00-18:00" (empty by default).
+	    They are resumed (SIGCONT) right after the period, so nothing is encoded again. New jobs are not started
+	    while the queue is paused. It is not available on Windows
+	"--pause_load=<float>" or "-pause_load <float>" - suspend running ffmpegs while load average per CPU exceeds
+	    the number, they are resumed when it falls below 3/4 of it (0, which turns it off, by default). Number should
+	    be greater than load made by the queue itself
+	"--pause_file=<path>" or "-pause_file <path>" - suspend running ffmpegs while the file exists, like ".pause"
+	    (empty by default, which turns it off)
+	"--logs=<path>" or "-logs <path>" - write output (stderr) of ffmpeg of each job to its own file in the directory,
+	    named "<job number>-<filename>.log" (empty string, which turns it off, by default)
+	"--log_size=<MB>" or "-log_size <MB>" - set size of log file of the job (10 MB by default). Larger log is
+	    rotated: previous part is kept as "<log>.1", so log of the job takes no more than twice the size. 0 turns
+	    rotation off
+	"--log_lines=<int>" or "-log_lines <int>" - keep last lines of output of ffmpeg in memory and print them if
+	    the job has failed (20 by default, 0 turns it off)
+	"--verify=<duration|decode>" or "-verify <duration|decode>" - verify outputs of each job as soon as it is
+	    finished, while next jobs are encoding: "duration" checks with ffprobe that duration of output matches
+	    duration of input, "decode" also decodes output to null muxer, which fails on the first error. Verification
+	    runs with the lowest CPU and I/O priority, outputs which have failed it are kept and reported, and exit code
+	    of the script is 1 then. Empty string (by default) turns it off
+	"--verify_threads=<int>" or "-verify_threads <int>" - set number of outputs verified at one time (1 by default)
+	"--verify_tolerance=<seconds>" or "-verify_tolerance <seconds>" - set allowed difference between durations of
+	    input and output (1 second by default)
+	"--trace=<path>", "--trace <path>" or "-trace <path>" - write timeline of the queue to the file in Chrome
+	    trace-event format, which can be opened in Perfetto or chrome://tracing. There is a track for each slot with
+	    phases of its jobs (prepare, spawn, encode, post-process), track of directory scan and rendering of commands,
+	    track of uploads from scratch directory, track of verification of outputs and track of the queue itself
+	    (preflight, order, pause, join, cleanup)
+	"--metrics=<path>" or "-metrics <path>" - append resource usage of each finished job to JSON-lines file: wall time,
+	    user and system CPU time and peak RSS of ffmpeg (not available on Windows), sizes of input and output,
+	    compression ratio and exit code
+	"--prometheus=<path>" or "-prometheus <path>" - keep totals of resource usage of jobs by output parameters
+	    (or renditions) in Prometheus text format file, for textfile collector of node_exporter (file should end
+	    with ".prom")
+	"--scratch=<path>" or "-scratch <path>" - stage jobs on local scratch directory: inputs of upcoming jobs are
+	    copied there while earlier jobs are encoding, ffmpeg writes outputs there, and they are moved to output
+	    directory after the job, so ffmpeg doesn't read and write slow (network) storage itself
+	"--scratch_size=<GB>" or "-scratch_size <GB>" - set space of scratch directory which staged jobs can take
+	    (20 GB by default, output of the job is counted as large as its input)
+	"--io_threads=<int>" or "-io_threads <int>" - change number of copies to and from scratch directory running
+	    at one time on each device (2)
+	"--serve=<[host:]port>" or "-serve <[host:]port>" - don't encode, but give jobs to workers over HTTP (coordinator).
+	    Workers are started with the same configuration and see input and output directories at the same paths.
+	    Journal of jobs is kept by coordinator. Segments and watch mode are not used by coordinator
+	"--worker=<host:port>" or "-worker <host:port>" - take jobs from coordinator instead of input directory and
+	    encode them with "threads" ffmpegs at one time. Worker stops when coordinator has no more jobs
+	"--renditions=<names>" or "-renditions <names>" - make outputs of comma-separated profiles from configuration file
+	    (see 2) by one ffmpeg for each input file instead of one output. Output of profile is named
+	    "<filename>.<profile>.<its output_format>", only output parameters, format and directory of profiles are used
+	"--control=<path>" or "-control <path>" - listen for commands on Unix socket at <path> while jobs are running
+	    (not available on Windows). Commands are sent by "control" command of the script itself:
+	    "ffmpeg_queue.py control <path> <command>", where <command> is one of:
+	      "status" - show running and queued jobs,
+	      "add [-p <priority>] <files>" - add files (relative to input directory without "..", or absolute) to the
+	          queue, with given priority (0 by default, jobs with higher priority are started first),
+	      "priority <job> <priority>" - change priority of the queued job,
+	      "cancel <job>" - stop the running job (with its process group) or remove the queued one, job split into
+	          segments is cancelled with all of its segments. Cancelled jobs don't make the exit code nonzero,
+	      "threads <int>" - change number of ffmpegs running at one time,
+	      "drain" - don't start new jobs, finish the running ones and stop
+	"--lease=<seconds>" or "-lease <seconds>" - set time for which coordinator gives a job to worker (60 seconds by
+	    default). Workers renew leases while jobs are running, and jobs of vanished workers are given to others
 2. Configuration ini file.
 	  Configuration can be loaded at startup point, by passing console parameter "--config_file=<path>" or "-cfg <path>",
 	or it can be loaded from user interface by command "load". You can save any configuration by command "save" at UI.
 	Also, ini file is easily readable by any text-viewer, after save you can try to change by yourself.
 	In some cases, not all of the parameters go to ini file - it happens when they are same to default.
+	  Besides [default] section, ini file can contain output profiles: sections [profile <name>] with parameters
+	which differ from [default] ones, like "output_params" and "output_format". Profiles named in "renditions" are
+	made from each input file by one ffmpeg with several outputs, so the file is read and decoded only once.
+	Rows of manifest ("--manifest") can name a profile too, and "max_jobs" of the profile limits number of its jobs
+	running at one time.
 3. Interface.
 	  After running program, you get to console interface, where you can see list of commands and how your
 	executing string looks like at the moment. You can skip interface step by console command ("--no_user")
@@ -41,8 +179,11 @@ import sys
 import os
 import subprocess
 import time
+import asyncio
+import json
 
 from enum import Enum, auto as enum_auto
+from stat import S_ISSOCK
 
 class Shutdown:
 	'''Shutdown is the class for easy choice between shutdown, hibernation and nothing.'''
@@ -157,6 +298,7 @@ class Properties:
 			f'{props_names[Prop.OUTPUT_PARAMS]} ' \
 			f'"{props_names[Prop.OUTPUT_DIR]}{os.path.sep}{props_names[Prop.OUTPUT_FILENAME]}"'
 		self.ffmpeg_path = 'ffmpeg'
+		self.ffprobe_path = 'ffprobe'
 		self.input_params = '-i'
 		self.output_params = '-c copy'
 		self._input_formats = ['avi']
@@ -164,9 +306,59 @@ class Properties:
 		self._input_dir = '.'
 		self._output_dir = f'{props_names[Prop.INPUT_DIR]}{os.path.sep}Output {{time}}'
 		self._threads = 1
+		self._adaptive = False
+		self._max_threads = os.cpu_count() or 1
+		self._max_load = 1.0
+		self._adapt_interval = 30.0
+		self._affinity = False
+		self._segments = True
+		self._nice = 0
+		self._ionice = ''
 		self._finish = Shutdown()
 		self._no_user = False
+		self.journal = 'journal.sqlite'
+		self._progress = 10.0
+		self._schedule = 'fifo'
+		self._size_fallback = True
+		self._recursive = False
+		self._include = []
+		self._exclude = []
+		self._watch = False
+		self._watch_stable = 10.0
+		self.cache = 'cache.sqlite'
+		self._cache_size = 100000
+		self._probe_threads = 8
+		self.history = ''
+		self.copy_video = ''
+		self.copy_audio = ''
+		self._preflight = False
+		self.manifest = ''
+		self._max_jobs = 0
+		self._template = None
+		self._profiles = {}
+		self._profile_cache = {}
+		self._renditions = []
+		self._pause_window = ''
+		self._pause_load = 0.0
+		self.pause_file = ''
+		self.logs = ''
+		self._log_size = 10.0
+		self._log_lines = 20
+		self._verify = ''
+		self._verify_threads = 1
+		self._verify_tolerance = 1.0
+		self.trace = ''
+		self.metrics = ''
+		self.prometheus = ''
+		self.scratch = ''
+		self._scratch_size = 20.0
+		self._io_threads = 2
+		self.serve = ''
+		self.control = ''
+		self.worker = ''
+		self._lease = 60.0
 		self._time = int(time.time())
+		self._key_output_dir = None
 	@property
 	def input_formats(self):
 		return self._input_formats
@@ -180,6 +372,39 @@ class Properties:
 				self._input_formats = ' '.join(new_input_formats.split(',')).split()
 		else:
 			self._input_formats = new_input_formats
+	@property
+	def recursive(self):
+		return self._recursive
+	@recursive.setter
+	def recursive(self, new_recursive):
+		self._recursive = to_bool(new_recursive)
+	@property
+	def include(self):
+		return self._include
+	@include.setter
+	def include(self, new_include):
+		self._include = to_list(new_include)
+	@property
+	def exclude(self):
+		return self._exclude
+	@exclude.setter
+	def exclude(self, new_exclude):
+		self._exclude = to_list(new_exclude)
+	@property
+	def watch(self):
+		return self._watch
+	@watch.setter
+	def watch(self, new_watch):
+		self._watch = to_bool(new_watch)
+	@property
+	def watch_stable(self):
+		return self._watch_stable
+	@watch_stable.setter
+	def watch_stable(self, new_watch_stable):
+		try:
+			self._watch_stable = max(0.0, float(new_watch_stable))
+		except ValueError:
+			pass
 	@staticmethod # FIXME bug occures when non-static method
 	def get_exec_str(self, params_order = None): 
 		if params_order == None:
@@ -195,12 +420,14 @@ class Properties:
 			.replace(Properties.props_names[Properties.Prop.OUTPUT_FILENAME], f'<filename>.{self.output_format}') \
 			.replace(Properties.props_names[Properties.Prop.TIME], f'{self._time}')
 	@staticmethod # FIXME bug occures when non-static method
-	def get_exec_cmd(self, filename: str, params_order = None):
+	def get_exec_cmd(self, filename: str, params_order = None, output_filename = None, time = None):
 		#(props.ffmpeg_path, *split_quotes(props.input_params), props.input_dir + os.path.sep + fname,
 		#	*split_quotes(props.output_params),
 		#	props.output_dir + os.path.sep + fname[:fname.rfind('.') + 1] + props.output_format		
+		if output_filename == None:
+			output_filename = filename[:filename.rfind('.') + 1] + self.output_format
 		if params_order == None:
-			params_order = Properties.get_exec_cmd(self, filename, self.params_order)
+			params_order = Properties.get_exec_cmd(self, filename, self.params_order, output_filename, time)
 		return params_order \
 			.replace(Properties.props_names[Properties.Prop.FFPATH], self.ffmpeg_path) \
 			.replace(Properties.props_names[Properties.Prop.INPUT_PARAMS], self.input_params) \
@@ -208,8 +435,51 @@ class Properties:
 			.replace(Properties.props_names[Properties.Prop.INPUT_FILENAME], filename) \
 			.replace(Properties.props_names[Properties.Prop.OUTPUT_PARAMS], self.output_params) \
 			.replace(Properties.props_names[Properties.Prop.OUTPUT_DIR], self.output_dir) \
-			.replace(Properties.props_names[Properties.Prop.OUTPUT_FILENAME], filename[:filename.rfind('.') + 1] + self.output_format) \
-			.replace(Properties.props_names[Properties.Prop.TIME], f'{self._time}')
+			.replace(Properties.props_names[Properties.Prop.OUTPUT_FILENAME], output_filename) \
+			.replace(Properties.props_names[Properties.Prop.TIME], f'{self._time}' if time is None else time)
+	@staticmethod
+	def expand_output_dir(self):
+		'''expand_output_dir puts parameters and the time of launch into output_dir, if it is not done yet. Output
+		directory with {time} left as it is goes to _key_output_dir, so commands of jobs in journal don't depend on
+		the time of launch (see CommandTemplate).'''
+		if self._key_output_dir is None:
+			key_output_dir = Properties.get_exec_cmd(self, '', self.output_dir,
+				time=Properties.props_names[Properties.Prop.TIME])
+			self.output_dir = Properties.get_exec_cmd(self, '', self.output_dir)
+			self._key_output_dir = key_output_dir
+	@staticmethod
+	def get_profile(self, name: str):
+		'''get_profile returns copy of Properties with parameters of the profile from configuration file set.
+		It is made again only when parameters used by jobs are changed. Unknown profile raises ValueError.'''
+		from copy import copy
+		if name not in self._profiles:
+			raise ValueError(f'profile \'{name}\' is not found')
+		key = (self.params_order, self.ffmpeg_path, self.input_params, self.output_params, self.output_format,
+			self.input_dir, self.output_dir, self.copy_video, self.copy_audio, self._time,
+			tuple(self._profiles[name].items()))
+		if name not in self._profile_cache or self._profile_cache[name][0] != key:
+			profile = copy(self)
+			profile._template = None
+			profile._renditions = []
+			for param, value in self._profiles[name].items():
+				setattr(profile, param, value)
+			Properties.expand_output_dir(profile)
+			self._profile_cache[name] = (key, profile)
+		return self._profile_cache[name][1]
+	@staticmethod
+	def get_template(self):
+		'''get_template returns params_order compiled to CommandTemplate. It is compiled again only when some of
+		parameters used in it are changed, so rendering commands for many files is cheap.'''
+		key = (self.params_order, self.ffmpeg_path, self.input_params, self.output_params, self.input_dir,
+			self.output_dir, self._key_output_dir, self._time)
+		if self._template is None or self._template[0] != key:
+			self._template = (key, CommandTemplate(self))
+		return self._template[1]
+	@staticmethod
+	def get_preset(self):
+		'''get_preset returns the name under which jobs with these parameters are accounted: names of renditions
+		or output parameters.'''
+		return ','.join(self.renditions) if len(self.renditions) > 0 else self.output_params
 	@property
 	def threads(self):
 		return self._threads
@@ -220,14 +490,223 @@ class Properties:
 		except:
 			pass
 	@property
+	def adaptive(self):
+		return self._adaptive
+	@adaptive.setter
+	def adaptive(self, new_adaptive):
+		self._adaptive = to_bool(new_adaptive)
+	@property
+	def max_threads(self):
+		return self._max_threads
+	@max_threads.setter
+	def max_threads(self, new_max_threads):
+		try:
+			self._max_threads = max(1, int(new_max_threads))
+		except ValueError:
+			pass
+	@property
+	def max_load(self):
+		return self._max_load
+	@max_load.setter
+	def max_load(self, new_max_load):
+		try:
+			self._max_load = float(new_max_load)
+		except ValueError:
+			pass
+	@property
+	def adapt_interval(self):
+		return self._adapt_interval
+	@adapt_interval.setter
+	def adapt_interval(self, new_adapt_interval):
+		try:
+			self._adapt_interval = max(1.0, float(new_adapt_interval))
+		except ValueError:
+			pass
+	@property
+	def affinity(self):
+		return self._affinity
+	@affinity.setter
+	def affinity(self, new_affinity):
+		self._affinity = to_bool(new_affinity)
+	@property
+	def segments(self):
+		return self._segments
+	@segments.setter
+	def segments(self, new_segments):
+		self._segments = to_bool(new_segments)
+	@property
+	def nice(self):
+		return self._nice
+	@nice.setter
+	def nice(self, new_nice):
+		try:
+			self._nice = min(19, max(-20, int(new_nice)))
+		except ValueError:
+			pass
+	@property
+	def ionice(self):
+		return self._ionice
+	@ionice.setter
+	def ionice(self, new_ionice: str):
+		from re import match
+		if match('^((idle)|(best-effort|realtime)(:[0-7])?)?$', new_ionice) is not None:
+			self._ionice = new_ionice
+	@property
+	def cache_size(self):
+		return self._cache_size
+	@cache_size.setter
+	def cache_size(self, new_cache_size):
+		try:
+			self._cache_size = int(new_cache_size)
+		except ValueError:
+			pass
+	@property
+	def probe_threads(self):
+		return self._probe_threads
+	@probe_threads.setter
+	def probe_threads(self, new_probe_threads):
+		try:
+			self._probe_threads = max(1, int(new_probe_threads))
+		except ValueError:
+			pass
+	@property
+	def renditions(self):
+		return self._renditions
+	@renditions.setter
+	def renditions(self, new_renditions):
+		self._renditions = to_list(new_renditions)
+	@property
+	def scratch_size(self):
+		return self._scratch_size
+	@scratch_size.setter
+	def scratch_size(self, new_scratch_size):
+		try:
+			self._scratch_size = max(0.0, float(new_scratch_size))
+		except ValueError:
+			pass
+	@property
+	def log_size(self):
+		return self._log_size
+	@log_size.setter
+	def log_size(self, new_log_size):
+		try:
+			self._log_size = max(0.0, float(new_log_size))
+		except ValueError:
+			pass
+	@property
+	def log_lines(self):
+		return self._log_lines
+	@log_lines.setter
+	def log_lines(self, new_log_lines):
+		try:
+			self._log_lines = max(0, int(new_log_lines))
+		except ValueError:
+			pass
+	@property
+	def verify(self):
+		return self._verify
+	@verify.setter
+	def verify(self, new_verify: str):
+		if new_verify in ('', 'duration', 'decode'):
+			self._verify = new_verify
+	@property
+	def verify_threads(self):
+		return self._verify_threads
+	@verify_threads.setter
+	def verify_threads(self, new_verify_threads):
+		try:
+			self._verify_threads = max(1, int(new_verify_threads))
+		except ValueError:
+			pass
+	@property
+	def verify_tolerance(self):
+		return self._verify_tolerance
+	@verify_tolerance.setter
+	def verify_tolerance(self, new_verify_tolerance):
+		try:
+			self._verify_tolerance = max(0.0, float(new_verify_tolerance))
+		except ValueError:
+			pass
+	@property
+	def io_threads(self):
+		return self._io_threads
+	@io_threads.setter
+	def io_threads(self, new_io_threads):
+		try:
+			self._io_threads = max(1, int(new_io_threads))
+		except ValueError:
+			pass
+	@property
+	def max_jobs(self):
+		return self._max_jobs
+	@max_jobs.setter
+	def max_jobs(self, new_max_jobs):
+		try:
+			self._max_jobs = max(0, int(new_max_jobs))
+		except ValueError:
+			pass
+	@property
+	def pause_window(self):
+		return self._pause_window
+	@pause_window.setter
+	def pause_window(self, new_pause_window):
+		try:
+			parse_windows(new_pause_window)
+			self._pause_window = new_pause_window
+		except ValueError:
+			pass
+	@property
+	def pause_load(self):
+		return self._pause_load
+	@pause_load.setter
+	def pause_load(self, new_pause_load):
+		try:
+			self._pause_load = max(0.0, float(new_pause_load))
+		except ValueError:
+			pass
+	@property
+	def lease(self):
+		return self._lease
+	@lease.setter
+	def lease(self, new_lease):
+		try:
+			self._lease = max(3.0, float(new_lease))
+		except ValueError:
+			pass
+	@property
+	def preflight(self):
+		return self._preflight
+	@preflight.setter
+	def preflight(self, new_preflight):
+		self._preflight = to_bool(new_preflight)
+	@property
+	def progress(self):
+		return self._progress
+	@progress.setter
+	def progress(self, new_progress):
+		try:
+			self._progress = max(0.0, float(new_progress))
+		except ValueError:
+			pass
+	@property
 	def no_user(self):
 		return self._no_user
 	@no_user.setter
 	def no_user(self, new_no_user):
-		if isinstance(new_no_user, str):
-			self._no_user = True if new_no_user.lower() in ('true', 't', '1', True, 'yes', 'on') else False
-		else:
-			self._no_user = bool(new_no_user)
+		self._no_user = to_bool(new_no_user)
+	@property
+	def schedule(self):
+		return self._schedule
+	@schedule.setter
+	def schedule(self, new_schedule: str):
+		if new_schedule in ('fifo', 'longest', 'largest', 'cost'):
+			self._schedule = new_schedule
+	@property
+	def size_fallback(self):
+		return self._size_fallback
+	@size_fallback.setter
+	def size_fallback(self, new_size_fallback):
+		self._size_fallback = to_bool(new_size_fallback)
 	@property
 	def input_dir(self):
 		return self._input_dir
@@ -242,6 +721,7 @@ class Properties:
 		self._output_dir = \
 			f'{Properties.props_names[Properties.Prop.INPUT_DIR]}{os.path.sep}Output {{time}}' \
 			if new_output_dir == '' else new_output_dir
+		self._key_output_dir = None
 
 	@property
 	def finish(self):
@@ -267,6 +747,51 @@ def change_title(title: str):
 	if os.sys.platform == 'win32':
 		subprocess.call(f'title {title}', shell=True)
 
+def format_time(seconds: float):
+	'''format_time is the function which formats number of seconds as "H:MM:SS" string.'''
+	seconds = int(seconds)
+	return f'{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+def to_bool(value):
+	'''to_bool is the function which converts value from console or configuration file to bool.'''
+	if isinstance(value, str):
+		return value.lower() in ('true', 't', '1', 'yes', 'on')
+	return bool(value)
+
+def to_list(value):
+	'''to_list is the function which converts comma-separated string (or the one written by str(list))
+	from console or configuration file to list of strings. Value in brackets which is not list literal (like glob
+	"[abc]") is split by commas too.'''
+	if isinstance(value, str):
+		if value.startswith('[') and value.endswith(']'):
+			from ast import literal_eval
+			try:
+				items = literal_eval(value)
+				if isinstance(items, list):
+					return list(map(str, items))
+			except (ValueError, SyntaxError):
+				pass
+		return list(filter(lambda item: item != '', map(str.strip, value.split(','))))
+	return list(value)
+
+def parse_windows(string: str):
+	'''parse_windows returns list of periods of the day (start and end in minutes since midnight) from comma-separated
+	string like "09:00-13:00,14:00-18:00". Period can cross midnight: "22:00-06:00", and "24:00" is the end of the day.
+	Bad period raises ValueError.'''
+	windows = []
+	for window in filter(lambda window: window != '', map(str.strip, string.split(','))):
+		minutes = []
+		for moment in window.split('-'):
+			hours, _, mins = moment.strip().partition(':')
+			minute = int(hours) * 60 + int(mins or 0)
+			if not 0 <= int(mins or 0) < 60 or not 0 <= minute <= 24 * 60:
+				raise ValueError(f'bad time \'{moment}\'')
+			minutes.append(minute)
+		if len(minutes) != 2:
+			raise ValueError(f'bad period \'{window}\'')
+		windows.append(tuple(minutes))
+	return windows
+
 def split_quotes(string: str):
 	'''split_quotes is the function which splits input string like .split(), but quoted fragments
 	are joined to one and quotes are deleted.
@@ -288,7 +813,70 @@ def split_quotes(string: str):
 			string[i] = string[i].replace('"', '')
 			i += 1
 	return string
-	
+
+class CommandTemplate:
+	'''CommandTemplate is the class for params_order compiled to the list of arguments of ffmpeg (no shell is used).
+	Pattern is split to arguments once (quoted fragments are joined, like in split_quotes) and all the parameters
+	except filenames are put in. Input and output filenames are put in for each job and are never split or unquoted,
+	whatever characters they contain. {input_params} and {output_params} which are separate arguments become
+	several arguments. Time of launch is put in for each job too, so the command can be rendered with {time} left
+	as it is. Unknown expression in pattern raises ValueError. Arguments from output_index on belong to output file
+	(they start with {output_params} or with output file path if there are no output parameters).'''
+	def __init__(self, props: Properties, params_order: str = None):
+		from re import split
+		names = Properties.props_names
+		Prop = Properties.Prop
+		output_dir = props._key_output_dir if props._key_output_dir is not None else \
+			Properties.get_exec_cmd(props, '', props.output_dir, time=names[Prop.TIME])
+		values = {
+			names[Prop.FFPATH]: props.ffmpeg_path,
+			names[Prop.INPUT_PARAMS]: props.input_params,
+			names[Prop.INPUT_DIR]: props.input_dir,
+			names[Prop.INPUT_FILENAME]: 0,
+			names[Prop.OUTPUT_PARAMS]: props.output_params,
+			names[Prop.OUTPUT_DIR]: tuple(map(lambda part: 2 if part == names[Prop.TIME] else part,
+				split(f'({names[Prop.TIME]})', output_dir))),
+			names[Prop.OUTPUT_FILENAME]: 1,
+			names[Prop.TIME]: 2
+		}
+		self.time = str(props._time)
+		self._args = []
+		self.output_index = None
+		for arg in split_quotes(params_order if params_order is not None else props.params_order):
+			if arg == names[Prop.OUTPUT_PARAMS] and self.output_index is None:
+				self.output_index = len(self._args)
+			if arg in (names[Prop.INPUT_PARAMS], names[Prop.OUTPUT_PARAMS]):
+				self._args.extend(split_quotes(values[arg]))
+				continue
+			parts = []
+			for part in split('(\\{\\w*\\})', arg):
+				if part.startswith('{') and part.endswith('}'):
+					if part not in values:
+						raise ValueError(f'unknown expression \'{part}\' in parameters order')
+					part = values[part]
+				for part in part if isinstance(part, tuple) else (part,):
+					if part == '':
+						continue
+					if len(parts) > 0 and isinstance(part, str) and isinstance(parts[-1], str):
+						parts[-1] += part
+					else:
+						parts.append(part)
+			if len(parts) == 1 and isinstance(parts[0], str):
+				self._args.append(parts[0])
+			elif len(parts) > 0:
+				if self.output_index is None and 1 in parts:
+					self.output_index = len(self._args)
+				self._args.append(tuple(parts))
+		if self.output_index is None:
+			self.output_index = len(self._args)
+
+	def render(self, filename: str, output_filename: str, time: str = None):
+		'''render returns the list of arguments for given input and output filenames (and time instead of the time
+		of launch, if it is given).'''
+		filenames = (filename, output_filename, self.time if time is None else time)
+		return [arg if isinstance(arg, str) else
+			''.join(map(lambda part: part if isinstance(part, str) else filenames[part], arg)) for arg in self._args]
+
 def save_properties(props: Properties, filename: str):
 	'''save_properties is the function for saving configuration in file.
 	Takes Properties class and filename to save it in ini-format.'''
@@ -309,13 +897,16 @@ def save_properties(props: Properties, filename: str):
 	if len(savedict) == 0:
 		print('Output is empty, all the parameters are default', file=sys.stderr)
 	saving['default'].update(savedict)
+	for name, profile in props._profiles.items():
+		saving[f'profile {name}'] = profile
 	saving.write(f)
 	f.close()
 	
 def load_properties(props: Properties, filename: str):
 	'''load_properties is the function for loading configuration file.
 	It changes Properties class given in parameters and filename to load from.
-	Can throw ValueError exception if file is not found or there is no [default] section.'''
+	Can throw ValueError exception if file is not found, there is no [default] section, parameters order
+	contains unknown expression (then it is set to default) or profile contains unknown parameter.'''
 	import configparser
 	loading = configparser.ConfigParser()
 	if not os.path.isfile(filename):
@@ -324,6 +915,9 @@ def load_properties(props: Properties, filename: str):
 	default_props = Properties()
 	if not 'default' in loading.sections():
 		raise ValueError('no \'default\' section is found; load is aborted')
+	profiles = {}
+	for section in filter(lambda section: section.startswith('profile '), loading.sections()):
+		profiles[section[len('profile '):].strip()] = dict(loading[section])
 	loading = loading['default']
 	params = set(filter(lambda x: not x.startswith('_'), dir(props)))
 	for param in params:
@@ -331,14 +925,2612 @@ def load_properties(props: Properties, filename: str):
 			setattr(props, param, loading[param])
 		else:
 			setattr(props, param, getattr(default_props, param))
+	props._profiles = profiles
+	for name, profile in profiles.items():
+		for param in profile:
+			if param not in params or callable(getattr(props, param)):
+				raise ValueError(f'unknown parameter \'{param}\' in profile \'{name}\'')
+	try:
+		CommandTemplate(props)
+	except ValueError as exc:
+		props.params_order = default_props.params_order
+		raise ValueError(f'{exc}, default parameters order is used')
+
+MANIFEST_PARAMS = ('ffmpeg_path', 'ffprobe_path', 'input_dir', 'input_params', 'output_dir', 'output_params',
+	'output_format', 'params_order', 'renditions', 'copy_video', 'copy_audio', 'nice', 'logs', 'log_size', 'log_lines',
+	'verify', 'verify_tolerance')
+
+def read_manifest(props: Properties, skipped: list = None):
+	'''read_manifest is the generator of jobs from manifest file (JSON lines, or CSV with header if its name ends
+	with ".csv"), which is read lazily. Each row has "file" (absolute or relative to input directory of the row),
+	optional "profile" (name of profile from configuration file) and any other parameters which override the ones
+	of the profile (or main ones) for the row, only the ones which apply to one job (MANIFEST_PARAMS) can be set.
+	Parameters of rows with the same overrides are made only once. Rows with errors are reported and skipped,
+	their line numbers are appended to `skipped` list (if it is given).'''
+	from copy import copy
+	import csv
+	params = set(filter(lambda param: not param.startswith('_') and not callable(getattr(props, param)), dir(props)))
+	rows_props = {}
+	number = 0
+	with open(props.manifest, encoding='utf-8', newline='') as f:
+		is_csv = props.manifest.lower().endswith('.csv')
+		for line, row in enumerate(csv.DictReader(f) if is_csv else f, 2 if is_csv else 1):
+			try:
+				if not is_csv:
+					if row.strip() == '':
+						continue
+					row = json.loads(row)
+					if not isinstance(row, dict):
+						raise ValueError('row is not an object')
+				row = {key: str(value) for key, value in row.items() if value is not None and value != ''}
+				if 'file' not in row:
+					raise ValueError('"file" is not set')
+				path = row.pop('file')
+				profile = row.pop('profile', None)
+				for param in filter(lambda param: param not in MANIFEST_PARAMS, row):
+					raise ValueError(f'unknown parameter \'{param}\'' if param not in params else
+						f'parameter \'{param}\' is set for the whole queue, not for one row')
+				if os.path.isabs(path):
+					row['input_dir'], path = os.path.split(path)
+				key = (profile, tuple(sorted(row.items())))
+				if key not in rows_props:
+					row_props = Properties.get_profile(props, profile) if profile is not None else props
+					if len(row) > 0:
+						row_props = copy(row_props)
+						row_props._template = None
+						for param, value in row.items():
+							setattr(row_props, param, value)
+						Properties.expand_output_dir(row_props)
+						Properties.get_template(row_props)
+						parse_constraints(row_props.copy_video)
+						parse_constraints(row_props.copy_audio)
+					rows_props[key] = row_props
+				row_props = rows_props[key]
+				if not os.path.isfile(row_props.input_dir + os.path.sep + path):
+					raise ValueError(f'file \'{path}\' is not found in \'{row_props.input_dir}\'')
+				number += 1
+				job = Job(row_props, number, path.replace(os.path.sep, '/'))
+				job.profile = profile
+				yield job
+			except ValueError as exc:
+				print(f'Warning: row {line} of manifest is skipped: {exc}')
+				if skipped is not None:
+					skipped.append(line)
+
+def discover_files(props: Properties):
+	'''discover_files is the generator of paths of input files relative to input_dir. Directories are read lazily
+	with os.scandir, subdirectories are walked only if `recursive` is on (symbolic links and output directory are
+	not followed). File is taken if it has one of input_formats, matches one of `include` patterns (if there are
+	any) and matches none of `exclude` patterns. Patterns are matched against path relative to input_dir with "/"
+	as separator, and directories matching `exclude` are not walked at all.'''
+	from fnmatch import fnmatch
+	output_dir = os.path.realpath(Properties.get_exec_cmd(props, '', props.output_dir))
+	stack = ['']
+	while len(stack) > 0:
+		relative = stack.pop()
+		subdirs = []
+		try:
+			with os.scandir(props.input_dir + os.path.sep + relative if relative != '' else props.input_dir) as entries:
+				for entry in entries:
+					path = relative + os.path.sep + entry.name if relative != '' else entry.name
+					pattern_path = path.replace(os.path.sep, '/')
+					if any(map(lambda pattern: fnmatch(pattern_path, pattern), props.exclude)):
+						continue
+					if entry.is_dir(follow_symlinks=False):
+						if props.recursive and os.path.realpath(entry.path) != output_dir:
+							subdirs.append(path)
+					elif entry.name.endswith(tuple(props.input_formats)) and (len(props.include) == 0 or \
+							any(map(lambda pattern: fnmatch(pattern_path, pattern), props.include))):
+						yield path
+		except OSError as exc:
+			print(f'Warning: directory cannot be read: \'{exc}\'')
+		stack.extend(reversed(subdirs))
+
+class Inotify:
+	'''Inotify is the class for getting notifications about new files in directories from Linux inotify
+	(through ctypes, as there is no binding in standard library). Raises OSError if inotify is not available.'''
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_TO    = 0x80
+	IN_CREATE      = 0x100
+	def __init__(self):
+		import ctypes, ctypes.util
+		if os.sys.platform != 'linux':
+			raise OSError('inotify is available only on Linux')
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 has failed')
+		self._watched = set()
+
+	def add(self, path: str):
+		'''add starts watching the directory (if it is not watched yet).'''
+		if path not in self._watched and self._libc.inotify_add_watch(self.fd, os.fsencode(path),
+				Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_CREATE) >= 0:
+			self._watched.add(path)
+
+	def drain(self):
+		'''drain reads and drops all the pending events, only the fact of change is used.'''
+		try:
+			while len(os.read(self.fd, 65536)) > 0:
+				pass
+		except BlockingIOError:
+			pass
 
-def recode_func(inp):
-	'''recode_func is the function which is passed to multiprocessing.Pool and takes job number and job itself,
-	and then launches job. Job is simply command, string parameter.'''
-	number, job = inp
-	print(f'{time.ctime()}: Job {number}: [[{job}]]')
-	subprocess.getoutput(job)
-	print(f'{time.ctime()}: Job {number} is finished')
+	def close(self):
+		os.close(self.fd)
+
+async def watch_files(props: Properties):
+	'''watch_files is the endless asynchronous generator of paths of new input files relative to input_dir.
+	Input directory is scanned again when inotify reports changes (on Linux) or every `watch_stable` / 2 seconds,
+	and file is given away when its size and modification time haven't changed for `watch_stable` seconds.'''
+	loop = asyncio.get_event_loop()
+	changed = asyncio.Event()
+	try:
+		inotify = Inotify()
+		loop.add_reader(inotify.fd, lambda: (inotify.drain(), changed.set()))
+	except (OSError, AttributeError, NotImplementedError):
+		inotify = None
+	period = 60 if inotify is not None else max(1.0, props.watch_stable / 2)
+	seen = set()
+	candidates = {}
+	last_scan = None
+	try:
+		while True:
+			if last_scan is None or changed.is_set() or time.time() - last_scan >= period:
+				changed.clear()
+				last_scan = time.time()
+				files = await loop.run_in_executor(None, lambda: tuple(discover_files(props)))
+				for filename in files:
+					if filename not in seen and filename not in candidates:
+						candidates[filename] = None
+				if inotify is not None:
+					for directory in set(map(os.path.dirname, files)) | {''}:
+						inotify.add(props.input_dir + os.path.sep + directory if directory != '' else props.input_dir)
+			now = time.time()
+			for filename, state in tuple(candidates.items()):
+				try:
+					stat = os.stat(props.input_dir + os.path.sep + filename)
+				except OSError:
+					del candidates[filename]
+					continue
+				if state is None or state[:2] != (stat.st_size, stat.st_mtime_ns):
+					candidates[filename] = (stat.st_size, stat.st_mtime_ns, now)
+				elif now - state[2] >= props.watch_stable:
+					del candidates[filename]
+					seen.add(filename)
+					yield filename
+			try:
+				await asyncio.wait_for(changed.wait(), 1.0)
+			except asyncio.TimeoutError:
+				pass
+	finally:
+		if inotify is not None:
+			loop.remove_reader(inotify.fd)
+			inotify.close()
+
+def summarize_files(props: Properties):
+	'''summarize_files returns the string with number of input files, their total size and (with metadata cache)
+	total duration.'''
+	count = 0
+	size = 0
+	paths = []
+	for filename in discover_files(props):
+		path = props.input_dir + os.path.sep + filename
+		count += 1
+		size += os.path.getsize(path) if os.path.isfile(path) else 0
+		if props.cache != '':
+			paths.append(path)
+	if len(paths) == 0:
+		return f'{count} files found, {size / 2 ** 30:.2f} GB'
+	infos = run_loop(get_metadata(props, paths))
+	durations = tuple(filter(lambda duration: duration is not None, map(get_duration, infos)))
+	unknown = f' ({count - len(durations)} files cannot be probed)' if len(durations) < count else ''
+	estimate = ''
+	if props.history != '' and os.path.isfile(props.history):
+		history = History(props.history)
+		costs = tuple(map(lambda info: history.estimate(Properties.get_preset(props), info), infos))
+		history.close()
+		known = tuple(filter(lambda cost: cost is not None, costs))
+		if len(known) > 0:
+			estimate = f', estimated time {format_time(sum(known) / max(1, props.threads))} on {props.threads} ' \
+				f'threads' + (f' ({len(costs) - len(known)} files are not estimated)' if len(known) < len(costs) else '')
+	return f'{count} files found, {size / 2 ** 30:.2f} GB, total duration {format_time(sum(durations))}{unknown}' \
+		f'{estimate}'
+
+def remove_empty_dirs(path: str):
+	'''remove_empty_dirs deletes all empty directories in the given one, and the directory itself if it is empty.'''
+	for dirpath, _, _ in tuple(os.walk(path, topdown=False)):
+		if len(os.listdir(dirpath)) == 0:
+			os.rmdir(dirpath)
+
+def slot_cpus(count: int, taken: list):
+	'''slot_cpus returns the set of CPUs for a new slot out of `count`: its share of CPUs available to the script
+	(neighbouring ones, if they are free), which are not in `taken` sets of the slots already running. If all CPUs
+	are taken, it is one CPU taken by the least number of slots.'''
+	cpus = sorted(os.sched_getaffinity(0))
+	busy = set().union(*taken)
+	free = list(filter(lambda cpu: cpu not in busy, cpus))
+	if len(free) == 0:
+		return {min(cpus, key=lambda cpu: sum(map(lambda cpus: cpu in cpus, taken)))}
+	size = max(1, len(cpus) // max(1, count))
+	for start in range(len(free) - size + 1):
+		if free[start + size - 1] - free[start] == size - 1:
+			return set(free[start:start + size])
+	return set(free[:size])
+
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'ppc64le': 273,
+	's390x': 282, 'riscv64': 30}
+
+def ioprio_setter(ionice: str):
+	'''ioprio_setter returns the function which sets I/O scheduling class of the calling process ("idle",
+	"best-effort[:<level>]" or "realtime[:<level>]", as ionice utility does) with ioprio_set system call,
+	or None if ionice is empty or is not supported.'''
+	if ionice == '':
+		return None
+	import platform
+	number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+	if os.sys.platform != 'linux' or number is None:
+		print(f'Warning: ionice is not supported on {os.sys.platform} {platform.machine()}, it is ignored')
+		return None
+	import ctypes
+	name, _, level = ionice.partition(':')
+	ioclass = {'realtime': 1, 'best-effort': 2, 'idle': 3}[name]
+	prio = ioclass << 13 | (int(level) if level != '' else 0 if ioclass == 3 else 4)
+	syscall = ctypes.CDLL(None, use_errno=True).syscall
+	return lambda: syscall(number, 1, 0, prio)
+
+SEGMENT_MIN_DURATION = 120
+SEGMENT_DROPPED = {'-map': 1, '-vn': 0, '-an': 0, '-sn': 0, '-dn': 0}
+
+def drop_options(params: str, options: dict):
+	'''drop_options returns parameters string without the given options (dictionary of option and number of its
+	values), arguments with spaces are quoted again.'''
+	args = split_quotes(params)
+	kept = []
+	i = 0
+	while i < len(args):
+		if args[i] in options:
+			i += 1 + options[args[i]]
+			continue
+		kept.append(f'"{args[i]}"' if ' ' in args[i] else args[i])
+		i += 1
+	return ' '.join(kept)
+
+async def probe_keyframes(props: Properties, path: str, targets: list):
+	'''probe_keyframes returns timestamps of keyframes of the first video stream which are the closest to target
+	timestamps. Only packets in 30 seconds after each target are read, nothing is decoded.'''
+	try:
+		process = await asyncio.create_subprocess_exec(props.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+			'-read_intervals', ','.join(map(lambda target: f'{target:.3f}%+30', targets)),
+			'-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path,
+			stdin=subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=subprocess.DEVNULL)
+	except OSError:
+		return []
+	output, _ = await process.communicate()
+	keyframes = []
+	for line in output.decode(errors='replace').splitlines():
+		pts, _, flags = line.partition(',')
+		if flags.startswith('K'):
+			try:
+				keyframes.append(float(pts))
+			except ValueError:
+				pass
+	if process.returncode != 0 or len(keyframes) == 0:
+		return []
+	points = set(map(lambda target: min(keyframes, key=lambda keyframe: abs(keyframe - target)), targets))
+	return sorted(filter(lambda point: point > 0, points))
+
+def plan_segments(props: Properties, files: tuple):
+	'''plan_segments returns jobs for the files when there are fewer of them than threads. Each file longer than
+	2 * SEGMENT_MIN_DURATION is split at keyframes into segments (threads / number of files of them), video of each
+	segment is encoded by separate job, audio is encoded by one more job, and after all of them are finished,
+	they are joined with concat demuxer. Streams of parts are mapped explicitly (stream selection options of output
+	parameters, see SEGMENT_DROPPED, are dropped), so only files with one video stream and audio streams are split,
+	the ones with subtitles, data or several video streams are encoded whole.'''
+	from copy import copy
+	paths = tuple(map(lambda filename: props.input_dir + os.path.sep + filename, files))
+	infos = run_loop(get_metadata(props, paths))
+	count = props.threads // len(files)
+	jobs = []
+	for number, (filename, path, info) in enumerate(zip(files, paths, infos), 1):
+		job = Job(props, number, filename)
+		duration = get_duration(info)
+		segments = min(count, int(duration // SEGMENT_MIN_DURATION)) if duration is not None else 0
+		kinds = tuple(map(lambda stream: stream.get('codec_type'), info.get('streams', []))) if info is not None else ()
+		if segments > 1 and (kinds.count('video') != 1 or any(map(lambda kind: kind not in ('video', 'audio'), kinds))):
+			print(f'{filename} is not split into segments, as it has streams other than one video and audio')
+			segments = 0
+		points = run_loop(probe_keyframes(props, path, tuple(map(lambda k: duration * k / segments,
+			range(1, segments))))) if segments > 1 else []
+		if len(points) == 0:
+			jobs.append(job)
+			continue
+		directory = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.segments')
+		bounds = [0.0, *points, None]
+		job.parts = []
+		output_params = drop_options(props.output_params, SEGMENT_DROPPED)
+		if 'audio' in kinds:
+			part_props = copy(props)
+			part_props.output_params = f'{output_params} -map 0:a -vn -sn -dn'
+			job.audio = Job(part_props, number, filename, os.path.join(directory, f'audio.{props.output_format}'))
+			job.audio.filename = f'{filename} (audio)'
+			job.parts.append(job.audio)
+		for k in range(len(bounds) - 1):
+			part_props = copy(props)
+			part_props.input_params = f'-ss {bounds[k]:.6f} {props.input_params}'
+			part_props.output_params = f'{output_params} -map 0:v:0 -an -sn -dn' + \
+				(f' -t {bounds[k + 1] - bounds[k]:.6f}' if bounds[k + 1] is not None else '')
+			part = Job(part_props, number, filename, os.path.join(directory, f'video{k:03}.{props.output_format}'))
+			part.filename = f'{filename} (segment {k + 1} of {len(bounds) - 1})'
+			job.parts.append(part)
+		for part in job.parts:
+			part.parent = job
+		print(f'{filename} is split into {len(bounds) - 1} segments')
+		jobs.extend(job.parts)
+	return jobs
+
+def run_loop(coroutine):
+	'''run_loop is the function which runs coroutine in new asyncio event loop and returns its result.
+	On Windows Proactor event loop is used, as only it can launch subprocesses.'''
+	if os.sys.platform == 'win32':
+		asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+	return asyncio.run(coroutine)
+
+async def probe_file(props: Properties, path: str, **limits):
+	'''probe_file runs ffprobe on the file and returns its description (dictionary with "format" and "streams"),
+	or None if the file cannot be probed. `limits` are additional arguments for subprocess.'''
+	try:
+		process = await asyncio.create_subprocess_exec(props.ffprobe_path, '-v', 'error', '-show_format',
+			'-show_streams', '-of', 'json', path,
+			stdin=subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=subprocess.DEVNULL, **limits)
+	except OSError:
+		return None
+	output, _ = await process.communicate()
+	if process.returncode != 0:
+		return None
+	try:
+		return json.loads(output)
+	except ValueError:
+		return None
+
+async def probe_files(props: Properties, paths: list, threads: int):
+	'''probe_files probes all the given files, no more than `threads` ffprobes at one time.'''
+	semaphore = asyncio.Semaphore(threads)
+	async def probe(path):
+		async with semaphore:
+			return await probe_file(props, path)
+	return await asyncio.gather(*map(probe, paths))
+
+class MetadataCache:
+	'''MetadataCache is the class for persistent SQLite cache of ffprobe descriptions of files. File is identified
+	by its path, size and modification time, so description of changed file is dropped and probed again.
+	Cache keeps no more than `size` descriptions, least recently used ones are evicted.'''
+	def __init__(self, filename: str, size: int):
+		import sqlite3
+		self._db = sqlite3.connect(filename)
+		self._db.execute('CREATE TABLE IF NOT EXISTS metadata (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+			'info TEXT, accessed REAL)')
+		self._size = size
+
+	def get(self, path: str):
+		'''get returns pair (found, description) for the file. Description is None for files which ffprobe
+		could not read. Raises OSError if the file is not accessible.'''
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		row = self._db.execute('SELECT size, mtime_ns, info FROM metadata WHERE path = ?', (path,)).fetchone()
+		if row is None:
+			return False, None
+		if row[:2] != (stat.st_size, stat.st_mtime_ns):
+			self._db.execute('DELETE FROM metadata WHERE path = ?', (path,))
+			return False, None
+		self._db.execute('UPDATE metadata SET accessed = ? WHERE path = ?', (time.time(), path))
+		return True, json.loads(row[2])
+
+	def put(self, path: str, info: dict):
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		self._db.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)',
+			(path, stat.st_size, stat.st_mtime_ns, json.dumps(info), time.time()))
+
+	def evict(self):
+		self._db.execute('DELETE FROM metadata WHERE path NOT IN '
+			'(SELECT path FROM metadata ORDER BY accessed DESC LIMIT ?)', (self._size,))
+
+	def clear(self):
+		self._db.execute('DELETE FROM metadata')
+
+	def close(self):
+		self._db.commit()
+		self._db.close()
+
+async def get_metadata(props: Properties, paths: list, quiet: bool = False):
+	'''get_metadata returns ffprobe descriptions of the files (None for the ones which cannot be probed).
+	They are taken from metadata cache, and only files missing there are probed, `probe_threads` at one time.
+	Cache is not kept open while files are probed, so other tasks can use it meanwhile. Cache which cannot be
+	used (like locked by another process for too long) is reported and files are probed.'''
+	import sqlite3
+	infos = [None] * len(paths)
+	missing = list(range(len(paths)))
+	if props.cache != '':
+		missing = []
+		try:
+			cache = MetadataCache(props.cache, props.cache_size)
+			try:
+				for i, path in enumerate(paths):
+					try:
+						found, infos[i] = cache.get(path)
+					except OSError:
+						continue
+					if not found:
+						missing.append(i)
+			finally:
+				cache.close()
+		except sqlite3.Error as exc:
+			print(f'Warning: metadata cache \'{props.cache}\' cannot be read: \'{exc}\'')
+			missing = list(range(len(paths)))
+	if len(missing) == 0:
+		return infos
+	if not quiet:
+		print(f'Probing {len(missing)} files')
+	probed = await probe_files(props, tuple(map(lambda i: paths[i], missing)), props.probe_threads)
+	for i, info in zip(missing, probed):
+		infos[i] = info
+	if props.cache != '':
+		try:
+			cache = MetadataCache(props.cache, props.cache_size)
+			try:
+				for i in filter(lambda i: os.path.isfile(paths[i]), missing):
+					cache.put(paths[i], infos[i])
+				cache.evict()
+			finally:
+				cache.close()
+		except sqlite3.Error as exc:
+			print(f'Warning: metadata cache \'{props.cache}\' cannot be written: \'{exc}\'')
+	return infos
+
+def get_duration(info: dict):
+	'''get_duration returns duration in seconds from ffprobe description of the file, or None if it is unknown.'''
+	try:
+		return float(info['format']['duration'])
+	except (TypeError, KeyError, ValueError):
+		return None
+
+COPY_CONSTRAINTS = ('codec', 'pix_fmt', 'max_bitrate', 'max_width', 'max_height', 'max_channels')
+COPY_DROPPED = {'video': ('-c:v', '-codec:v', '-vcodec', '-vf', '-filter:v', '-s', '-pix_fmt', '-r'),
+	'audio': ('-c:a', '-codec:a', '-acodec', '-af', '-filter:a', '-ar', '-ac')}
+
+def parse_constraints(string: str):
+	'''parse_constraints returns dictionary of stream constraints from string like "codec=h264|hevc,max_height=1080"
+	(see COPY_CONSTRAINTS). Lists of values are split by "|", numbers can have "k" or "M" suffix.
+	Unknown constraint or bad number raises ValueError.'''
+	constraints = {}
+	for constraint in filter(lambda constraint: constraint != '', map(str.strip, string.split(','))):
+		name, _, value = map(str.strip, constraint.partition('='))
+		if name not in COPY_CONSTRAINTS:
+			raise ValueError(f'unknown stream constraint \'{name}\'')
+		if name.startswith('max_'):
+			multiplier = {'k': 1000, 'M': 1000000}.get(value[-1:], 1)
+			constraints[name] = float(value[:-1] if multiplier > 1 else value) * multiplier
+		else:
+			constraints[name] = value.split('|')
+	return constraints
+
+def stream_matches(stream: dict, constraints: dict, bit_rate: str = None):
+	'''stream_matches returns True if the stream from ffprobe description meets all of the constraints.
+	Unknown value doesn't match, except bitrate of stream, for which bitrate of the whole file (bit_rate) is used.'''
+	fields = {'codec': 'codec_name', 'pix_fmt': 'pix_fmt', 'max_bitrate': 'bit_rate', 'max_width': 'width',
+		'max_height': 'height', 'max_channels': 'channels'}
+	for name, limit in constraints.items():
+		value = stream.get(fields[name], bit_rate if name == 'max_bitrate' else None)
+		if name.startswith('max_'):
+			try:
+				if float(value) > limit:
+					return False
+			except (TypeError, ValueError):
+				return False
+		elif value not in limit:
+			return False
+	return True
+
+def copied_streams(props: Properties, info: dict):
+	'''copied_streams returns types of streams ("video", "audio") of the file with ffprobe description info,
+	which all match constraints of stream copy (copy_video, copy_audio) and can be copied without encoding.'''
+	if info is None:
+		return ()
+	bit_rate = info.get('format', {}).get('bit_rate')
+	copied = []
+	for kind, string in (('video', props.copy_video), ('audio', props.copy_audio)):
+		streams = tuple(filter(lambda stream: stream.get('codec_type') == kind and
+			not stream.get('disposition', {}).get('attached_pic'), info.get('streams', [])))
+		if string != '' and len(streams) > 0 and all(map(lambda stream:
+				stream_matches(stream, parse_constraints(string), bit_rate), streams)):
+			copied.append(kind)
+	return tuple(copied)
+
+HISTORY_WINDOW = 50
+
+def resolution_class(info: dict):
+	'''resolution_class returns class of resolution of the first video stream from ffprobe description of the file
+	by its smaller side: "sd" (below 720), "hd" (below 1080), "fhd" (below 1440), "qhd" (below 2160), "uhd"
+	or "unknown".'''
+	try:
+		stream = next(filter(lambda stream: stream.get('codec_type') == 'video', info['streams']))
+		lines = min(int(stream['width']), int(stream['height']))
+	except (TypeError, KeyError, ValueError, StopIteration):
+		return 'unknown'
+	for name, limit in (('sd', 720), ('hd', 1080), ('fhd', 1440), ('qhd', 2160)):
+		if lines < limit:
+			return name
+	return 'uhd'
+
+class History:
+	'''History is the class for persistent SQLite history of successfully finished jobs: preset (see
+	Properties.get_preset), resolution class and video codec of input, its duration and wall time of the job.
+	It is the cost model of encoding: seconds of wall time per second of content for the preset and resolution
+	class, taken over last `HISTORY_WINDOW` jobs (over all resolutions of the preset if there were no jobs
+	of the class).'''
+	def __init__(self, filename: str):
+		import sqlite3
+		self._db = sqlite3.connect(filename)
+		self._db.execute('CREATE TABLE IF NOT EXISTS history (preset TEXT, resolution TEXT, codec TEXT, '
+			'duration REAL, wall REAL, finished REAL)')
+		self._db.execute('CREATE INDEX IF NOT EXISTS history_preset ON history (preset, resolution, finished)')
+		self._db.commit()
+		self._costs = {}
+
+	def record(self, preset: str, info: dict, wall: float):
+		duration = get_duration(info)
+		if duration is None or duration <= 0:
+			return
+		codec = next(map(lambda stream: stream.get('codec_name'),
+			filter(lambda stream: stream.get('codec_type') == 'video', info.get('streams', []))), None)
+		self._db.execute('INSERT INTO history VALUES (?, ?, ?, ?, ?, ?)',
+			(preset, resolution_class(info), codec, duration, wall, time.time()))
+		self._db.commit()
+		self._costs.clear()
+
+	def cost(self, preset: str, resolution: str):
+		'''cost returns seconds of wall time per second of content, or None if there is no history of the preset.'''
+		if (preset, resolution) not in self._costs:
+			for condition, args in (('AND resolution = ?', (preset, resolution)), ('', (preset,))):
+				wall, duration = self._db.execute(f'SELECT SUM(wall), SUM(duration) FROM (SELECT wall, duration '
+					f'FROM history WHERE preset = ? {condition} ORDER BY finished DESC LIMIT {HISTORY_WINDOW})',
+					args).fetchone()
+				if duration:
+					self._costs[preset, resolution] = wall / duration
+					break
+			else:
+				self._costs[preset, resolution] = None
+		return self._costs[preset, resolution]
+
+	def estimate(self, preset: str, info: dict):
+		'''estimate returns expected wall time of encoding the file with ffprobe description info, or None.'''
+		duration = get_duration(info)
+		cost = self.cost(preset, resolution_class(info)) if duration is not None else None
+		return duration * cost if cost is not None else None
+
+	def close(self):
+		self._db.close()
+
+def order_files(props: Properties, files: tuple):
+	'''order_files returns files sorted by estimated cost of encoding, longest first, so the slots are kept busy
+	and the queue is not waiting for one long job started at the end. With "largest" schedule the cost is
+	file size, with "longest" it is duration given by ffprobe, with "cost" it is duration multiplied by wall time
+	per second of content for resolution of the file from history (see History). Files which cannot be probed
+	get duration estimated from their size (if size_fallback is on) or go to the end of the queue.'''
+	paths = tuple(map(lambda fname: props.input_dir + os.path.sep + fname, files))
+	sizes = tuple(map(lambda path: os.path.getsize(path) if os.path.isfile(path) else 0, paths))
+	if props.schedule == 'largest':
+		costs = sizes
+	else:
+		infos = run_loop(get_metadata(props, paths))
+		durations = tuple(map(get_duration, infos))
+		if props.schedule == 'cost' and props.history != '':
+			history = History(props.history)
+			preset = Properties.get_preset(props)
+			rates = tuple(map(lambda info: history.cost(preset, resolution_class(info)), infos))
+			history.close()
+			if any(map(lambda rate: rate is not None, rates)):
+				default = max(filter(lambda rate: rate is not None, rates))
+				durations = tuple(map(lambda pair: pair[0] * (pair[1] if pair[1] is not None else default)
+					if pair[0] is not None else None, zip(durations, rates)))
+			else:
+				print('Warning: there is no history of jobs with current parameters, files are ordered by duration')
+		elif props.schedule == 'cost':
+			print('Warning: history of jobs is not set ("--history"), files are ordered by duration')
+		known = tuple(filter(lambda pair: pair[0] is not None, zip(durations, sizes)))
+		rate = None
+		if props.size_fallback and sum(map(lambda pair: pair[1], known)) > 0:
+			rate = sum(map(lambda pair: pair[0], known)) / sum(map(lambda pair: pair[1], known))
+		costs = tuple(map(lambda pair: pair[0] if pair[0] is not None else -1 if rate is None else pair[1] * rate,
+			zip(durations, sizes)))
+		if len(known) < len(files):
+			print(f'Warning: {len(files) - len(known)} files cannot be probed, they are ' +
+				('estimated by size' if rate is not None else 'put to the end of the queue'))
+	return tuple(map(lambda i: files[i], sorted(range(len(files)), key=lambda i: costs[i], reverse=True)))
+
+class Rendition:
+	'''Rendition is the class for one output of the job: name of its profile (None for the output made with main
+	parameters), output path, temporary output path and status ("done", "failed" or "interrupted") after the job
+	is finished.'''
+	def __init__(self, name: str, output: str, temp_output: str):
+		self.name = name
+		self.output = output
+		self.temp_output = temp_output
+		self.status = None
+
+class Job:
+	'''Job is the class for one launch of ffmpeg: its number in the queue, input filename and command itself
+	(list of arguments, no shell is used). ffmpeg writes to temporary output file (temp_output), which is renamed
+	to output only after success. If renditions are set, one ffmpeg makes output of each of them (renditions holds
+	their outputs, output and temp_output are the ones of the first rendition). After the job is finished,
+	returncode holds exit status of ffmpeg. Command of the job in journal (key_command) is rendered with {time} left
+	as it is, so the job has the same key in every batch, like with default output directory.'''
+	def __init__(self, props: Properties, number: int, filename: str, output_filename: str = None):
+		rendering = time.time()
+		self.number = number
+		self.filename = filename
+		self.input_path = props.input_dir + os.path.sep + filename
+		self.renditions = []
+		self.command = []
+		key_command = []
+		key_time = Properties.props_names[Properties.Prop.TIME]
+		for name in (props.renditions if len(props.renditions) > 0 else (None,)):
+			rendition_props = Properties.get_profile(props, name) if name is not None else props
+			if output_filename is None or name is not None:
+				output_filename = filename[:filename.rfind('.') + 1] + (name + '.' if name is not None else '') + \
+					rendition_props.output_format
+			temp_filename = output_filename[:output_filename.rfind('.') + 1] + 'part.' + rendition_props.output_format
+			self.renditions.append(Rendition(name, rendition_props.output_dir + os.path.sep + output_filename,
+				rendition_props.output_dir + os.path.sep + temp_filename))
+			template = Properties.get_template(rendition_props)
+			start = template.output_index if len(self.command) > 0 else 0
+			key_command.extend(template.render(filename, output_filename, key_time)[start:])
+			self.command.extend(template.render(filename, temp_filename)[start:])
+		self.output = self.renditions[0].output
+		self.temp_output = self.renditions[0].temp_output
+		self.key_command = ' '.join(key_command)
+		self.preset = Properties.get_preset(props)
+		self.props = props
+		self.returncode = None
+		self.progress = None
+		self.started = None
+		self.ended = None
+		self.slot = None
+		self.parent = None
+		self.parts = None
+		self.audio = None
+		self.priority = 0
+		self.pid = None
+		self.rusage = None
+		self.info = None
+		self.estimate = None
+		self.profile = None
+		self.paused = 0.0
+		self.rendered = (rendering, time.time())
+		self.log = None
+		self.verified = None
+		self.verification = None
+		self.cancelled = False
+	@property
+	def succeeded(self):
+		return self.returncode == 0
+
+class Progress:
+	'''Progress is the class for the state of running ffmpeg, parsed from its "-progress" output.
+	Values which ffmpeg reports as "N/A" stay unchanged.'''
+	def __init__(self):
+		self.frame = 0
+		self.fps = 0.0
+		self.speed = 0.0
+		self.out_time = 0.0
+		self.total_size = 0
+		self.advanced = time.time()
+
+	def update(self, key: str, value: str):
+		try:
+			if key == 'frame':
+				self.frame = int(value)
+			elif key == 'fps':
+				self.fps = float(value)
+			elif key == 'speed':
+				self.speed = float(value.rstrip('x'))
+			elif key == 'out_time_us':
+				if int(value) / 1000000 > self.out_time:
+					self.advanced = time.time()
+				self.out_time = int(value) / 1000000
+			elif key == 'total_size':
+				self.total_size = int(value)
+		except ValueError:
+			pass
+
+class Journal:
+	'''Journal is the class for persistent SQLite journal of jobs. Job is identified by its input path, size,
+	modification time and rendered command, so changing file or parameters makes the job run again.
+	Jobs finished successfully are skipped on the next launch, failed or interrupted ones are run again.'''
+	def __init__(self, filename: str):
+		import sqlite3
+		self._db = sqlite3.connect(filename)
+		self._db.execute('CREATE TABLE IF NOT EXISTS jobs (input TEXT, size INTEGER, mtime_ns INTEGER, command TEXT, '
+			'output TEXT, status TEXT, returncode INTEGER, started REAL, finished REAL, '
+			'PRIMARY KEY (input, size, mtime_ns, command))')
+		self._db.execute('CREATE TABLE IF NOT EXISTS renditions (input TEXT, size INTEGER, mtime_ns INTEGER, '
+			'command TEXT, name TEXT, output TEXT, status TEXT, PRIMARY KEY (input, size, mtime_ns, command, name))')
+		self._db.commit()
+		self._keys = {}
+
+	def _key(self, job: Job, keep: bool = True):
+		'''_key returns the key of the job, it is kept until the job is finished if `keep` is set.'''
+		key = self._keys.get(job)
+		if key is None:
+			stat = os.stat(job.input_path)
+			key = (os.path.abspath(job.input_path), stat.st_size, stat.st_mtime_ns, job.key_command)
+			if keep:
+				self._keys[job] = key
+		return key
+
+	def is_done(self, job: Job):
+		'''is_done returns True if the job was finished successfully before and its outputs still exist.'''
+		try:
+			key = self._key(job, keep=False)
+		except OSError:
+			return False
+		row = self._db.execute('SELECT status, output FROM jobs WHERE input = ? AND size = ? AND mtime_ns = ? '
+			'AND command = ?', key).fetchone()
+		if row is None or row[0] != 'done' or not os.path.isfile(row[1]):
+			return False
+		return all(map(lambda rendition: os.path.isfile(rendition[0]), self._db.execute('SELECT output '
+			'FROM renditions WHERE input = ? AND size = ? AND mtime_ns = ? AND command = ?', key)))
+
+	def start(self, job: Job):
+		try:
+			self._db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, \'running\', NULL, ?, NULL)',
+				(*self._key(job), os.path.abspath(job.output), time.time()))
+		except OSError:
+			return
+		for rendition in filter(lambda rendition: rendition.name is not None, job.renditions):
+			self._db.execute('INSERT OR REPLACE INTO renditions VALUES (?, ?, ?, ?, ?, ?, \'running\')',
+				(*self._key(job), rendition.name, os.path.abspath(rendition.output)))
+		self._db.commit()
+
+	def finish(self, job: Job, status: str):
+		'''finish records final status of the job: "done", "failed" or "interrupted".'''
+		if job not in self._keys:
+			return
+		for rendition in filter(lambda rendition: rendition.name is not None, job.renditions):
+			self._db.execute('UPDATE renditions SET status = ? WHERE input = ? AND size = ? AND mtime_ns = ? '
+				'AND command = ? AND name = ?', (rendition.status or status, *self._keys[job], rendition.name))
+		self._db.execute('UPDATE jobs SET status = ?, returncode = ?, finished = ? WHERE input = ? AND size = ? '
+			'AND mtime_ns = ? AND command = ?', (status, job.returncode, time.time(), *self._keys.pop(job)))
+		self._db.commit()
+
+	def close(self):
+		self._db.close()
+
+PREFLIGHT_DURATION = 1
+PAUSE_INTERVAL = 5
+LOG_LINE_LENGTH = 1000
+PARKED_JOBS = 10000
+
+async def preflight_job(props: Properties, job: Job):
+	'''preflight_job runs ffmpeg command of the job on the first PREFLIGHT_DURATION seconds of input with outputs
+	replaced by null muxer. It returns None if ffmpeg has succeeded, or the reason of failure.'''
+	command = list(job.command)
+	for rendition in job.renditions:
+		if rendition.temp_output in command:
+			index = command.index(rendition.temp_output)
+			command[index:index + 1] = ['-t', str(PREFLIGHT_DURATION), '-f', 'null', '-']
+	try:
+		process = await asyncio.create_subprocess_exec(command[0], '-v', 'error', '-nostdin', *command[1:],
+			stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+	except OSError as exc:
+		return f'ffmpeg could not be launched: \'{exc}\''
+	_, errors = await process.communicate()
+	if process.returncode != 0:
+		lines = errors.decode(errors='replace').strip().splitlines()
+		return f'ffmpeg has failed with exit code {process.returncode}' + (f': {lines[-1]}' if len(lines) > 0 else '')
+	return None
+
+async def verify_output(props: Properties, info: dict, path: str, **limits):
+	'''verify_output checks the output file: its duration should differ from duration of input (`info` is ffprobe
+	description of input, if it is None, duration is not checked) by no more than `verify_tolerance` seconds, and
+	in "decode" mode ffmpeg should decode it to null muxer without errors. `limits` are additional arguments for
+	subprocesses. It returns None if the file has passed, or the reason of failure.'''
+	if not os.path.isfile(path):
+		return 'output is missing'
+	output = await probe_file(props, path, **limits)
+	if output is None:
+		return 'output cannot be probed'
+	expected, duration = get_duration(info), get_duration(output)
+	if expected is not None:
+		if duration is None:
+			return 'duration of output is unknown'
+		if abs(duration - expected) > props.verify_tolerance:
+			return f'duration of output is {duration:.2f} s while input has {expected:.2f} s'
+	if props.verify != 'decode':
+		return None
+	try:
+		process = await asyncio.create_subprocess_exec(props.ffmpeg_path, '-v', 'error', '-xerror', '-nostdin',
+			'-i', path, '-f', 'null', '-',
+			stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE, **limits)
+	except OSError as exc:
+		return f'ffmpeg could not be launched: \'{exc}\''
+	error = ''
+	try:
+		while True:
+			line = await process.stderr.readline()
+			if not line:
+				break
+			error = line.decode(errors='replace').strip()[:LOG_LINE_LENGTH] or error
+		await process.wait()
+	except asyncio.CancelledError:
+		if process.returncode is None:
+			process.kill()
+		raise
+	if process.returncode != 0 or error != '':
+		return f'decoding has failed with exit code {process.returncode}' + (f': {error}' if error != '' else '')
+	return None
+
+def preflight(props: Properties, files: tuple):
+	'''preflight probes the files and runs ffmpeg command for each of them on a short slice (see preflight_job),
+	`probe_threads` at one time. Files which are already finished according to the journal are not checked.
+	It returns pair of lists: files which have passed and files which have failed (they are reported).'''
+	journal = Journal(props.journal) if props.journal != '' else None
+	try:
+		jobs = tuple(filter(lambda job: journal is None or not journal.is_done(job),
+			map(lambda item: Job(props, item[0], item[1]), enumerate(files, 1))))
+	finally:
+		if journal is not None:
+			journal.close()
+	print(f'Preflight of {len(jobs)} files')
+	infos = run_loop(get_metadata(props, tuple(map(lambda job: job.input_path, jobs))))
+	semaphore = asyncio.Semaphore(props.probe_threads)
+	async def check(job, info):
+		if info is None:
+			return 'file cannot be probed'
+		if len(info.get('streams', [])) == 0:
+			return 'file has no streams'
+		async with semaphore:
+			return await preflight_job(props, job)
+	async def check_all():
+		return await asyncio.gather(*map(check, jobs, infos))
+	failed = []
+	for job, reason in zip(jobs, run_loop(check_all())):
+		if reason is not None:
+			print(f'Warning: \'{job.filename}\' has failed preflight: {reason}')
+			failed.append(job.filename)
+	rejected = set(failed)
+	return list(filter(lambda filename: filename not in rejected, files)), failed
+
+class Trace:
+	'''Trace is the class for timeline of the queue in Chrome trace-event format (JSON array of events), which can be
+	opened in Perfetto or chrome://tracing. Each phase is a complete event on its named track (shown as a thread),
+	events are written to the file as soon as the phase is finished.'''
+	def __init__(self, filename: str):
+		self._file = open(filename, 'w', encoding='utf-8')
+		self._file.write('[')
+		self._tracks = {}
+		self._separator = '\n'
+
+	def _write(self, event: dict):
+		self._file.write(self._separator + json.dumps(event))
+		self._separator = ',\n'
+
+	def _track(self, name: str):
+		'''_track returns id of the track, new track is named and ordered as it has appeared.'''
+		if name not in self._tracks:
+			self._tracks[name] = len(self._tracks)
+			self._write({'ph': 'M', 'name': 'thread_name', 'pid': os.getpid(), 'tid': self._tracks[name],
+				'args': {'name': name}})
+			self._write({'ph': 'M', 'name': 'thread_sort_index', 'pid': os.getpid(), 'tid': self._tracks[name],
+				'args': {'sort_index': self._tracks[name]}})
+		return self._tracks[name]
+
+	def span(self, name: str, track: str, start: float, end: float, **args):
+		'''span records the phase from start to end (seconds since epoch) on the track.'''
+		self._write({'ph': 'X', 'name': name, 'cat': track.split()[0], 'pid': os.getpid(), 'tid': self._track(track),
+			'ts': round(start * 1000000), 'dur': max(0, round((end - start) * 1000000)), 'args': args})
+
+	def close(self):
+		self._file.write('\n]\n')
+		self._file.close()
+
+class Metrics:
+	'''Metrics is the class for export of resource usage of finished jobs: each job is appended to JSON-lines file
+	(`filename`), and totals by preset (output parameters or renditions of the job) are written to Prometheus text
+	format file (`textfile`). Any of them can be None.'''
+	def __init__(self, filename: str, textfile: str):
+		self.filename = filename
+		self.textfile = textfile
+		self._totals = {}
+		self._last = None
+
+	def record(self, job: Job):
+		'''record exports resource usage of the finished job.'''
+		try:
+			input_bytes = os.path.getsize(job.input_path)
+		except OSError:
+			input_bytes = None
+		outputs = tuple(filter(os.path.isfile, map(lambda rendition: rendition.output, job.renditions)))
+		output_bytes = sum(map(os.path.getsize, outputs)) if len(outputs) > 0 else None
+		usage = job.rusage
+		entry = {'job': job.number, 'filename': job.filename, 'preset': job.preset, 'returncode': job.returncode,
+			'started': job.started, 'ended': job.ended,
+			'wall': job.ended - job.started if job.started is not None and job.ended is not None else None,
+			'paused': job.paused,
+			'user_cpu': usage.ru_utime if usage is not None else None,
+			'system_cpu': usage.ru_stime if usage is not None else None,
+			'max_rss': usage.ru_maxrss * (1 if os.sys.platform == 'darwin' else 1024) if usage is not None else None,
+			'input_bytes': input_bytes, 'output_bytes': output_bytes,
+			'compression_ratio': output_bytes / input_bytes if output_bytes is not None and input_bytes else None,
+			'outputs': list(outputs)}
+		if self.filename is not None:
+			with open(self.filename, 'a', encoding='utf-8') as f:
+				f.write(json.dumps(entry) + '\n')
+		if self.textfile is not None:
+			totals = self._totals.setdefault(job.preset, {'succeeded': 0, 'failed': 0, 'wall': 0.0, 'user_cpu': 0.0,
+				'system_cpu': 0.0, 'input_bytes': 0, 'output_bytes': 0, 'max_rss': 0})
+			totals['succeeded' if job.succeeded else 'failed'] += 1
+			for key in ('wall', 'user_cpu', 'system_cpu', 'input_bytes', 'output_bytes'):
+				totals[key] += entry[key] or 0
+			totals['max_rss'] = max(totals['max_rss'], entry['max_rss'] or 0)
+			self._last = job.ended
+			self._write_textfile()
+
+	def _write_textfile(self):
+		'''_write_textfile replaces Prometheus file at once, so collector never reads half-written one.'''
+		metrics = (
+			('jobs_total', 'counter', 'Finished jobs by result'),
+			('wall_seconds_total', 'counter', 'Wall time of finished jobs', 'wall'),
+			('user_cpu_seconds_total', 'counter', 'User CPU time of ffmpegs of finished jobs', 'user_cpu'),
+			('system_cpu_seconds_total', 'counter', 'System CPU time of ffmpegs of finished jobs', 'system_cpu'),
+			('input_bytes_total', 'counter', 'Size of input files of finished jobs', 'input_bytes'),
+			('output_bytes_total', 'counter', 'Size of output files of finished jobs', 'output_bytes'),
+			('max_rss_bytes', 'gauge', 'Peak resident set size of ffmpeg among finished jobs', 'max_rss'))
+		lines = []
+		for name, kind, description, *key in metrics:
+			lines += [f'# HELP ffmpeg_queue_{name} {description}.', f'# TYPE ffmpeg_queue_{name} {kind}']
+			for preset, totals in self._totals.items():
+				label = 'preset="' + preset.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+				if len(key) == 0:
+					lines += [f'ffmpeg_queue_{name}{{{label},result="{result}"}} {totals[result]}'
+						for result in ('succeeded', 'failed')]
+				else:
+					lines.append(f'ffmpeg_queue_{name}{{{label}}} {totals[key[0]]}')
+		lines += ['# HELP ffmpeg_queue_last_job_timestamp_seconds Time when the last job was finished.',
+			'# TYPE ffmpeg_queue_last_job_timestamp_seconds gauge', f'ffmpeg_queue_last_job_timestamp_seconds {self._last}']
+		temp = f'{self.textfile}.{os.getpid()}.tmp'
+		with open(temp, 'w', encoding='utf-8') as f:
+			f.write('\n'.join(lines) + '\n')
+		os.replace(temp, self.textfile)
+
+class Child:
+	'''Child is the class for launched ffmpeg. On POSIX it is not watched by asyncio: it is reaped by os.wait4
+	in a separate thread, so its resource usage (rusage: user and system CPU time, peak RSS) becomes known.
+	Elsewhere asyncio subprocess is used, and rusage stays None.'''
+	def __init__(self):
+		self.pid = None
+		self.stdout = None
+		self.stderr = None
+		self.returncode = None
+		self.rusage = None
+		self._process = None
+		self._reaped = None
+		self._transports = []
+
+	@staticmethod
+	async def start(command: list, **kwargs):
+		'''start launches the command with arguments of subprocess.Popen and returns Child,
+		stdout and stderr of which are asyncio.StreamReader if they are pipes.'''
+		child = Child()
+		if not hasattr(os, 'wait4'):
+			child._process = await asyncio.create_subprocess_exec(*command, **kwargs)
+			child.pid = child._process.pid
+			child.stdout = child._process.stdout
+			child.stderr = child._process.stderr
+			return child
+		import threading
+		loop = asyncio.get_event_loop()
+		child._process = subprocess.Popen(command, **kwargs)
+		child.pid = child._process.pid
+		child._reaped = loop.create_future()
+		def reap():
+			try:
+				_, status, rusage = os.wait4(child.pid, 0)
+			except ChildProcessError:
+				status, rusage = 255 << 8, None
+			loop.call_soon_threadsafe(child._set_reaped, status, rusage)
+		threading.Thread(target=reap, daemon=True).start()
+		for name in ('stdout', 'stderr'):
+			pipe = getattr(child._process, name)
+			if pipe is not None:
+				reader = asyncio.StreamReader()
+				transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+				child._transports.append(transport)
+				setattr(child, name, reader)
+		return child
+
+	def _set_reaped(self, status: int, rusage):
+		self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+		self.rusage = rusage
+		# Popen must not wait for the process which is already reaped
+		self._process.returncode = self.returncode
+		if not self._reaped.done():
+			self._reaped.set_result(None)
+
+	async def wait(self):
+		'''wait waits for the process to exit and returns its exit code.'''
+		if self._reaped is None:
+			self.returncode = await self._process.wait()
+			return self.returncode
+		await asyncio.shield(self._reaped)
+		for transport in self._transports:
+			transport.close()
+		return self.returncode
+
+	def terminate(self):
+		if self.returncode is not None:
+			return
+		if self._reaped is None:
+			self._process.terminate()
+		else:
+			import signal
+			os.kill(self.pid, signal.SIGTERM)
+
+class JobLog:
+	'''JobLog is the class for output of ffmpeg of one job. It is written to the file `path` (if it is not None),
+	which is rotated when it grows over `size` bytes (0 for no limit): previous part is kept as "<path>.1".
+	Last `lines` lines are kept in memory as `tail`, each of them no longer than LOG_LINE_LENGTH characters, and
+	a line ended by carriage return (like status line of ffmpeg) replaces the previous one of that kind, as it does
+	in console. So memory taken by the log stays the same however long the job runs.'''
+	def __init__(self, path: str, size: int, lines: int):
+		import codecs
+		from collections import deque
+		self.path = path
+		self.size = size
+		self.tail = deque(maxlen=lines)
+		self._file = None
+		self._written = 0
+		self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+		self._line = ''
+		self._status = False
+		if path is not None:
+			try:
+				os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+				if os.path.exists(path + '.1'):
+					os.remove(path + '.1')
+				self._file = open(path, 'wb')
+			except OSError as exc:
+				print(f'Warning: Log file \'{path}\' could not be opened: \'{exc}\'')
+				self.path = None
+
+	def write(self, data: bytes):
+		'''write appends the chunk of output to the file and to the tail.'''
+		if self._file is not None:
+			try:
+				if self.size > 0 and self._written > 0 and self._written + len(data) > self.size:
+					self._file.close()
+					os.replace(self.path, self.path + '.1')
+					self._file = open(self.path, 'wb')
+					self._written = 0
+				self._file.write(data)
+				self._written += len(data)
+			except OSError as exc:
+				print(f'Warning: Log file \'{self.path}\' could not be written: \'{exc}\'')
+				self._file.close()
+				self._file = None
+		if self.tail.maxlen == 0:
+			return
+		text = self._line + self._decoder.decode(data)
+		start = 0
+		for end, char in enumerate(text):
+			if char in '\r\n':
+				self._add(text[start:end], char == '\r')
+				start = end + 1
+		self._line = text[start:start + LOG_LINE_LENGTH]
+
+	def _add(self, line: str, status: bool):
+		if line == '':
+			return
+		line = line[:LOG_LINE_LENGTH]
+		if status and self._status and len(self.tail) > 0:
+			self.tail[-1] = line
+		else:
+			self.tail.append(line)
+		self._status = status
+
+	def close(self):
+		if self.tail.maxlen != 0:
+			self._add((self._line + self._decoder.decode(b'', final=True))[:LOG_LINE_LENGTH], False)
+			self._line = ''
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+class Stager:
+	'''Stager is the class for jobs staged on local scratch directory. Input of the job is copied to scratch
+	before it is launched and the job command reads it from there, temporary outputs are written to scratch too
+	and are moved to output directory by upload after the job. Space of staged jobs (input and output of the job
+	counted as large as input) is limited by `budget` bytes, but one job is staged anyway. Copies from and to
+	one device (st_dev of the file on slow storage) go no more than `io_threads` at one time.'''
+	def __init__(self, directory: str, budget: int, io_threads: int):
+		self.directory = directory
+		self.budget = budget
+		self.io_threads = io_threads
+		self.used = 0
+		self.jobs = {}
+		self._devices = {}
+		self._freed = asyncio.Event()
+
+	async def _copy(self, source: str, destination: str, remote: str):
+		'''_copy copies the file in a separate thread, limited by the device of remote path.'''
+		import shutil
+		device = os.stat(remote).st_dev
+		if device not in self._devices:
+			self._devices[device] = asyncio.Semaphore(self.io_threads)
+		async with self._devices[device]:
+			await asyncio.get_event_loop().run_in_executor(None, shutil.copyfile, source, destination)
+
+	async def stage(self, job: Job):
+		'''stage waits for space on scratch, copies input of the job there and changes the job command
+		and temporary outputs to the scratch ones. Input is not copied if the command doesn't contain its path.'''
+		size = os.path.getsize(job.input_path)
+		reserved = 2 * size if job.input_path in job.command else size
+		while self.used > 0 and self.used + reserved > self.budget:
+			self._freed.clear()
+			await self._freed.wait()
+		directory = os.path.join(self.directory, f'{os.getpid()}-{job.number}')
+		self.used += reserved
+		self.jobs[job] = (directory, reserved, tuple(map(lambda rendition: rendition.temp_output, job.renditions)))
+		try:
+			os.makedirs(os.path.join(directory, 'output'), exist_ok=True)
+			replaced = {}
+			if job.input_path in job.command:
+				replaced[job.input_path] = os.path.join(directory, os.path.basename(job.input_path))
+				await self._copy(job.input_path, replaced[job.input_path], job.input_path)
+			for rendition in job.renditions:
+				if rendition.temp_output in job.command:
+					replaced[rendition.temp_output] = os.path.join(directory, 'output',
+						os.path.basename(rendition.temp_output))
+					rendition.temp_output = replaced[rendition.temp_output]
+		except BaseException:
+			self.release(job)
+			raise
+		job.command = [replaced.get(arg, arg) for arg in job.command]
+		job.temp_output = job.renditions[0].temp_output
+
+	async def upload(self, job: Job):
+		'''upload copies temporary outputs of the job from scratch to their places in output directory,
+		so the job can be finished as usual.'''
+		_, _, temp_outputs = self.jobs[job]
+		for rendition, temp_output in zip(job.renditions, temp_outputs):
+			if rendition.temp_output != temp_output and os.path.isfile(rendition.temp_output):
+				os.makedirs(os.path.dirname(temp_output) or '.', exist_ok=True)
+				await self._copy(rendition.temp_output, temp_output, os.path.dirname(temp_output) or '.')
+				os.remove(rendition.temp_output)
+				rendition.temp_output = temp_output
+		job.temp_output = job.renditions[0].temp_output
+
+	def release(self, job: Job):
+		'''release deletes scratch files of the job and frees its space.'''
+		import shutil
+		if job not in self.jobs:
+			return
+		directory, reserved, _ = self.jobs.pop(job)
+		shutil.rmtree(directory, ignore_errors=True)
+		self.used -= reserved
+		self._freed.set()
+
+class Tally:
+	'''Tally is the class for summary of finished jobs, which takes the same memory however many jobs there are:
+	only numbers of finished, succeeded and verified jobs and total wall time of succeeded ones are counted, jobs
+	themselves are kept only if they have failed (`failed`) or their outputs have failed verification (`unverified`).
+	Jobs cancelled by control command are only counted (`cancelled`), they are not failures.
+	len() of Tally is the number of finished jobs.'''
+	def __init__(self):
+		self.count = 0
+		self.cancelled = 0
+		self.succeeded = 0
+		self.wall = 0.0
+		self.verified = 0
+		self.failed = []
+		self.unverified = []
+
+	def __len__(self):
+		return self.count
+
+	def add(self, job: Job):
+		self.count += 1
+		if job.cancelled:
+			self.cancelled += 1
+			return
+		if not job.succeeded:
+			self.failed.append(job)
+			return
+		self.succeeded += 1
+		if job.started is not None and job.ended is not None:
+			self.wall += job.ended - job.started
+
+	def remove(self, job: Job):
+		'''remove takes back the finished job which is not counted anymore.'''
+		self.count -= 1
+		if job.cancelled:
+			self.cancelled -= 1
+			return
+		if not job.succeeded:
+			self.failed.remove(job)
+			return
+		self.succeeded -= 1
+		if job.started is not None and job.ended is not None:
+			self.wall -= job.ended - job.started
+
+	def verify(self, job: Job):
+		'''verify counts result of verification of the finished job.'''
+		self.verified += 1
+		if not job.verified:
+			self.unverified.append(job)
+
+class JobQueue:
+	'''JobQueue is the class for jobs waiting for free thread, ordered by priority (higher first) and then by the
+	order of putting. Jobs put from the iterable of jobs are limited by `size`, so it is read lazily, and jobs put
+	by control commands are not limited. After the last job of the iterable the queue is closed, and get returns
+	None when closed queue is empty, unless `keep_open` (if it is set) returns True: then get waits for jobs put
+	by control commands until keep_open turns False (notify should be called then). When get with accept finds
+	no job which can be launched now, such jobs are parked: up to `parked` of them are not counted in `size`
+	anymore, so the jobs behind them (like ones of another profile) can be put and launched.'''
+	def __init__(self, size: int, parked: int = 0):
+		self.size = size
+		self.parked = parked
+		self.closed = False
+		self.keep_open = None
+		self._heap = []
+		self._count = 0
+		self._fed = 0
+		self._parked = set()
+		self._changed = asyncio.Event()
+
+	async def put(self, job: Job, fed: bool = True):
+		while fed and self._fed >= self.size:
+			self._changed.clear()
+			await self._changed.wait()
+		self.put_nowait(job, fed)
+
+	def put_nowait(self, job: Job, fed: bool = False):
+		'''put_nowait puts the job without waiting, it is meant for jobs which are not limited by `size`.'''
+		import heapq
+		heapq.heappush(self._heap, (-job.priority, self._count, job, fed))
+		self._count += 1
+		self._fed += 1 if fed else 0
+		self._changed.set()
+
+	async def get(self, accept = None):
+		'''get returns the first job, or the first one for which accept returns True if it is given. Then it waits
+		for such job to be put (or for notify), and None is returned when closed queue is empty.'''
+		import heapq
+		while True:
+			if len(self._heap) == 0 and self.closed and (self.keep_open is None or not self.keep_open()):
+				return None
+			entry = next(filter(lambda entry: accept(entry[2]), sorted(self._heap)), None) if accept is not None \
+				else self._heap[0] if len(self._heap) > 0 else None
+			if entry is not None:
+				break
+			self._park()
+			self._changed.clear()
+			await self._changed.wait()
+		if entry is self._heap[0]:
+			heapq.heappop(self._heap)
+		else:
+			self._heap.remove(entry)
+			heapq.heapify(self._heap)
+		self._forget(entry)
+		return entry[2]
+
+	def _park(self):
+		'''_park stops counting the queued jobs put from the iterable in `size`, up to `parked` of them.'''
+		for i, entry in enumerate(self._heap):
+			if len(self._parked) >= self.parked:
+				break
+			if entry[3]:
+				self._heap[i] = (*entry[:3], False)
+				self._parked.add(entry[2])
+				self._fed -= 1
+		self._changed.set()
+
+	def _forget(self, entry: tuple):
+		self._fed -= 1 if entry[3] else 0
+		self._parked.discard(entry[2])
+		self._changed.set()
+
+	def notify(self):
+		'''notify makes waiting get check the jobs again, as its accept can give another answer now.'''
+		self._changed.set()
+
+	def close(self):
+		self.closed = True
+		self._changed.set()
+
+	def clear(self):
+		self._heap.clear()
+		self._fed = 0
+		self._parked.clear()
+		self._changed.set()
+
+	def jobs(self):
+		return list(map(lambda entry: entry[2], sorted(self._heap)))
+
+	def remove(self, job: Job):
+		'''remove takes the job out of the queue, returns False if it is not queued.'''
+		import heapq
+		for i, entry in enumerate(self._heap):
+			if entry[2] is job:
+				self._heap[i] = self._heap[-1]
+				self._heap.pop()
+				heapq.heapify(self._heap)
+				self._forget(entry)
+				return True
+		return False
+
+	def reprioritize(self, job: Job, priority: int):
+		'''reprioritize changes priority of the queued job, keeping its order among jobs with the same priority.'''
+		import heapq
+		for i, entry in enumerate(self._heap):
+			if entry[2] is job:
+				job.priority = priority
+				self._heap[i] = (-priority, *entry[1:])
+				heapq.heapify(self._heap)
+				return True
+		return False
+
+class Scheduler:
+	'''Scheduler is the class which launches jobs as child processes of one asyncio event loop.
+	No more than `threads` ffmpegs are running at one time, and in adaptive mode this number is tuned during
+	the run. When there is only one thread, ffmpeg is attached to the console just like it was launched by hand,
+	otherwise its input and output are detached.'''
+	def __init__(self, props: Properties):
+		self.props = props
+		self.threads = max(1, props.threads)
+		self.attached = self.threads == 1 and not props.adaptive
+		self.encoded = 0.0
+		self._resized = None
+		self._slots = set()
+		self._cpus = {}
+		self._ioprio = ioprio_setter(props.ionice)
+		if props.affinity and not hasattr(os, 'sched_setaffinity'):
+			print(f'Warning: CPU affinity is not supported on {os.sys.platform}, it is ignored')
+		self.total = None
+		self.finished = Tally()
+		self.skipped = 0
+		self._skipped_parents = set()
+		self.queued = 0
+		self.running = set()
+		self.journal = None
+		self.feed_size = max(32, 2 * self.threads)
+		self._tasks = {}
+		self._queue = None
+		self._draining = False
+		self._added = 0
+		self.metrics = None
+		self.history = None
+		self.trace = None
+		self._stager = None
+		self._staged = None
+		self._uploads = set()
+		self._staging = 0
+		self._server = None
+		self._dispatching = False
+		self._verifications = set()
+		self._verify_pool = None
+		self._verify_limits = None
+		self._profile_jobs = {}
+		self._paused = None
+		self._paused_at = None
+		self._resumed = None
+		self._capped = props.max_jobs > 0 or any(map(lambda profile: 'max_jobs' in profile, props._profiles.values()))
+
+	async def run_job(self, job: Job):
+		'''run_job launches one job, waits for it to finish and reports its exit status.'''
+		begun = time.time()
+		if job.parent is None and any(map(lambda props: props.copy_video != '' or props.copy_audio != '',
+				(job.props, *map(lambda name: Properties.get_profile(job.props, name), job.props.renditions)))):
+			await self._stream_copy(job)
+		print(f'{time.ctime()}: Job {job.number}{" (" + job.filename + ")" if job.parent is not None else ""}: ' \
+			f'[[{" ".join(job.command)}]]')
+		for rendition in job.renditions:
+			if os.path.exists(rendition.temp_output):
+				os.remove(rendition.temp_output)
+			os.makedirs(os.path.dirname(rendition.temp_output) or '.', exist_ok=True)
+		job.slot = min(set(range(len(self._slots) + 1)) - self._slots)
+		self._slots.add(job.slot)
+		if self.props.affinity and hasattr(os, 'sched_setaffinity'):
+			self._cpus[job.slot] = slot_cpus(self.threads, tuple(self._cpus.values()))
+		if job.parent is None:
+			if self.journal is not None:
+				self.journal.start(job)
+		elif job.parent.started is None:
+			job.parent.started = time.time()
+			if self.journal is not None:
+				self.journal.start(job.parent)
+		if self.attached:
+			change_title(f'[{job.number} / {self.total or "?"}] ({job.filename}), {self.props.finish}')
+			streams = {}
+		else:
+			streams = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL}
+		if job.props.logs != '' or job.props.log_lines > 0:
+			streams['stderr'] = asyncio.subprocess.PIPE
+		command = job.command
+		if self.props.progress > 0 or self.props.adaptive:
+			command = [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+			streams['stdout'] = asyncio.subprocess.PIPE
+		command, limits = self._limit(job, command)
+		describe = None
+		if self.history is not None and job.parent is None and job.parts is None:
+			describe = asyncio.ensure_future(self._describe(job))
+		job.started = time.time()
+		track = f'slot {job.slot}'
+		self._span('prepare', track, begun, job.started, job=job.number, filename=job.filename)
+		try:
+			process = await Child.start(command, **streams, **limits)
+		except OSError as exc:
+			self._span('spawn', track, job.started, time.time(), job=job.number, error=str(exc))
+			if describe is not None:
+				describe.cancel()
+			job.returncode = -1
+			self.finish_job(job)
+			print(f'{time.ctime()}: Job {job.number} could not be launched: \'{exc}\'')
+			if job.parent is not None:
+				await self._join(job.parent)
+			return
+		spawned = time.time()
+		self._span('spawn', track, job.started, spawned, job=job.number, pid=process.pid)
+		job.progress = Progress()
+		job.pid = process.pid
+		self.running.add(job)
+		if self._paused is not None:
+			self._signal(job, 'SIGSTOP')
+		readers = []
+		if process.stdout is not None:
+			readers.append(self._read_progress(job, process.stdout))
+		if process.stderr is not None:
+			job.log = JobLog(os.path.join(job.props.logs, f'{job.number}-' + job.filename.replace('/', '_') \
+				.replace(os.path.sep, '_') + '.log') if job.props.logs != '' else None,
+				int(job.props.log_size * 1024 * 1024), job.props.log_lines)
+			readers.append(self._read_log(job, process.stderr))
+		try:
+			await asyncio.gather(*readers)
+			job.returncode = await process.wait()
+		except asyncio.CancelledError:
+			if describe is not None:
+				describe.cancel()
+			if process.returncode is None:
+				self._terminate(job, process)
+			job.returncode = await process.wait()
+			job.rusage = process.rusage
+			self._span('encode', track, spawned, time.time(), job=job.number, returncode=job.returncode,
+				interrupted=True)
+			self.finish_job(job, interrupted=True)
+			if job.parent is not None and job.parent.cancelled:
+				self._end_segmented(job.parent)
+			raise
+		finally:
+			self.running.discard(job)
+			if job.log is not None:
+				job.log.close()
+		encoded = time.time()
+		self._span('encode', track, spawned, encoded, job=job.number, returncode=job.returncode, paused=job.paused)
+		job.rusage = process.rusage
+		if describe is not None:
+			await describe
+			if job.succeeded and job.info is not None:
+				self.history.record(job.preset, job.info, time.time() - job.started - job.paused)
+		if self._stager is not None and job in self._stager.jobs:
+			self._free_slot(job)
+			job.slot = None
+			upload = asyncio.ensure_future(self._upload(job))
+			self._uploads.add(upload)
+			upload.add_done_callback(self._uploads.discard)
+			upload.add_done_callback(lambda upload: self._queue.notify())
+			self._span('post-process', track, encoded, time.time(), job=job.number)
+			return
+		self.finish_job(job)
+		self._print_finished(job)
+		self._span('post-process', track, encoded, time.time(), job=job.number)
+		if job.parent is not None:
+			await self._join(job.parent)
+
+	async def _describe(self, job: Job):
+		'''_describe gets ffprobe description of input of the job (from metadata cache if it is there) and its
+		expected wall time from history.'''
+		if job.info is None:
+			job.info = (await get_metadata(job.props, [job.input_path], quiet=True))[0]
+		if job.info is not None:
+			job.estimate = self.history.estimate(job.preset, job.info)
+
+	async def _stream_copy(self, job: Job):
+		'''_stream_copy probes input of the job and changes output part of the command of each rendition, so the
+		streams which match constraints of stream copy (see copied_streams) are copied without encoding: "-c:v copy"
+		or "-c:a copy" is put before output file and codec and filters of these streams are dropped. Command with
+		complex filtergraph or without temporary outputs (changed parameters order) is kept as it is.'''
+		if job.info is None:
+			job.info = (await get_metadata(job.props, [job.input_path], quiet=True))[0]
+		command = job.command
+		if '-filter_complex' in command or '-lavfi' in command or \
+				any(map(lambda rendition: rendition.temp_output not in command, job.renditions)):
+			return
+		start = Properties.get_template(job.props).output_index
+		copied = set()
+		for rendition in job.renditions:
+			end = command.index(rendition.temp_output)
+			output = command[start:end]
+			kinds = copied_streams(Properties.get_profile(job.props, rendition.name) if rendition.name is not None
+				else job.props, job.info)
+			for kind in kinds:
+				dropped = COPY_DROPPED[kind]
+				output = [arg for i, arg in enumerate(output) if arg not in dropped and
+					(i == 0 or output[i - 1] not in dropped)]
+				output += [f'-c:{kind[0]}', 'copy']
+			command = [*command[:start], *output, *command[end:]]
+			start = command.index(rendition.temp_output) + 1
+			copied.update(kinds)
+		if len(copied) > 0:
+			job.command = command
+			job.preset = f'{job.preset} ({" and ".join(sorted(copied, reverse=True))} copy)'
+			print(f'{time.ctime()}: Job {job.number} ({job.filename}): {" and ".join(sorted(copied, reverse=True))} ' \
+				f'streams match the target, they are copied')
+
+	def _remaining(self, job: Job):
+		'''_remaining returns the number of seconds left until the running job is finished, or None if it is
+		unknown. It is taken from progress of ffmpeg if duration of input is known, otherwise from history.'''
+		duration = get_duration(job.info)
+		if job.progress is not None and duration is not None and job.progress.out_time > 0 and job.progress.speed > 0:
+			return max(0.0, duration - job.progress.out_time) / job.progress.speed
+		if job.estimate is not None:
+			return max(0.0, job.estimate - (time.time() - job.started))
+		return None
+
+	def _span(self, name: str, track: str, start: float, end: float, **args):
+		if self.trace is not None:
+			self.trace.span(name, track, start, end, **args)
+
+	def _print_finished(self, job: Job):
+		print(f'{time.ctime()}: Job {job.number}{" (" + job.filename + ")" if job.parent is not None else ""} ' \
+			f'is finished with exit code {job.returncode}')
+		if job.renditions[0].name is not None:
+			for rendition in job.renditions:
+				print(f'\tRendition {rendition.name}: {rendition.status}, \'{rendition.output}\'')
+		if not job.succeeded and job.log is not None and len(job.log.tail) > 0:
+			print(f'\tLast lines of ffmpeg output{" (" + job.log.path + ")" if job.log.path is not None else ""}:')
+			for line in job.log.tail:
+				print(f'\t\t{line}')
+		job.log = None
+
+	async def _upload(self, job: Job):
+		'''_upload moves outputs of the staged job from scratch to output directory (if it has succeeded),
+		and finishes the job (its scratch space is freed then). Slot of the job is already free at this point.'''
+		uploading = time.time()
+		try:
+			if job.succeeded:
+				await self._stager.upload(job)
+				self._span('upload', 'upload', uploading, time.time(), job=job.number)
+		except asyncio.CancelledError:
+			self.finish_job(job, interrupted=True)
+			raise
+		except OSError as exc:
+			print(f'{time.ctime()}: Outputs of job {job.number} could not be moved to output directory: \'{exc}\'')
+			job.returncode = -1
+		self.finish_job(job)
+		self._print_finished(job)
+
+	async def _join(self, job: Job):
+		'''_join finishes the job split into segments after all of its parts are finished: encoded segments are
+		joined with concat demuxer (and encoded audio is added) to temporary output of the job.'''
+		if any(map(lambda part: part.returncode is None, job.parts)):
+			return
+		joining = time.time()
+		directory = os.path.dirname(job.parts[-1].output)
+		if all(map(lambda part: part.succeeded, job.parts)):
+			listfile = os.path.join(directory, 'concat.txt')
+			with open(listfile, 'w', encoding='utf-8') as f:
+				for part in job.parts:
+					if part is not job.audio:
+						path = os.path.abspath(part.output).replace("'", "'\\''")
+						f.write(f"file '{path}'\n")
+			command = [self.props.ffmpeg_path, '-v', 'error', '-nostats', '-f', 'concat', '-safe', '0', '-i', listfile]
+			if job.audio is not None:
+				command += ['-i', job.audio.output, '-map', '0:v', '-map', '1:a']
+			command += ['-c', 'copy', job.temp_output]
+			print(f'{time.ctime()}: Job {job.number}: joining segments [[{" ".join(command)}]]')
+			try:
+				process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL)
+				job.returncode = await process.wait()
+			except OSError as exc:
+				print(f'{time.ctime()}: Job {job.number} could not be joined: \'{exc}\'')
+				job.returncode = -1
+		self._end_segmented(job, joining)
+
+	def _end_segmented(self, job: Job, joining: float = None):
+		'''_end_segmented finishes the job split into segments after all of its parts are finished (or dropped, if
+		the job is cancelled): it fails with exit code of the first failed part, and directory of segments is
+		deleted.'''
+		import shutil
+		if any(map(lambda part: part.returncode is None, job.parts)):
+			return
+		failed = tuple(filter(lambda part: not part.succeeded, job.parts))
+		if len(failed) > 0:
+			job.returncode = failed[0].returncode
+		shutil.rmtree(os.path.dirname(job.parts[-1].output), ignore_errors=True)
+		self.finish_job(job, interrupted=job.cancelled)
+		if joining is not None:
+			self._span('join', 'queue', joining, time.time(), job=job.number, returncode=job.returncode)
+		if job.cancelled:
+			print(f'{time.ctime()}: Job {job.number} is cancelled')
+		else:
+			print(f'{time.ctime()}: Job {job.number} is finished with exit code {job.returncode}')
+
+	def _drop_part(self, job: Job):
+		'''_drop_part marks the part of cancelled job which is not run as failed, the job is finished after
+		its last part.'''
+		job.returncode = -1
+		job.cancelled = True
+		self._end_segmented(job.parent)
+
+	def _terminate(self, job: Job, process: Child):
+		'''_terminate stops ffmpeg of the job, with its process group if ffmpeg is detached from the console.
+		Suspended ffmpeg is resumed, so it gets the signal.'''
+		if os.sys.platform != 'win32' and not self.attached:
+			self._signal(job, 'SIGTERM')
+		else:
+			process.terminate()
+		if self._paused is not None:
+			self._signal(job, 'SIGCONT')
+
+	def _signal(self, job: Job, name: str):
+		'''_signal sends the signal to ffmpeg of the job, to its process group if ffmpeg is detached (POSIX only).'''
+		import signal
+		try:
+			if self.attached:
+				os.kill(job.pid, getattr(signal, name))
+			else:
+				os.killpg(job.pid, getattr(signal, name))
+		except OSError:
+			pass
+
+	def _free_slot(self, job: Job):
+		'''_free_slot frees the slot of the job with its CPUs.'''
+		self._slots.discard(job.slot)
+		self._cpus.pop(job.slot, None)
+
+	def _limit(self, job: Job, command: list):
+		'''_limit returns command and additional arguments for subprocess, which pin the job to the CPUs of its slot
+		(with the same number in "-threads" for ffmpeg, if it is not set already) and set its nice and ionice.
+		CPUs are given to the slot when it is taken (see slot_cpus), so they don't overlap with CPUs of running
+		slots when the number of threads is changed. Detached ffmpeg gets its own process group, so it can be
+		stopped with all of its children.'''
+		limits = {}
+		if os.sys.platform != 'win32' and not self.attached:
+			limits['start_new_session'] = True
+		cpus = self._cpus.get(job.slot)
+		if cpus is not None:
+			if '-threads' not in command:
+				for rendition in job.renditions:
+					index = command.index(rendition.temp_output) if rendition.temp_output in command \
+						else len(command) - 1
+					command = [*command[:index], '-threads', str(len(cpus)), *command[index:]]
+		if os.sys.platform == 'win32':
+			if job.props.nice > 0:
+				limits['creationflags'] = subprocess.IDLE_PRIORITY_CLASS if job.props.nice >= 15 \
+					else subprocess.BELOW_NORMAL_PRIORITY_CLASS
+		elif cpus is not None or job.props.nice != 0 or self._ioprio is not None:
+			nice = job.props.nice
+			ioprio = self._ioprio
+			def preexec():
+				if cpus is not None:
+					os.sched_setaffinity(0, cpus)
+				if nice != 0:
+					os.nice(nice)
+				if ioprio is not None:
+					ioprio()
+			limits['preexec_fn'] = preexec
+		return command, limits
+
+	def finish_job(self, job: Job, interrupted: bool = False):
+		'''finish_job moves temporary output of successful job to its place (or deletes the partial one),
+		and records the job as finished.'''
+		job.ended = time.time()
+		self._free_slot(job)
+		for rendition in job.renditions:
+			if job.succeeded and not interrupted:
+				if os.path.isfile(rendition.temp_output):
+					os.replace(rendition.temp_output, rendition.output)
+			elif os.path.isfile(rendition.temp_output):
+				os.remove(rendition.temp_output)
+			rendition.status = 'interrupted' if interrupted else 'done' if job.succeeded else 'failed'
+		if job.parent is None:
+			if self.journal is not None:
+				self.journal.finish(job, 'interrupted' if interrupted else 'done' if job.succeeded else 'failed')
+			self.finished.add(job)
+		if self._stager is not None:
+			self._stager.release(job)
+		if self.metrics is not None:
+			self.metrics.record(job)
+		if job.props.verify != '' and job.parent is None and job.succeeded and not interrupted:
+			verification = asyncio.ensure_future(self._verify(job))
+			self._verifications.add(verification)
+			verification.add_done_callback(self._verifications.discard)
+
+	async def _verify(self, job: Job):
+		'''_verify checks outputs of the finished job (see verify_output) and records the result to the job.
+		No more than `verify_threads` jobs are verified at one time, by processes with the lowest CPU and I/O
+		priority, so verification goes alongside the running jobs and takes only the resources they leave.'''
+		if self._verify_pool is None:
+			self._verify_pool = asyncio.Semaphore(self.props.verify_threads)
+			if os.sys.platform == 'win32':
+				self._verify_limits = {'creationflags': subprocess.IDLE_PRIORITY_CLASS}
+			else:
+				ioprio = ioprio_setter('idle') if os.sys.platform == 'linux' else None
+				def preexec():
+					os.nice(19)
+					if ioprio is not None:
+						ioprio()
+				self._verify_limits = {'preexec_fn': preexec}
+		async with self._verify_pool:
+			begun = time.time()
+			if job.info is None:
+				job.info = (await get_metadata(job.props, [job.input_path], quiet=True))[0]
+			reasons = []
+			for rendition in job.renditions:
+				reason = await verify_output(job.props, job.info, rendition.output, **self._verify_limits)
+				if reason is not None:
+					reasons.append(reason if rendition.name is None else f'rendition {rendition.name}: {reason}')
+		job.verified = len(reasons) == 0
+		job.verification = '; '.join(reasons) if len(reasons) > 0 else None
+		self.finished.verify(job)
+		self._span('verify', 'verify', begun, time.time(), job=job.number, passed=job.verified)
+		if job.verified:
+			print(f'{time.ctime()}: Output of job {job.number} has passed verification')
+		else:
+			print(f'{time.ctime()}: Output of job {job.number} has failed verification: {job.verification}')
+
+	async def _read_log(self, job: Job, stream: asyncio.StreamReader):
+		'''_read_log passes output of ffmpeg to log of the job by chunks, and to console if the queue is attached.'''
+		while True:
+			data = await stream.read(65536)
+			if not data:
+				break
+			job.log.write(data)
+			if self.attached:
+				sys.stderr.write(data.decode(errors='replace'))
+				sys.stderr.flush()
+
+	async def _read_progress(self, job: Job, stream: asyncio.StreamReader):
+		while True:
+			line = await stream.readline()
+			if not line:
+				break
+			key, _, value = line.decode(errors='replace').strip().partition('=')
+			out_time = job.progress.out_time
+			job.progress.update(key, value)
+			self.encoded += job.progress.out_time - out_time
+
+	def estimate(self):
+		'''estimate returns the number of seconds left until the queue is finished (or None if it is unknown yet).
+		Running jobs take the time left by their progress or history (see _remaining), and jobs which are not started
+		yet take as long as the finished ones on average (or as expected by history for the running ones, if there
+		are no finished ones yet).'''
+		expected = tuple(filter(lambda estimate: estimate is not None, map(lambda job: job.estimate, self.running)))
+		if self.total is None or self.finished.succeeded == 0 and len(expected) == 0:
+			return None
+		if self.finished.succeeded > 0:
+			average = self.finished.wall / self.finished.succeeded
+		else:
+			average = sum(expected) / len(expected)
+		left = max(0, self.total - len(self.finished) - self.skipped - len(self.running))
+		running = 0.0
+		for job in self.running:
+			remaining = self._remaining(job)
+			running += remaining if remaining is not None else max(0.0, average - (time.time() - job.started))
+		return (average * left + running) / self.threads
+
+	async def _report_progress(self):
+		'''_report_progress prints the throughput of all running jobs every `progress` seconds:
+		speed relative to realtime, frames per second and megabytes of output per second, and the queue ETA.
+		Jobs which have not moved forward for a while are marked as stalled.'''
+		sizes = {}
+		last = time.time()
+		while True:
+			await asyncio.sleep(self.props.progress)
+			now = time.time()
+			running = sorted(self.running, key=lambda job: job.number)
+			if len(running) == 0:
+				sizes = {}
+				last = now
+				continue
+			written = sum(map(lambda job: job.progress.total_size - sizes.get(job, 0), running))
+			sizes = {job: job.progress.total_size for job in running}
+			eta = self.estimate()
+			summary = f'{len(running)} running, {sum(map(lambda job: job.progress.speed, running)):.2f}x realtime, ' \
+				f'{sum(map(lambda job: job.progress.fps, running)):.1f} fps, ' \
+				f'{max(0, written) / (now - last) / 2 ** 20:.2f} MB/s, ' \
+				f'{len(self.finished)} of {self.total or "?"} finished, ' \
+				f'ETA {format_time(eta) if eta is not None else "unknown"}' + \
+				(f', paused ({self._paused})' if self._paused is not None else '')
+			last = now
+			print(f'{time.ctime()}: {summary}')
+			for job in running:
+				stalled = ', paused' if self._paused is not None else ', stalled' \
+					if now - job.progress.advanced > max(30, 3 * self.props.progress) else ''
+				remaining = self._remaining(job)
+				print(f'\tJob {job.number} ({job.filename}): {format_time(job.progress.out_time)} at ' \
+					f'{job.progress.speed:.2f}x, {job.progress.fps:.1f} fps, ' \
+					f'{job.progress.total_size / 2 ** 20:.1f} MB' \
+					f'{", ETA " + format_time(remaining) if remaining is not None else ""}{stalled}')
+			change_title(f'{summary}, {self.props.finish}')
+
+	async def _feed(self, jobs, queue: JobQueue):
+		'''_feed takes jobs from the iterable in a separate thread, so walking directories on slow storage doesn't
+		stop running jobs, and puts them to the bounded queue. Queue is closed after the last job.
+		Asynchronous iterables (like the one of watch mode) are read in the event loop itself.'''
+		from itertools import islice
+		loop = asyncio.get_event_loop()
+		iterator = iter(jobs) if not hasattr(jobs, '__aiter__') else None
+		count = 0
+		try:
+			if hasattr(jobs, '__aiter__'):
+				async for job in jobs:
+					await queue.put(job)
+					count += 1
+			while not hasattr(jobs, '__aiter__'):
+				scanning = time.time()
+				chunk = await loop.run_in_executor(None, lambda: tuple(islice(iterator, 16)))
+				self._span('scan', 'scan', scanning, time.time(), jobs=len(chunk))
+				for job in chunk:
+					self._span('render', 'scan', *job.rendered, job=job.number)
+				if len(chunk) == 0:
+					break
+				for job in chunk:
+					await queue.put(job)
+				count += len(chunk)
+			if self.total is None:
+				self.total = count
+		finally:
+			queue.close()
+
+	def resize(self, threads: int):
+		'''resize changes number of jobs running at one time. When it is decreased, running jobs are not stopped,
+		new ones are not launched until there are less of them than the new number.'''
+		self.threads = max(1, threads)
+		if self._resized is not None:
+			self._resized.set()
+
+	async def _adapt(self):
+		'''_adapt tunes number of threads every `adapt_interval` seconds: while adding a thread increases throughput
+		(seconds of content encoded per second) by 5% or more, one more is added, up to `max_threads`. If it doesn't,
+		the thread is taken back and the number is kept for a while. If load average per CPU exceeds `max_load`,
+		number of threads is halved.'''
+		cpus = os.cpu_count() or 1
+		last_encoded = self.encoded
+		last_time = time.time()
+		previous = None
+		hold = 0
+		while True:
+			await asyncio.sleep(self.props.adapt_interval)
+			now = time.time()
+			if self._paused is not None:
+				last_encoded, last_time = self.encoded, now
+				previous = None
+				continue
+			throughput = (self.encoded - last_encoded) / (now - last_time)
+			last_encoded, last_time = self.encoded, now
+			try:
+				load = os.getloadavg()[0] / cpus
+			except (AttributeError, OSError):
+				load = 0.0
+			threads = self.threads
+			if load > self.props.max_load and threads > 1:
+				threads = max(1, threads // 2)
+				previous = None
+				hold = 2
+			elif hold > 0:
+				hold -= 1
+			elif len(self.running) < self.threads:
+				previous = None
+			elif previous is not None and throughput < previous * 1.05:
+				threads -= 1
+				previous = None
+				hold = 4
+			elif threads < self.props.max_threads:
+				previous = throughput
+				threads += 1
+			if threads != self.threads:
+				print(f'{time.ctime()}: Number of threads is changed from {self.threads} to {threads} ' \
+					f'({throughput:.2f}x realtime, load {load:.2f} per CPU)')
+				self.resize(threads)
+
+	def _pause_reason(self):
+		'''_pause_reason returns the reason to suspend running jobs now (pause file, pause window or load average),
+		or None if there is no such reason. Load which paused the queue has to fall below 3/4 of `pause_load`.'''
+		if self.props.pause_file != '' and os.path.exists(self.props.pause_file):
+			return f'file \'{self.props.pause_file}\' exists'
+		now = time.localtime()
+		minute = now.tm_hour * 60 + now.tm_min
+		for start, end in parse_windows(self.props.pause_window):
+			if start <= minute < end or end < start and (minute >= start or minute < end):
+				return f'pause window {start // 60:02}:{start % 60:02}-{end // 60:02}:{end % 60:02}'
+		if self.props.pause_load > 0:
+			try:
+				load = os.getloadavg()[0] / (os.cpu_count() or 1)
+			except (AttributeError, OSError):
+				return None
+			if load > self.props.pause_load * (0.75 if self._paused is not None else 1.0):
+				return f'load average {load:.2f} per CPU'
+		return None
+
+	async def _shed(self):
+		'''_shed checks every `PAUSE_INTERVAL` seconds if there is the reason to pause (see _pause_reason).
+		Then running ffmpegs are suspended with SIGSTOP and new jobs are not launched, and when the reason is gone,
+		ffmpegs are resumed with SIGCONT and continue where they were stopped. Time of jobs spent in pause
+		is counted in their `paused`.'''
+		while True:
+			reason = self._pause_reason()
+			if reason is not None and self._paused is None:
+				print(f'{time.ctime()}: Queue is paused, {len(self.running)} running jobs are suspended: {reason}')
+				self._paused = reason
+				self._paused_at = time.time()
+				self._resumed.clear()
+				for job in self.running:
+					self._signal(job, 'SIGSTOP')
+			elif reason is None and self._paused is not None:
+				now = time.time()
+				print(f'{time.ctime()}: Queue is resumed after {format_time(now - self._paused_at)} of pause')
+				for job in self.running:
+					self._signal(job, 'SIGCONT')
+					job.paused += now - max(self._paused_at, job.started)
+				self._span('pause', 'queue', self._paused_at, now, reason=self._paused)
+				self._paused = None
+				self._resumed.set()
+			await asyncio.sleep(PAUSE_INTERVAL)
+
+	async def _wait_slot(self, running: set):
+		'''_wait_slot waits until there are less running jobs than threads and returns the set of running ones.'''
+		while len(running) >= self.threads:
+			resized = asyncio.ensure_future(self._resized.wait())
+			done, _ = await asyncio.wait(running | {resized}, return_when=asyncio.FIRST_COMPLETED)
+			resized.cancel()
+			self._resized.clear()
+			running = running - done
+		return running
+
+	async def _run(self, jobs):
+		self._resized = asyncio.Event()
+		self._resumed = asyncio.Event()
+		self._resumed.set()
+		reporter = asyncio.ensure_future(self._report_progress()) if self.props.progress > 0 else None
+		shedder = None
+		if os.sys.platform != 'win32':
+			if self.props.pause_window != '' or self.props.pause_load > 0 or self.props.pause_file != '':
+				shedder = asyncio.ensure_future(self._shed())
+		elif self.props.pause_window != '' or self.props.pause_load > 0:
+			print(f'Warning: pausing of jobs is not supported on {os.sys.platform}, it is ignored')
+		adapter = asyncio.ensure_future(self._adapt()) if self.props.adaptive else None
+		self._queue = queue = JobQueue(self.feed_size, PARKED_JOBS if self._capped else 0)
+		queue.keep_open = self._accepting
+		feeder = asyncio.ensure_future(self._feed(jobs, queue))
+		prefetcher = None
+		if self.props.scratch != '':
+			self._stager = Stager(self.props.scratch, int(self.props.scratch_size * 2 ** 30), self.props.io_threads)
+			self._staged = queue = JobQueue(self.threads, PARKED_JOBS if self._capped else 0)
+			prefetcher = asyncio.ensure_future(self._prefetch(self._queue, queue))
+		self._server = server = await self._serve_control() if self.props.control != '' else None
+		running = set()
+		self._dispatching = True
+		while True:
+			running = await self._wait_slot(running)
+			job = await queue.get(self._accepts if self._capped else None)
+			if job is None or self._draining:
+				break
+			self.queued += 1
+			if self.journal is not None and self.journal.is_done(job.parent or job):
+				if job.parent is None or job.parent not in self._skipped_parents:
+					print(f'{time.ctime()}: Job {job.number} ({(job.parent or job).filename}) is already finished, skipping')
+					self.skipped += 1
+					if job.parent is not None:
+						self._skipped_parents.add(job.parent)
+				continue
+			if job.parent is not None and job.parent.cancelled:
+				self._drop_part(job)
+				continue
+			await self._resumed.wait()
+			task = asyncio.ensure_future(self.run_job(job))
+			self._tasks[job] = task
+			self._profile_jobs[job.profile] = self._profile_jobs.get(job.profile, 0) + 1
+			task.add_done_callback(lambda task, job=job: self._release(job))
+			running.add(task)
+		self._dispatching = False
+		if len(running) > 0:
+			await asyncio.wait(running)
+		if prefetcher is not None:
+			prefetcher.cancel()
+			await asyncio.wait([prefetcher])
+			for staged in (job, *queue.jobs()):
+				self._stager.release(staged)
+		if len(self._uploads) > 0:
+			await asyncio.wait(self._uploads)
+		if len(self._verifications) > 0:
+			print(f'{time.ctime()}: Waiting for verification of {len(self._verifications)} jobs')
+			await asyncio.wait(self._verifications)
+		if reporter is not None:
+			reporter.cancel()
+		if shedder is not None:
+			shedder.cancel()
+		if adapter is not None:
+			adapter.cancel()
+		if server is not None:
+			server.close()
+		if self._draining:
+			feeder.cancel()
+		else:
+			await feeder
+
+	def _accepting(self):
+		'''_accepting returns True if jobs added by control commands can still be run after all the jobs of the
+		iterable are taken: control socket is up, queue is not draining and some jobs are still running, staged
+		or uploaded, so the queue isn't finished yet.'''
+		return self._server is not None and not self._draining and (len(self._tasks) > 0 or self._staging > 0 or
+			self._staged is not None and len(self._staged.jobs()) > 0 or len(self._uploads) > 0)
+
+	def _accepts(self, job: Job):
+		'''_accepts returns True if the job can be launched now: there are less running jobs of its profile
+		than max_jobs of the profile (main max_jobs for jobs without profile), 0 is unlimited.'''
+		limit = (Properties.get_profile(self.props, job.profile) if job.profile is not None else self.props).max_jobs
+		return limit == 0 or self._profile_jobs.get(job.profile, 0) < limit
+
+	def _release(self, job: Job):
+		'''_release is called when the task of the job is done, it frees the place of the job among running
+		jobs of its profile.'''
+		self._tasks.pop(job, None)
+		self._profile_jobs[job.profile] -= 1
+		for queue in (self._queue, self._staged):
+			if queue is not None:
+				queue.notify()
+
+	async def _prefetch(self, queue: JobQueue, staged: JobQueue):
+		'''_prefetch stages jobs from the queue on scratch directory (see Stager) ahead of free threads and puts
+		them to the queue of staged jobs, `threads` of them are staged at one time. Jobs which are finished already
+		according to the journal and parts of segmented jobs (each of them reads only a piece of input) are passed
+		as they are. Job which cannot be staged reads its input directly.'''
+		async def stage(job: Job):
+			self._staging += 1
+			try:
+				try:
+					await self._stager.stage(job)
+				except OSError as exc:
+					print(f'{time.ctime()}: Job {job.number} could not be staged, it is run without scratch: \'{exc}\'')
+				try:
+					await staged.put(job)
+				except asyncio.CancelledError:
+					self._stager.release(job)
+					raise
+			finally:
+				self._staging -= 1
+		copies = set()
+		try:
+			while True:
+				if len(copies) >= self.threads:
+					_, copies = await asyncio.wait(copies, return_when=asyncio.FIRST_COMPLETED)
+					continue
+				job = await queue.get()
+				if job is None:
+					break
+				if job.parent is not None or self.journal is not None and self.journal.is_done(job):
+					await staged.put(job)
+					continue
+				copies.add(asyncio.ensure_future(stage(job)))
+			if len(copies) > 0:
+				await asyncio.wait(copies)
+		finally:
+			for copy in copies:
+				copy.cancel()
+			if len(copies) > 0:
+				await asyncio.wait(copies)
+			staged.close()
+
+	def _queued_jobs(self):
+		'''_queued_jobs returns jobs waiting for free thread, staged ones first.'''
+		return [*(self._staged.jobs() if self._staged is not None else ()), *self._queue.jobs()]
+
+	def cancel(self, job: Job):
+		'''cancel terminates the running job, it is finished as interrupted.'''
+		if job in self._tasks:
+			self._tasks[job].cancel()
+
+	def drain(self):
+		'''drain stops launching of new jobs, queue is finished after the running ones.'''
+		self._draining = True
+		self._queue.clear()
+		self._queue.close()
+		self.total = self.queued
+
+	async def _serve_control(self):
+		'''_serve_control starts listening for control commands (see control) on Unix socket.'''
+		if not hasattr(asyncio, 'start_unix_server'):
+			print(f'Warning: control socket is not supported on {os.sys.platform}, it is ignored')
+			return None
+		async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+			try:
+				answer = self.control(json.loads(await reader.readline()))
+			except (ValueError, KeyError, TypeError) as exc:
+				answer = {'error': f'bad request: {exc}'}
+			writer.write(json.dumps(answer).encode() + b'\n')
+			await writer.drain()
+			writer.close()
+		if os.path.exists(self.props.control):
+			if not S_ISSOCK(os.stat(self.props.control).st_mode):
+				print(f'Warning: \'{self.props.control}\' exists and is not a socket, control commands are not listened')
+				return None
+			os.remove(self.props.control)
+		server = await asyncio.start_unix_server(handle, self.props.control)
+		os.chmod(self.props.control, 0o600)
+		print(f'Listening for control commands at \'{self.props.control}\'')
+		return server
+
+	def control(self, request: dict):
+		'''control executes one control command and returns the answer: "status", "add" (files relative
+		to input directory or absolute, with priority), "priority" (job, priority), "cancel" (job), "threads" (threads)
+		or "drain". Jobs are given by their numbers. Absolute path outside of input directory is taken like in manifest
+		(the file's directory becomes input directory of the job), relative path can't go out of input directory.'''
+		command = request['command']
+		if command == 'status':
+			return {'threads': self.threads, 'finished': len(self.finished), 'total': self.total,
+				'draining': self._draining,
+				'running': list(map(lambda job: {'job': job.number, 'filename': job.filename, 'slot': job.slot,
+					'pid': job.pid, 'out_time': job.progress.out_time if job.progress else 0.0}, self._tasks)),
+				'queued': list(map(lambda job: {'job': job.number, 'filename': job.filename, 'priority': job.priority},
+					self._queued_jobs()))}
+		elif command == 'add':
+			if self._draining:
+				return {'error': 'queue is draining'}
+			if not self._dispatching:
+				return {'error': 'queue is finished'}
+			from copy import copy
+			added = []
+			for path in request['files']:
+				props, filename = self.props, path
+				if os.path.isabs(path):
+					try:
+						filename = os.path.relpath(path, props.input_dir)
+					except ValueError:
+						filename = os.pardir
+					if filename == os.pardir or filename.startswith(os.pardir + os.path.sep):
+						props = copy(self.props)
+						props.input_dir, filename = os.path.split(path)
+				elif os.pardir in path.replace('/', os.path.sep).split(os.path.sep):
+					return {'error': f'path \'{path}\' goes out of input directory', 'added': added}
+				if not os.path.isfile(os.path.join(props.input_dir, filename)):
+					return {'error': f'file \'{path}\' is not found', 'added': added}
+				self._added += 1
+				job = Job(props, f'+{self._added}', filename.replace(os.path.sep, '/'))
+				job.priority = int(request.get('priority', 0))
+				self._queue.put_nowait(job)
+				if self.total is not None:
+					self.total += 1
+				added.append(job.number)
+				print(f'{time.ctime()}: Job {job.number} ({job.filename}) is added with priority {job.priority}')
+			return {'added': added}
+		elif command in ('priority', 'cancel'):
+			number = str(request['job'])
+			jobs = tuple(filter(lambda job: str(job.number) == number, (*self._tasks, *self._queued_jobs())))
+			if len(jobs) == 0:
+				return {'error': f'job {number} is neither running nor queued'}
+			for job in jobs:
+				if command == 'priority':
+					if not self._queue.reprioritize(job, int(request['priority'])) and (self._staged is None or
+							not self._staged.reprioritize(job, int(request['priority']))):
+						return {'error': f'job {number} is already running'}
+				elif job in self._tasks:
+					if job.parent is None:
+						print(f'{time.ctime()}: Job {job.number} is cancelled')
+					else:
+						job.parent.cancelled = True
+					job.cancelled = True
+					self.cancel(job)
+				elif self._queue.remove(job) or self._staged is not None and self._staged.remove(job):
+					if self._stager is not None:
+						self._stager.release(job)
+					if job.parent is None:
+						print(f'{time.ctime()}: Job {job.number} is removed from the queue')
+						if self.total is not None:
+							self.total -= 1
+					else:
+						job.parent.cancelled = True
+						self._drop_part(job)
+			return {}
+		elif command == 'threads':
+			self.resize(int(request['threads']))
+			print(f'{time.ctime()}: Number of threads is set to {self.threads}')
+			return {'threads': self.threads}
+		elif command == 'drain':
+			print(f'{time.ctime()}: Queue is draining, running jobs are finished')
+			self.drain()
+			return {}
+		return {'error': f'unknown command \'{command}\''}
+
+	def run(self, jobs, total: int = None):
+		'''run executes all the given jobs (any iterable or asynchronous iterable of Job, it is read lazily)
+		and returns Tally of finished ones. If total is not given, it becomes known when the iterable is exhausted.
+		Ctrl+C terminates running ffmpegs and stops the queue. Phases of jobs are recorded to `trace` (Trace)
+		if it is set.'''
+		self.total = total
+		if self.props.journal != '':
+			self.journal = Journal(self.props.journal)
+		if self.props.metrics != '' or self.props.prometheus != '':
+			self.metrics = Metrics(self.props.metrics or None, self.props.prometheus or None)
+		if self.props.history != '':
+			self.history = History(self.props.history)
+		try:
+			run_loop(self._run(jobs))
+		except KeyboardInterrupt:
+			print(f'{time.ctime()}: Queue is interrupted')
+		finally:
+			if self.journal is not None:
+				self.journal.close()
+			if self.history is not None:
+				self.history.close()
+			if self._server is not None and os.path.exists(self.props.control) and \
+					S_ISSOCK(os.stat(self.props.control).st_mode):
+				os.remove(self.props.control)
+		if self.total is None:
+			self.total = self.queued
+		return self.finished
+
+class Coordinator:
+	'''Coordinator is the class which owns the queue of jobs and gives them to workers (see Worker) over HTTP
+	instead of running them. Worker leases a job for `lease` seconds and renews the lease while the job is running,
+	job of a worker which has vanished is given to another one when its lease expires. All the requests are POSTs
+	with JSON body, containing "worker" name:
+	  "/lease" returns job ({"id", "filename", "time", "lease"}), 204 if all the jobs are leased already
+	    or 410 if there are no more jobs;
+	  "/progress" renews leases of {"jobs": {id: {"out_time", "speed"}}} and returns {"lost": [ids]} which are
+	    not leased by the worker anymore;
+	  "/result" records {"id", "returncode"} of the finished job.
+	GET "/status" returns the state of the queue.'''
+	def __init__(self, props: Properties, files, total: int = None):
+		from collections import deque
+		self.props = props
+		self.total = total
+		self.finished = Tally()
+		self.skipped = 0
+		self.pending = deque()
+		self.leases = {}
+		self.exhausted = False
+		self.journal = None
+		self._files = iter(files)
+		self._number = 0
+
+	@property
+	def done(self):
+		return self.exhausted and len(self.pending) == 0 and len(self.leases) == 0
+
+	def _next(self):
+		'''_next returns job to be leased, expired ones go first, or None if there is no such job.'''
+		now = time.time()
+		for number, (job, worker, deadline, _) in tuple(self.leases.items()):
+			if deadline < now:
+				print(f'{time.ctime()}: Lease of job {number} by {worker} has expired, job is queued again')
+				del self.leases[number]
+				self.pending.appendleft(job)
+		if len(self.pending) > 0:
+			return self.pending.popleft()
+		while not self.exhausted:
+			filename = next(self._files, None)
+			if filename is None:
+				self.exhausted = True
+				if self.total is None:
+					self.total = self._number
+				break
+			self._number += 1
+			job = Job(self.props, self._number, filename)
+			if self.journal is not None and self.journal.is_done(job):
+				print(f'{time.ctime()}: Job {job.number} ({job.filename}) is already finished, skipping')
+				self.skipped += 1
+				continue
+			return job
+		return None
+
+	def lease(self, worker: str):
+		job = self._next()
+		if job is None:
+			return (410 if self.done else 204), None
+		self.leases[job.number] = [job, worker, time.time() + self.props.lease, {}]
+		job.started = job.started or time.time()
+		if self.journal is not None:
+			self.journal.start(job)
+		print(f'{time.ctime()}: Job {job.number} ({job.filename}) is leased by {worker}')
+		return 200, {'id': job.number, 'filename': job.filename, 'time': self.props._time, 'lease': self.props.lease}
+
+	def renew(self, worker: str, jobs: dict):
+		lost = []
+		for number, progress in jobs.items():
+			lease = self.leases.get(int(number))
+			if lease is None or lease[1] != worker:
+				lost.append(int(number))
+				continue
+			lease[2] = time.time() + self.props.lease
+			lease[3] = progress
+		return 200, {'lost': lost}
+
+	def result(self, worker: str, number: int, returncode: int):
+		lease = self.leases.get(number)
+		if lease is None or lease[1] != worker:
+			return 409, None
+		job = self.leases.pop(number)[0]
+		job.returncode = returncode
+		job.ended = time.time()
+		if self.journal is not None:
+			self.journal.finish(job, 'done' if job.succeeded else 'failed')
+		self.finished.add(job)
+		print(f'{time.ctime()}: Job {job.number} ({job.filename}) is finished by {worker} with exit code {returncode}')
+		return 200, {}
+
+	def status(self):
+		return 200, {'total': self.total, 'finished': len(self.finished), 'skipped': self.skipped,
+			'pending': len(self.pending), 'leases': {number: {'filename': job.filename, 'worker': worker,
+				'progress': progress} for number, (job, worker, _, progress) in self.leases.items()}}
+
+	def serve(self, address: str):
+		'''serve answers requests of workers until all the jobs are finished and returns Tally of finished ones.
+		After that it keeps answering for a few seconds, so waiting workers get to know that the queue is over.
+		Ctrl+C stops the coordinator, jobs which are not finished are run again on the next launch.'''
+		from http.server import HTTPServer, BaseHTTPRequestHandler
+		coordinator = self
+		class Handler(BaseHTTPRequestHandler):
+			def do_POST(self):
+				try:
+					request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+					worker = str(request.get('worker', self.client_address[0]))
+					if self.path == '/lease':
+						self._answer(*coordinator.lease(worker))
+					elif self.path == '/progress':
+						self._answer(*coordinator.renew(worker, dict(request.get('jobs', {}))))
+					elif self.path == '/result':
+						self._answer(*coordinator.result(worker, int(request['id']), request.get('returncode')))
+					else:
+						self._answer(404, None)
+				except (ValueError, KeyError, TypeError):
+					self._answer(400, None)
+			def do_GET(self):
+				self._answer(*(coordinator.status() if self.path == '/status' else (404, None)))
+			def _answer(self, code: int, answer):
+				body = json.dumps(answer).encode() if answer is not None else b''
+				self.send_response(code)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, *args):
+				pass
+		host, _, port = address.rpartition(':')
+		server = HTTPServer((host or '0.0.0.0', int(port)), Handler)
+		server.timeout = 1
+		if self.props.journal != '':
+			self.journal = Journal(self.props.journal)
+		print(f'Giving jobs to workers at {host or "0.0.0.0"}:{port}, hit Ctrl + C to stop')
+		try:
+			while not self.done:
+				server.handle_request()
+			linger = time.time() + 10
+			while time.time() < linger:
+				server.handle_request()
+		except KeyboardInterrupt:
+			print(f'{time.ctime()}: Queue is interrupted')
+		finally:
+			server.server_close()
+			if self.journal is not None:
+				self.journal.close()
+		if self.total is None:
+			self.total = self._number
+		return self.finished
+
+class Worker(Scheduler):
+	'''Worker is the scheduler which runs jobs leased from coordinator (see Coordinator) instead of jobs from input
+	directory. It renews leases of its jobs, reporting their progress, and sends their exit codes to coordinator.
+	Job which lease is lost (coordinator has given it to another worker) is terminated. Temporary outputs which
+	other workers have left for the job (see remove_stale) are deleted when the job is leased and finished.'''
+	def __init__(self, props: Properties, url: str):
+		import socket
+		super().__init__(props)
+		self.url = url.rstrip('/') if '://' in url else 'http://' + url.rstrip('/')
+		self.name = f'{socket.gethostname()}:{os.getpid()}'
+		self.lease = props.lease
+		self.leased = {}
+		self.feed_size = 1
+		self._released = None
+		self._reports = []
+
+	async def _request(self, path: str, data: dict):
+		'''_request sends POST request to coordinator and returns status code and answer, (None, None) if
+		coordinator cannot be reached.'''
+		from urllib import request, error
+		def send():
+			req = request.Request(self.url + path, json.dumps({'worker': self.name, **data}).encode(),
+				{'Content-Type': 'application/json'})
+			try:
+				with request.urlopen(req, timeout=10) as response:
+					body = response.read()
+					return response.status, (json.loads(body) if len(body) > 0 else None)
+			except error.HTTPError as exc:
+				return exc.code, None
+			except (OSError, ValueError):
+				return None, None
+		return await asyncio.get_event_loop().run_in_executor(None, send)
+
+	async def leased_jobs(self):
+		'''leased_jobs is the asynchronous iterable of jobs leased from coordinator. New job is asked only when
+		there are less leased jobs than threads. It ends when coordinator has no more jobs or cannot be reached
+		for two lease times.'''
+		from copy import copy
+		output_dir = self.props.output_dir
+		unreachable = None
+		while True:
+			while len(self.leased) >= self.threads:
+				self._released.clear()
+				await self._released.wait()
+			code, answer = await self._request('/lease', {})
+			if code == 200:
+				unreachable = None
+				props = copy(self.props)
+				props._time = answer['time']
+				props.output_dir = output_dir
+				Properties.expand_output_dir(props)
+				self.lease = answer['lease']
+				job = Job(props, answer['id'], answer['filename'])
+				# temporary output is unique for the worker, so the stopped job doesn't delete output of its new owner
+				for rendition in job.renditions:
+					index = rendition.temp_output.rfind('.part.')
+					temp_output = f'{rendition.temp_output[:index]}.part.{self.name.replace(":", "-")}' \
+						f'{rendition.temp_output[index + len(".part"):]}'
+					job.command = [temp_output if arg == rendition.temp_output else arg for arg in job.command]
+					rendition.temp_output = temp_output
+				job.temp_output = job.renditions[0].temp_output
+				self.remove_stale(job)
+				self.leased[job.number] = job
+				yield job
+				continue
+			if code == 410:
+				return
+			if code is None:
+				unreachable = unreachable or time.time()
+				if time.time() - unreachable > 2 * self.lease:
+					print(f'{time.ctime()}: Coordinator at {self.url} cannot be reached, stopping')
+					return
+			await asyncio.sleep(min(5, self.lease / 3))
+
+	async def _renew(self):
+		while True:
+			await asyncio.sleep(self.lease / 3)
+			if len(self.leased) == 0:
+				continue
+			jobs = {number: {'out_time': job.progress.out_time, 'speed': job.progress.speed} if job.progress else {}
+				for number, job in self.leased.items()}
+			code, answer = await self._request('/progress', {'jobs': jobs})
+			if code != 200:
+				continue
+			for number in answer['lost']:
+				job = self.leased.pop(number, None)
+				if job is not None:
+					print(f'{time.ctime()}: Lease of job {job.number} is lost, it is stopped')
+					self.cancel(job)
+					self._released.set()
+
+	def resize(self, threads: int):
+		super().resize(threads)
+		if self._released is not None:
+			self._released.set()
+
+	async def run_job(self, job: Job):
+		if job.number in self.leased:
+			await super().run_job(job)
+
+	def finish_job(self, job: Job, interrupted: bool = False):
+		super().finish_job(job, interrupted)
+		self._released.set()
+		if self.leased.pop(job.number, None) is None:
+			self.finished.remove(job)
+		elif not interrupted:
+			self.remove_stale(job)
+			self._reports.append(asyncio.ensure_future(self._report(job)))
+
+	def remove_stale(self, job: Job):
+		'''remove_stale deletes temporary outputs of the job made by other workers ("<name>.part.<worker>.<format>"),
+		which are left by workers which have vanished or lost the lease of the job.'''
+		from glob import glob, escape
+		own = self.name.replace(':', '-')
+		for rendition in job.renditions:
+			index = rendition.temp_output.rfind(f'.part.{own}.')
+			if index < 0:
+				continue
+			pattern = escape(rendition.temp_output[:index]) + '.part.*' + \
+				escape(rendition.temp_output[index + len(f'.part.{own}'):])
+			for path in filter(lambda path: path != rendition.temp_output, glob(pattern)):
+				try:
+					os.remove(path)
+					print(f'{time.ctime()}: Temporary output \'{path}\' left by another worker is deleted')
+				except OSError:
+					pass
+
+	async def _report(self, job: Job):
+		for _ in range(3):
+			code, _ = await self._request('/result', {'id': job.number, 'returncode': job.returncode})
+			if code is not None:
+				return
+			await asyncio.sleep(5)
+		print(f'{time.ctime()}: Exit code of job {job.number} could not be sent to coordinator')
+
+	async def _run(self, jobs):
+		self._released = asyncio.Event()
+		renewer = asyncio.ensure_future(self._renew())
+		try:
+			await super()._run(jobs)
+		finally:
+			renewer.cancel()
+		if len(self._reports) > 0:
+			await asyncio.wait(self._reports)
+
+def control_client(path: str, args: list):
+	'''control_client sends control command given by console arguments to the running queue (see Scheduler.control)
+	and prints the answer. It returns exit code.'''
+	import socket
+	request = {'command': args[0] if len(args) > 0 else 'status'}
+	try:
+		if request['command'] == 'add':
+			if len(args) > 2 and args[1] in ('-p', '--priority'):
+				request['priority'] = int(args[2])
+				args = args[2:]
+			request['files'] = args[1:]
+		elif request['command'] == 'priority':
+			request['job'], request['priority'] = args[1], int(args[2])
+		elif request['command'] == 'cancel':
+			request['job'] = args[1]
+		elif request['command'] == 'threads':
+			request['threads'] = int(args[1])
+	except (IndexError, ValueError):
+		print(f'Error: wrong arguments of control command: \'{" ".join(args)}\'. Try \'--help\'')
+		return 1
+	try:
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.connect(path)
+			sock.sendall(json.dumps(request).encode() + b'\n')
+			answer = json.loads(sock.makefile('rb').readline())
+	except (OSError, ValueError, AttributeError) as exc:
+		print(f'Error: queue at \'{path}\' cannot be reached: \'{exc}\'')
+		return 1
+	if 'error' in answer:
+		print(f'Error: {answer["error"]}')
+		return 1
+	if request['command'] == 'status':
+		print(f'{len(answer["running"])} of {answer["threads"]} threads are busy, {answer["finished"]} of ' \
+			f'{answer["total"] if answer["total"] is not None else "?"} jobs are finished' + \
+			(', queue is draining' if answer['draining'] else ''))
+		for job in answer['running']:
+			print(f'\tJob {job["job"]} ({job["filename"]}): running in slot {job["slot"]}, pid {job["pid"]}, ' \
+				f'{format_time(job["out_time"])} encoded')
+		for job in answer['queued']:
+			print(f'\tJob {job["job"]} ({job["filename"]}): queued with priority {job["priority"]}')
+	else:
+		print('Accepted' + (f', jobs {", ".join(answer["added"])} are added' if 'added' in answer else ''))
+	return 0
+
+def report_jobs(jobs: Tally, total: int):
+	'''report_jobs prints the summary of finished jobs and returns True if all of them have succeeded or have been
+	cancelled (and their outputs have passed verification, if they were verified).'''
+	print(f'{jobs.succeeded} of {total} jobs are finished successfully')
+	if jobs.cancelled > 0:
+		print(f'{jobs.cancelled} jobs are cancelled')
+	for job in jobs.failed:
+		print(f'\tJob {job.number} ({job.filename}) has failed with exit code {job.returncode}')
+	if jobs.verified > 0:
+		print(f'{jobs.verified - len(jobs.unverified)} of {jobs.verified} verified jobs have passed verification')
+	for job in jobs.unverified:
+		print(f'\tJob {job.number} ({job.filename}) has failed verification: {job.verification}')
+	return len(jobs.failed) == 0 and len(jobs.unverified) == 0 and len(jobs) == total
 
 def parse_arguments(argv: list, props: Properties):
 	'''parse_arguments parses all the arguments and fills Properties from given parameters.'''
@@ -355,6 +3547,44 @@ def parse_arguments(argv: list, props: Properties):
 		THREADS = enum_auto() # threads
 		TIME = enum_auto()    # shutdown_time
 		CFG = enum_auto()     # config_file
+		JOURNAL = enum_auto() # journal
+		PROGRESS = enum_auto() # progress
+		FPPATH = enum_auto()  # ffprobe_path
+		SCHEDULE = enum_auto() # schedule
+		CACHE = enum_auto()   # cache
+		PROBE_THREADS = enum_auto() # probe_threads
+		INCLUDE = enum_auto() # include
+		EXCLUDE = enum_auto() # exclude
+		WATCH_STABLE = enum_auto() # watch_stable
+		MAX_THREADS = enum_auto() # max_threads
+		MAX_LOAD = enum_auto() # max_load
+		NICE = enum_auto()    # nice
+		IONICE = enum_auto()  # ionice
+		SERVE = enum_auto()   # serve
+		WORKER = enum_auto()  # worker
+		LEASE = enum_auto()   # lease
+		RENDITIONS = enum_auto() # renditions
+		CONTROL = enum_auto() # control
+		METRICS = enum_auto() # metrics
+		TRACE = enum_auto() # trace
+		LOGS = enum_auto()  # logs
+		LOG_SIZE = enum_auto() # log_size
+		LOG_LINES = enum_auto() # log_lines
+		VERIFY = enum_auto()  # verify
+		VERIFY_THREADS = enum_auto() # verify_threads
+		VERIFY_TOLERANCE = enum_auto() # verify_tolerance
+		PROMETHEUS = enum_auto() # prometheus
+		SCRATCH = enum_auto() # scratch
+		SCRATCH_SIZE = enum_auto() # scratch_size
+		IO_THREADS = enum_auto() # io_threads
+		HISTORY = enum_auto() # history
+		COPY_VIDEO = enum_auto() # copy_video
+		COPY_AUDIO = enum_auto() # copy_audio
+		MANIFEST = enum_auto() # manifest
+		MAX_JOBS = enum_auto() # max_jobs
+		PAUSE_WINDOW = enum_auto() # pause_window
+		PAUSE_LOAD = enum_auto() # pause_load
+		PAUSE_FILE = enum_auto() # pause_file
 		NORMAL = enum_auto()  # current argument is not a continue to the last one
 	var_map = {
 		'-ffpath'  : Variant.FFPATH,
@@ -368,7 +3598,46 @@ def parse_arguments(argv: list, props: Properties):
 		'-op'      : Variant.OP,
 		'-threads' : Variant.THREADS,
 		'-time'    : Variant.TIME,
-		'-cfg'     : Variant.CFG
+		'-cfg'     : Variant.CFG,
+		'-journal' : Variant.JOURNAL,
+		'-progress': Variant.PROGRESS,
+		'-fppath'  : Variant.FPPATH,
+		'-schedule': Variant.SCHEDULE,
+		'-cache'   : Variant.CACHE,
+		'-probe_threads': Variant.PROBE_THREADS,
+		'-include' : Variant.INCLUDE,
+		'-exclude' : Variant.EXCLUDE,
+		'-watch_stable': Variant.WATCH_STABLE,
+		'-max_threads': Variant.MAX_THREADS,
+		'-max_load': Variant.MAX_LOAD,
+		'-nice'    : Variant.NICE,
+		'-ionice'  : Variant.IONICE,
+		'-serve'   : Variant.SERVE,
+		'-worker'  : Variant.WORKER,
+		'-lease'   : Variant.LEASE,
+		'-renditions': Variant.RENDITIONS,
+		'-control' : Variant.CONTROL,
+		'-metrics' : Variant.METRICS,
+		'-trace' : Variant.TRACE,
+		'-logs'  : Variant.LOGS,
+		'-log_size': Variant.LOG_SIZE,
+		'-log_lines': Variant.LOG_LINES,
+		'-verify': Variant.VERIFY,
+		'-verify_threads': Variant.VERIFY_THREADS,
+		'-verify_tolerance': Variant.VERIFY_TOLERANCE,
+		'--trace' : Variant.TRACE,
+		'-prometheus': Variant.PROMETHEUS,
+		'-scratch': Variant.SCRATCH,
+		'-scratch_size': Variant.SCRATCH_SIZE,
+		'-io_threads': Variant.IO_THREADS,
+		'-history': Variant.HISTORY,
+		'-copy_video': Variant.COPY_VIDEO,
+		'-copy_audio': Variant.COPY_AUDIO,
+		'-manifest': Variant.MANIFEST,
+		'-max_jobs': Variant.MAX_JOBS,
+		'-pause_window': Variant.PAUSE_WINDOW,
+		'-pause_load': Variant.PAUSE_LOAD,
+		'-pause_file': Variant.PAUSE_FILE
 	}
 	last = Variant.NORMAL
 	for arg in argv[1:]:
@@ -411,6 +3680,100 @@ def parse_arguments(argv: list, props: Properties):
 				props.finish.time = arg.split('=')[1]
 			elif arg in ('--no_user', '-no_user'):
 				props.no_user = True
+			elif arg.startswith('--journal='):
+				props.journal = arg.split('=')[1]
+			elif arg.startswith('--progress='):
+				props.progress = arg.split('=')[1]
+			elif arg.startswith('--ffprobe_path='):
+				props.ffprobe_path = arg.split('=')[1]
+			elif arg.startswith('--schedule='):
+				props.schedule = arg.split('=')[1]
+			elif arg in ('--no_size_fallback', '-no_size_fallback'):
+				props.size_fallback = False
+			elif arg.startswith('--cache='):
+				props.cache = arg.split('=')[1]
+			elif arg.startswith('--cache_size='):
+				props.cache_size = arg.split('=')[1]
+			elif arg.startswith('--probe_threads='):
+				props.probe_threads = arg.split('=')[1]
+			elif arg in ('--recursive', '-r'):
+				props.recursive = True
+			elif arg.startswith('--include='):
+				props.include = arg.split('=', 1)[1]
+			elif arg.startswith('--exclude='):
+				props.exclude = arg.split('=', 1)[1]
+			elif arg in ('--watch', '-watch'):
+				props.watch = True
+			elif arg.startswith('--watch_stable='):
+				props.watch_stable = arg.split('=')[1]
+			elif arg in ('--adaptive', '-adaptive'):
+				props.adaptive = True
+			elif arg.startswith('--max_threads='):
+				props.max_threads = arg.split('=')[1]
+			elif arg.startswith('--max_load='):
+				props.max_load = arg.split('=')[1]
+			elif arg.startswith('--adapt_interval='):
+				props.adapt_interval = arg.split('=')[1]
+			elif arg in ('--affinity', '-affinity'):
+				props.affinity = True
+			elif arg in ('--no_segments', '-no_segments'):
+				props.segments = False
+			elif arg.startswith('--nice='):
+				props.nice = arg.split('=')[1]
+			elif arg.startswith('--ionice='):
+				props.ionice = arg.split('=')[1]
+			elif arg.startswith('--serve='):
+				props.serve = arg.split('=')[1]
+			elif arg.startswith('--worker='):
+				props.worker = arg.split('=')[1]
+			elif arg.startswith('--lease='):
+				props.lease = arg.split('=')[1]
+			elif arg.startswith('--renditions='):
+				props.renditions = arg.split('=', 1)[1]
+			elif arg in ('--preflight', '-preflight'):
+				props.preflight = True
+			elif arg.startswith('--control='):
+				props.control = arg.split('=', 1)[1]
+			elif arg.startswith('--metrics='):
+				props.metrics = arg.split('=', 1)[1]
+			elif arg.startswith('--trace='):
+				props.trace = arg.split('=', 1)[1]
+			elif arg.startswith('--logs='):
+				props.logs = arg.split('=', 1)[1]
+			elif arg.startswith('--log_size='):
+				props.log_size = arg.split('=')[1]
+			elif arg.startswith('--log_lines='):
+				props.log_lines = arg.split('=')[1]
+			elif arg.startswith('--verify='):
+				props.verify = arg.split('=')[1]
+			elif arg.startswith('--verify_threads='):
+				props.verify_threads = arg.split('=')[1]
+			elif arg.startswith('--verify_tolerance='):
+				props.verify_tolerance = arg.split('=')[1]
+			elif arg.startswith('--prometheus='):
+				props.prometheus = arg.split('=', 1)[1]
+			elif arg.startswith('--scratch='):
+				props.scratch = arg.split('=', 1)[1]
+			elif arg.startswith('--scratch_size='):
+				props.scratch_size = arg.split('=')[1]
+			elif arg.startswith('--io_threads='):
+				props.io_threads = arg.split('=')[1]
+			elif arg.startswith('--history='):
+				props.history = arg.split('=', 1)[1]
+			elif arg.startswith('--copy_video='):
+				props.copy_video = arg.split('=', 1)[1]
+			elif arg.startswith('--copy_audio='):
+				props.copy_audio = arg.split('=', 1)[1]
+			elif arg.startswith('--manifest='):
+				props.manifest = arg.split('=', 1)[1]
+			elif arg.startswith('--max_jobs='):
+				props.max_jobs = arg.split('=')[1]
+			elif arg.startswith('--pause_window='):
+				props.pause_window = arg.split('=')[1]
+			elif arg.startswith('--pause_load='):
+				props.pause_load = arg.split('=')[1]
+			elif arg.startswith('--pause_file='):
+				props.pause_file = arg.split('=', 1)[1]
 			else:
 				print(f'Warning: Unknown console parameter: \'{arg}\'. Try \'{argv[0]} --help\'')
 		elif last == Variant.FFPATH:
@@ -434,6 +3797,82 @@ def parse_arguments(argv: list, props: Properties):
 				print(f'Warning: Error with threads parameter: \'{arg}\'')
 		elif last == Variant.TIME:
 			props.finish.time = arg
+		elif last == Variant.JOURNAL:
+			props.journal = arg
+		elif last == Variant.PROGRESS:
+			props.progress = arg
+		elif last == Variant.FPPATH:
+			props.ffprobe_path = arg
+		elif last == Variant.SCHEDULE:
+			props.schedule = arg
+		elif last == Variant.CACHE:
+			props.cache = arg
+		elif last == Variant.PROBE_THREADS:
+			props.probe_threads = arg
+		elif last == Variant.INCLUDE:
+			props.include = arg
+		elif last == Variant.EXCLUDE:
+			props.exclude = arg
+		elif last == Variant.WATCH_STABLE:
+			props.watch_stable = arg
+		elif last == Variant.MAX_THREADS:
+			props.max_threads = arg
+		elif last == Variant.MAX_LOAD:
+			props.max_load = arg
+		elif last == Variant.NICE:
+			props.nice = arg
+		elif last == Variant.IONICE:
+			props.ionice = arg
+		elif last == Variant.SERVE:
+			props.serve = arg
+		elif last == Variant.WORKER:
+			props.worker = arg
+		elif last == Variant.LEASE:
+			props.lease = arg
+		elif last == Variant.RENDITIONS:
+			props.renditions = arg
+		elif last == Variant.CONTROL:
+			props.control = arg
+		elif last == Variant.METRICS:
+			props.metrics = arg
+		elif last == Variant.TRACE:
+			props.trace = arg
+		elif last == Variant.LOGS:
+			props.logs = arg
+		elif last == Variant.LOG_SIZE:
+			props.log_size = arg
+		elif last == Variant.LOG_LINES:
+			props.log_lines = arg
+		elif last == Variant.VERIFY:
+			props.verify = arg
+		elif last == Variant.VERIFY_THREADS:
+			props.verify_threads = arg
+		elif last == Variant.VERIFY_TOLERANCE:
+			props.verify_tolerance = arg
+		elif last == Variant.PROMETHEUS:
+			props.prometheus = arg
+		elif last == Variant.SCRATCH:
+			props.scratch = arg
+		elif last == Variant.SCRATCH_SIZE:
+			props.scratch_size = arg
+		elif last == Variant.IO_THREADS:
+			props.io_threads = arg
+		elif last == Variant.HISTORY:
+			props.history = arg
+		elif last == Variant.COPY_VIDEO:
+			props.copy_video = arg
+		elif last == Variant.COPY_AUDIO:
+			props.copy_audio = arg
+		elif last == Variant.MANIFEST:
+			props.manifest = arg
+		elif last == Variant.MAX_JOBS:
+			props.max_jobs = arg
+		elif last == Variant.PAUSE_WINDOW:
+			props.pause_window = arg
+		elif last == Variant.PAUSE_LOAD:
+			props.pause_load = arg
+		elif last == Variant.PAUSE_FILE:
+			props.pause_file = arg
 		elif last == Variant.CFG:
 			try:
 				load_properties(props, arg)
@@ -467,24 +3906,39 @@ def edit_order_menu(props: Properties):
 		if inp in ('halt', 'cancel', 'abort'):
 			return
 		elif inp in ('accept', 'apply'):
+			try:
+				CommandTemplate(props, params_order)
+			except ValueError as exc:
+				print(f'Error: {exc}, pattern cannot be applied')
+				continue
 			props.params_order = params_order
 			return
 		params_order = inp
 		for prop in Properties.props_names.values():
 			if not prop in params_order:
 				print(f'Warning: property "{prop}" is not used')
+		try:
+			CommandTemplate(props, params_order)
+		except ValueError as exc:
+			print(f'Warning: {exc}')
 
 def main_menu(props: Properties):
 	'''main_menu shows user interface where most of the parameters can be set.
 	It returns True if user decided to exit the script, and False when user decided to start the script work'''
+	last_files_key = None
 	while not props.no_user:
 		print('-' * (os.get_terminal_size().columns // 2))
 		print('Now order of parameters is:')
 		print(props.params_order)
 		print('Now execution string looks like this:')
 		print(Properties.get_exec_str(props))
-		cnt = len(tuple(filter(lambda filename: filename.endswith(tuple(props.input_formats)), os.listdir(props.input_dir))))
-		print(f'{cnt} files found')
+		files_key = (props.input_dir, props.output_dir, tuple(props.input_formats), props.recursive,
+			tuple(props.include), tuple(props.exclude), props.cache, props.history, Properties.get_preset(props),
+			props.threads)
+		if files_key != last_files_key:
+			files_summary = summarize_files(props)
+			last_files_key = files_key
+		print(files_summary)
 
 		print(props.finish) # fixme it's not needed here
 		print('List of commands:')
@@ -496,9 +3950,20 @@ def main_menu(props: Properties):
 		print('\t"ip" / "input_params" / "input_parameters" - change input parameters string', f'[{props.input_params}]')
 		print('\t"op" / "output_params" / "output_parameters" - change output parameters string', f'[{props.output_params}]')
 		print('\t"threads" - change number of ffmpegs running at one time', f'[{props.threads}]')
+		print('\t"adaptive" - switch tuning of number of threads during the run', f'[{props.adaptive}, ' \
+			f'up to {props.max_threads} threads]')
+		print('\t"schedule" - change order of jobs ("fifo", "longest", "largest" or "cost" first)', f'[{props.schedule}]')
+		print('\t"renditions" - change profiles which outputs are made from each file', props.renditions,
+			f'(available: {", ".join(props._profiles) if len(props._profiles) > 0 else "none"})')
 		print('\t"s_ty" / "shutdown_type" - chage type of action after finishing ("-" or "shutdown" / "s" or "hibernation" / "h")')
 		print('\t"s_ti" / "shutdown_time" - change time between finishing and shutdown/hibernation') # TODO make one "finish" command ^
 		print('\t"edit_order" / "order" - change the pattern of execution string')
+		print('\t"preflight" - switch checking of all the files with short run of ffmpeg before encoding',
+			f'[{props.preflight}]')
+		print('\t"recursive" - switch walking of subdirectories of input directory', f'[{props.recursive}]')
+		print('\t"include" / "exclude" - change glob patterns of files to take or to skip', props.include, props.exclude)
+		print('\t"rescan" - look for input files again')
+		print('\t"clear_cache" - forget all the cached ffprobe descriptions of files', f'[{props.cache}]')
 		print('\t"save <filename>" - save current configuration to <filename> file"')
 		print('\t"load <filename>" - load configuration from <filename> file"')
 		print('\t"start" / "go" / <empty_string> - start the script')
@@ -610,6 +4075,42 @@ def main_menu(props: Properties):
 				except Exception:
 					print(f'Error of decoding your "number": \'{data}\'. Try again.')
 					data = ''
+		elif comm == 'adaptive':
+			props.adaptive = not props.adaptive
+			print(f'Number of threads is {"" if props.adaptive else "not "}tuned during the run now.')
+		elif comm.startswith('schedule'):
+			if data == '':
+				data = input('Enter "fifo" to keep order of files, "longest" to start longest files first, ' \
+					'"largest" to start largest files first or "cost" to start first the files which take longest ' \
+					'to encode: ')
+			props.schedule = data
+			print(f'Schedule is \'{props.schedule}\'')
+		elif comm.startswith('renditions'):
+			if data == '':
+				data = input('Enter comma-separated names of profiles ("-" for one output with main parameters): ')
+			props.renditions = [] if data == '-' else data
+			for name in filter(lambda name: name not in props._profiles, props.renditions):
+				print(f'Warning: profile \'{name}\' is not found in configuration')
+			print(f'Accepted, renditions are {props.renditions}.')
+		elif comm == 'preflight':
+			props.preflight = not props.preflight
+			print(f'Files are {"" if props.preflight else "not "}checked before encoding now.')
+		elif comm == 'recursive':
+			props.recursive = not props.recursive
+			print(f'Subdirectories are {"" if props.recursive else "not "}walked now.')
+		elif comm.startswith(('include', 'exclude')):
+			if data == '':
+				data = input('Enter comma-separated glob patterns (relative to input directory, "-" for none): ')
+			setattr(props, comm.split()[0], [] if data == '-' else data)
+			print(f'Accepted, include is {props.include}, exclude is {props.exclude}.')
+		elif comm == 'rescan':
+			last_files_key = None
+		elif comm == 'clear_cache':
+			if props.cache != '':
+				cache = MetadataCache(props.cache, props.cache_size)
+				cache.clear()
+				cache.close()
+			print('Metadata cache is cleared.')
 		elif comm in ('edit_order', 'order'):
 			edit_order_menu(props)
 		elif comm.startswith('save'):
@@ -655,6 +4156,8 @@ def main_menu(props: Properties):
 	return False
 
 def main(argv):
+	if len(argv) > 2 and argv[1] == 'control':
+		return control_client(argv[2], argv[3:])
 	props = Properties()
 	try:
 		load_properties(props, 'default.ini')
@@ -671,60 +4174,111 @@ def main(argv):
 	save_properties(props, 'lastconfig.ini')
 	print('Current config has been written to "lastconfig.ini"')
 	# working
-	files = []
-	for fname in os.listdir(props.input_dir):
-		if fname.endswith(tuple(props.input_formats)):
-			files.append(fname)
-	props.output_dir = Properties.get_exec_cmd(props, '', props.output_dir)
-	if len(files) > 0 and not os.path.exists(props.output_dir):
-		os.mkdir(props.output_dir)
-	files = tuple(files)
-	if props.threads == 1 and len(files) > 0:
-		for i, fname in enumerate(files):
-			#command = (props.ffmpeg_path, *split_quotes(props.input_params), props.input_dir + os.path.sep + fname,
-			#	*split_quotes(props.output_params),
-			#	props.output_dir + os.path.sep + fname[:fname.rfind('.') + 1] + props.output_format
-			#)
-			command = split_quotes(Properties.get_exec_cmd(props, fname))
-			print(' '.join(command))
-			#print(props.ffmpeg_path, props.input_params, '"' + props.input_dir + os.path.sep + fname + '"',
-			#	*split_quotes(props.output_params),
-			#	'"' + props.output_dir + os.path.sep + fname[:fname.rfind('.') + 1] + props.output_format + '"')
-			change_title(f'[{i + 1} / {len(files)}] ({fname}), {props.finish}')
-			subprocess.call(command)
-	elif len(files) > 0:
-		import multiprocessing
-		if len(files) < props.threads:
-			print(f'Setting number of threads from {props.threads} to {len(files)} as number of files to encode')
-			props.threads = len(files)
-		pool = multiprocessing.Pool(processes = props.threads)
-		done = None
-		if os.sys.platform == 'win32':
-			done = pool.map_async( \
-				recode_func, \
-				((i + 1, f'start "{fname}" /WAIT ' + \
-					Properties.get_exec_cmd(props, fname))
-					for i, fname in enumerate(files)
-				)
-			)
+	for name in filter(lambda name: name not in props._profiles, props.renditions):
+		print(f'Error: profile \'{name}\' of renditions is not found in configuration')
+		return 1
+	for name, profile in (('', props), *map(lambda name: (name, Properties.get_profile(props, name)), props.renditions)):
+		try:
+			parse_constraints(profile.copy_video)
+			parse_constraints(profile.copy_audio)
+		except ValueError as exc:
+			print(f'Error: bad stream copy constraints{" of profile " + repr(name) if name != "" else ""}: {exc}')
+			return 1
+	if props.worker != '':
+		print(f'Taking jobs from coordinator at {props.worker}')
+		props.journal = ''
+		worker = Worker(props, props.worker)
+		worker.trace = Trace(props.trace) if props.trace != '' else None
+		worker.run(worker.leased_jobs())
+		if worker.trace is not None:
+			worker.trace.close()
+		success = report_jobs(worker.finished, len(worker.finished))
+		props.finish.execute()
+		if not props.no_user:
+			pause()
+		return 0 if success else 1
+	Properties.expand_output_dir(props)
+	files = discover_files(props)
+	total = None
+	rejected = []
+	skipped_rows = []
+	if props.manifest != '' and not os.path.isfile(props.manifest):
+		print(f'Error: manifest \'{props.manifest}\' is not found')
+		return 1
+	trace = Trace(props.trace) if props.trace != '' else None
+	started = time.time()
+	if props.preflight and not props.watch and props.manifest == '':
+		files, rejected = preflight(props, tuple(files))
+		total = len(files)
+		if trace is not None:
+			trace.span('preflight', 'queue', started, time.time(), passed=len(files), failed=len(rejected))
+	if props.manifest != '':
+		if props.serve != '' or props.watch:
+			print('Warning: jobs are taken from manifest, coordinator and watch mode are not used')
+		print(f'Taking jobs from manifest \'{props.manifest}\'')
+		jobs = read_manifest(props, skipped_rows)
+	elif props.serve != '':
+		if props.schedule != 'fifo':
+			started = time.time()
+			files = order_files(props, tuple(files))
+			total = len(files)
+			if trace is not None:
+				trace.span('order', 'queue', started, time.time(), schedule=props.schedule, files=total)
+		jobs = None
+	elif props.watch:
+		async def watch_jobs():
+			number = 0
+			async for filename in watch_files(props):
+				number += 1
+				yield Job(props, number, filename)
+		print(f'Watching \'{props.input_dir}\' for new files, hit Ctrl + C to stop')
+		jobs = watch_jobs()
+	else:
+		if props.schedule != 'fifo':
+			started = time.time()
+			files = order_files(props, tuple(files))
+			total = len(files)
+			if trace is not None:
+				trace.span('order', 'queue', started, time.time(), schedule=props.schedule, files=total)
+		elif total is None and props.segments and props.threads > 1 and len(props.renditions) == 0:
+			from itertools import chain, islice
+			first = tuple(islice(files, props.threads))
+			files = chain(first, files) if len(first) == props.threads else first
+			total = len(first) if len(first) < props.threads else None
+		if total is not None and 0 < total < props.threads and props.segments and len(props.renditions) == 0:
+			jobs = plan_segments(props, files)
 		else:
-			done = pool.map_async( \
-				recode_func, \
-				((i + 1, Properties.get_exec_cmd(props, fname) + ' &')
-					for i, fname in enumerate(files)
-				)
-			)
-		try:
-			done.get()
-		except KeyboardInterrupt:
-			pool.terminate() # doesen't work
-		#pool.join()
-	if os.path.isdir(props.output_dir) and len(os.listdir(props.output_dir)) == 0:
-		print('Output folder is empty, it will be deleted')
-		os.rmdir(props.output_dir)
+			if total is not None and 0 < total < props.threads and not props.adaptive:
+				print(f'Setting number of threads from {props.threads} to {total} as number of files to encode')
+				props.threads = total
+			jobs = (Job(props, i + 1, fname) for i, fname in enumerate(files))
+	scheduler = Scheduler(props) if jobs is not None else Coordinator(props, files, total)
+	if jobs is not None:
+		scheduler.trace = trace
+		scheduler.run(jobs, total)
+	else:
+		scheduler.serve(props.serve)
+	if scheduler.skipped > 0:
+		print(f'{scheduler.skipped} jobs are skipped as already finished')
+	success = report_jobs(scheduler.finished, (scheduler.total or 0) - scheduler.skipped)
+	if len(rejected) > 0:
+		print(f'{len(rejected)} files have failed preflight and are not encoded')
+		success = False
+	if len(skipped_rows) > 0:
+		print(f'{len(skipped_rows)} rows of manifest have errors and are skipped')
+		success = False
+	started = time.time()
+	if os.path.isdir(props.output_dir):
+		remove_empty_dirs(props.output_dir)
+		if not os.path.isdir(props.output_dir):
+			print('Output folder is empty, it has been deleted')
+	if trace is not None:
+		trace.span('cleanup', 'queue', started, time.time())
+		trace.close()
 	props.finish.execute()
 	if not props.no_user:
 		pause()
+	return 0 if success else 1
 
 if __name__ == '__main__':
-	main(sys.argv)
+	sys.exit(main(sys.argv))
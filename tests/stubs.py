@@ -0,0 +1,50 @@
+'''stubs is the module which writes stub executables of ffmpeg and ffprobe for tests, like the one of benchmark.py.
+ffmpeg stub works for STUB_WALL seconds, writes 1000 bytes to output (the last argument), appends its arguments
+to STUB_LOG (if it is set) and exits with STUB_EXIT code. ffprobe stub describes any file as STUB_DURATION seconds
+long with streams of STUB_STREAMS kinds (JSON list), and gives keyframes every 10 seconds.'''
+import sys
+import os
+
+FFMPEG = '''import sys, os, time, json
+args = sys.argv[1:]
+time.sleep(float(os.environ.get('STUB_WALL', '0')))
+if len(args) > 0 and args[-1] != '-':
+	with open(args[-1], 'wb') as f:
+		f.write(bytes(1000))
+if 'STUB_LOG' in os.environ:
+	with open(os.environ['STUB_LOG'], 'a') as f:
+		f.write(json.dumps(args) + '\\n')
+sys.exit(int(os.environ.get('STUB_EXIT', '0')))
+'''
+
+FFPROBE = '''import sys, os, json
+args = sys.argv[1:]
+duration = float(os.environ.get('STUB_DURATION', '600'))
+if '-show_entries' in args:
+	for keyframe in range(0, int(duration), 10):
+		print(f'{keyframe:.6f},K_')
+		print(f'{keyframe + 5:.6f},__')
+	sys.exit(0)
+kinds = json.loads(os.environ.get('STUB_STREAMS', '["video", "audio"]'))
+print(json.dumps({'format': {'duration': str(duration)},
+	'streams': [{'index': i, 'codec_type': kind} for i, kind in enumerate(kinds)]}))
+'''
+
+def write_stub(directory: str, name: str, source: str):
+	'''write_stub writes stub executable with given Python source to the directory and returns its path.'''
+	with open(os.path.join(directory, f'{name}.py'), 'w') as f:
+		f.write(source)
+	if sys.platform == 'win32':
+		path = os.path.join(directory, f'{name}.cmd')
+		with open(path, 'w') as f:
+			f.write(f'@"{sys.executable}" -S "%~dp0{name}.py" %*\n')
+	else:
+		path = os.path.join(directory, name)
+		with open(path, 'w') as f:
+			f.write(f'#!{sys.executable} -S\n{source}')
+		os.chmod(path, 0o755)
+	return path
+
+def write_stubs(directory: str):
+	'''write_stubs writes stubs of ffmpeg and ffprobe to the directory and returns their paths.'''
+	return write_stub(directory, 'ffmpeg', FFMPEG), write_stub(directory, 'ffprobe', FFPROBE)
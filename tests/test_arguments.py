@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import Properties, to_list, parse_arguments
+
+class ToListTest(unittest.TestCase):
+	def test_comma_separated(self):
+		self.assertEqual(to_list('*.avi, *.mkv,,sample*'), ['*.avi', '*.mkv', 'sample*'])
+		self.assertEqual(to_list(''), [])
+
+	def test_list_literal(self):
+		self.assertEqual(to_list(str(['a,b', 'c'])), ['a,b', 'c'])
+		self.assertEqual(to_list('[]'), [])
+
+	def test_brackets_which_are_not_list(self):
+		self.assertEqual(to_list('[abc]'), ['[abc]'])
+		self.assertEqual(to_list('[ab]*.avi,*.mkv'), ['[ab]*.avi', '*.mkv'])
+		self.assertEqual(to_list('[a-c]*'), ['[a-c]*'])
+
+	def test_not_string(self):
+		self.assertEqual(to_list(('a', 'b')), ['a', 'b'])
+
+class ParseArgumentsTest(unittest.TestCase):
+	def test_glob_in_brackets(self):
+		props = Properties()
+		self.assertFalse(parse_arguments(['ffmpeg_queue', '--exclude=[abc]', '-include', '*.avi,[0-9]*'], props))
+		self.assertEqual(props.exclude, ['[abc]'])
+		self.assertEqual(props.include, ['*.avi', '[0-9]*'])
+
+if __name__ == '__main__':
+	unittest.main()
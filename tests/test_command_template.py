@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import Properties, CommandTemplate
+
+def make_props(**params):
+	props = Properties()
+	props._time = 1234
+	props.input_dir = 'in'
+	props.output_dir = 'out'
+	for param, value in params.items():
+		setattr(props, param, value)
+	Properties.expand_output_dir(props)
+	return props
+
+class CommandTemplateTest(unittest.TestCase):
+	def test_default_order(self):
+		template = CommandTemplate(make_props(output_params='-c:v libx264 -crf 23'))
+		self.assertEqual(template.render('a.avi', 'a.mkv'), ['ffmpeg', '-i', f'in{os.path.sep}a.avi', '-c:v', 'libx264',
+			'-crf', '23', f'out{os.path.sep}a.mkv'])
+		self.assertEqual(template.output_index, 3)
+
+	def test_filenames_are_not_split(self):
+		template = CommandTemplate(make_props())
+		command = template.render('a "b" c.avi', "it's.mkv")
+		self.assertEqual(command[2], f'in{os.path.sep}a "b" c.avi')
+		self.assertEqual(command[-1], f"out{os.path.sep}it's.mkv")
+
+	def test_quoted_parameters(self):
+		template = CommandTemplate(make_props(output_params='-vf "scale=1280:-2, fps=30" -c:a aac'))
+		self.assertEqual(template.render('a.avi', 'a.mkv')[3:7], ['-vf', 'scale=1280:-2, fps=30', '-c:a', 'aac'])
+
+	def test_custom_order(self):
+		template = CommandTemplate(make_props(), '{ffmpeg_path} -y {input_params} {input_dir}/{input_filename} '
+			'-metadata comment=batch_{time} {output_dir}/{output_filename}')
+		self.assertEqual(template.render('a.avi', 'a.mkv'), ['ffmpeg', '-y', '-i', 'in/a.avi', '-metadata',
+			'comment=batch_1234', 'out/a.mkv'])
+		self.assertEqual(template.output_index, 6)
+
+	def test_time_is_rendered_per_job(self):
+		props = make_props(output_dir='out/{time}')
+		template = CommandTemplate(props)
+		self.assertEqual(template.render('a.avi', 'a.mkv')[-1], os.path.join('out', '1234', 'a.mkv'))
+		self.assertEqual(template.render('a.avi', 'a.mkv', '{time}')[-1], os.path.join('out', '{time}', 'a.mkv'))
+		self.assertEqual(template.render('1234.avi', '1234.mkv', '{time}')[-1],
+			os.path.join('out', '{time}', '1234.mkv'))
+
+	def test_unknown_expression(self):
+		with self.assertRaises(ValueError):
+			CommandTemplate(make_props(), '{ffmpeg_path} {unknown} {output_dir}/{output_filename}')
+
+	def test_template_is_cached(self):
+		props = make_props()
+		template = Properties.get_template(props)
+		self.assertIs(Properties.get_template(props), template)
+		props.output_params = '-c:v libx265'
+		self.assertIsNot(Properties.get_template(props), template)
+
+if __name__ == '__main__':
+	unittest.main()
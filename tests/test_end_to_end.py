@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stubs import write_stubs
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ffmpeg_queue.py')
+
+class EndToEndTest(unittest.TestCase):
+	'''EndToEndTest runs the script as it is run from console, with stub ffmpeg and ffprobe (see stubs).'''
+	def setUp(self):
+		self._directory = tempfile.TemporaryDirectory()
+		self.directory = self._directory.name
+		self.ffmpeg, self.ffprobe = write_stubs(self.directory)
+		self.input_dir = os.path.join(self.directory, 'in')
+		os.makedirs(self.input_dir)
+		self.log = os.path.join(self.directory, 'stub.log')
+		self.env = {**os.environ, 'STUB_LOG': self.log, 'STUB_DURATION': '60'}
+
+	def tearDown(self):
+		self._directory.cleanup()
+
+	def make_inputs(self, *filenames):
+		for filename in filenames:
+			with open(os.path.join(self.input_dir, filename), 'wb') as f:
+				f.write(bytes(100))
+
+	def command(self, *args):
+		return [sys.executable, SCRIPT, '-no_user', '-ffpath', self.ffmpeg, '-fppath', self.ffprobe, '-id', self.input_dir,
+			'--cache=', '--history=', '--progress=0', '-no_segments', *args]
+
+	def run_queue(self, *args, cwd: str = None):
+		return subprocess.run(self.command(*args), cwd=cwd or self.directory, env=self.env, stdin=subprocess.DEVNULL,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=60)
+
+	def launches(self):
+		if not os.path.isfile(self.log):
+			return 0
+		with open(self.log) as f:
+			return len(f.readlines())
+
+	def outputs(self, directory: str):
+		return sorted(filter(lambda name: not name.startswith('.'), os.listdir(directory)))
+
+	def test_journal_restart(self):
+		self.make_inputs('a.avi', 'b.avi', 'c 1.avi')
+		journal = os.path.join(self.directory, 'journal.sqlite')
+		result = self.run_queue('-threads', '2', f'--journal={journal}')
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertEqual(self.launches(), 3)
+		output_dirs = tuple(filter(lambda name: name.startswith('Output '), os.listdir(self.input_dir)))
+		self.assertEqual(len(output_dirs), 1)
+		self.assertEqual(self.outputs(os.path.join(self.input_dir, output_dirs[0])), ['a.mkv', 'b.mkv', 'c 1.mkv'])
+		# output directory depends on {time}, which is another one in the next launch
+		time.sleep(1.1)
+		other = os.path.join(self.directory, 'other')
+		os.makedirs(other)
+		result = self.run_queue('-threads', '2', f'--journal={journal}', cwd=other)
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertIn('3 jobs are skipped as already finished', result.stdout)
+		self.assertEqual(self.launches(), 3)
+		# changed file and removed output are encoded again
+		self.make_inputs('a.avi')
+		with open(os.path.join(self.input_dir, 'a.avi'), 'ab') as f:
+			f.write(bytes(10))
+		os.remove(os.path.join(self.input_dir, output_dirs[0], 'b.mkv'))
+		result = self.run_queue('-threads', '2', f'--journal={journal}')
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertIn('1 jobs are skipped as already finished', result.stdout)
+		self.assertEqual(self.launches(), 5)
+
+	def test_failed_jobs_are_run_again(self):
+		self.make_inputs('a.avi')
+		journal = os.path.join(self.directory, 'journal.sqlite')
+		output_dir = os.path.join(self.directory, 'out')
+		self.env['STUB_EXIT'] = '1'
+		result = self.run_queue('-od', output_dir, f'--journal={journal}')
+		self.assertEqual(result.returncode, 1, result.stdout)
+		self.assertFalse(os.path.exists(os.path.join(output_dir, 'a.mkv')))
+		del self.env['STUB_EXIT']
+		result = self.run_queue('-od', output_dir, f'--journal={journal}')
+		self.assertEqual(result.returncode, 0, result.stdout)
+		self.assertEqual(self.launches(), 2)
+		self.assertEqual(self.outputs(output_dir), ['a.mkv'])
+
+	@unittest.skipIf(sys.platform == 'win32', 'control socket is not available on Windows')
+	def test_control_add(self):
+		self.make_inputs('a.avi', 'b.avi')
+		output_dir = os.path.join(self.directory, 'out')
+		socket = os.path.join(self.directory, 'control.sock')
+		self.env['STUB_WALL'] = '2'
+		queue = subprocess.Popen(self.command('-threads', '2', '-od', output_dir, '--journal=', '-control', socket),
+			cwd=self.directory, env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT, universal_newlines=True)
+		try:
+			started = time.time()
+			while not os.path.exists(socket) and time.time() - started < 10:
+				time.sleep(0.1)
+			self.make_inputs('c.avi')
+			outside = os.path.join(self.directory, 'outside')
+			os.makedirs(outside)
+			for name in ('x.avi', 'x.mkv'):
+				with open(os.path.join(outside, name), 'wb') as f:
+					f.write(b'source')
+			control = lambda *args: subprocess.run([sys.executable, SCRIPT, 'control', socket, *args],
+				stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=10)
+			result = control('add', '-p', '1', 'c.avi', os.path.join(outside, 'x.avi'))
+			self.assertEqual(result.returncode, 0, result.stdout)
+			self.assertIn('jobs +1, +2 are added', result.stdout)
+			result = control('add', os.path.join('..', 'outside', 'x.avi'))
+			self.assertNotEqual(result.returncode, 0, result.stdout)
+			output, _ = queue.communicate(timeout=60)
+		finally:
+			if queue.poll() is None:
+				queue.kill()
+				queue.wait()
+		self.assertEqual(queue.returncode, 0, output)
+		self.assertIn('4 of 4 jobs are finished successfully', output)
+		self.assertEqual(self.outputs(output_dir), ['a.mkv', 'b.mkv', 'c.mkv', 'x.mkv'])
+		with open(os.path.join(outside, 'x.mkv'), 'rb') as f:
+			self.assertEqual(f.read(), b'source')
+		self.assertFalse(os.path.exists(socket))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import JobLog, LOG_LINE_LENGTH
+
+class JobLogTest(unittest.TestCase):
+	def test_tail_is_bounded(self):
+		log = JobLog(None, 0, 3)
+		for i in range(10):
+			log.write(f'line {i}\n'.encode())
+		log.close()
+		self.assertEqual(list(log.tail), ['line 7', 'line 8', 'line 9'])
+
+	def test_lines_split_between_chunks(self):
+		log = JobLog(None, 0, 5)
+		for chunk in (b'fir', b'st\nsec', b'ond\n\nthi', 'rd é'.encode()[:-1], 'rd é'.encode()[-1:], b'\n'):
+			log.write(chunk)
+		self.assertEqual(list(log.tail), ['first', 'second', 'third é'])
+
+	def test_status_lines_replace_each_other(self):
+		log = JobLog(None, 0, 5)
+		log.write(b'Input #0\nframe=1\rframe=2\rframe=3\r')
+		log.write(b'frame=4\r[error] broken packet\nframe=5\r')
+		self.assertEqual(list(log.tail), ['Input #0', 'frame=4', '[error] broken packet', 'frame=5'])
+
+	def test_long_lines_are_cut(self):
+		log = JobLog(None, 0, 2)
+		log.write(b'x' * (3 * LOG_LINE_LENGTH))
+		log.write(b'y\n')
+		self.assertEqual(list(log.tail), ['x' * LOG_LINE_LENGTH])
+
+	def test_no_tail(self):
+		log = JobLog(None, 0, 0)
+		log.write(b'line\n')
+		self.assertEqual(list(log.tail), [])
+
+	def test_file_is_rotated(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'logs', 'job.log')
+			log = JobLog(path, 100, 1)
+			for i in range(30):
+				log.write(f'line {i:02}\n'.encode())
+			log.close()
+			with open(path, 'rb') as f:
+				current = f.read()
+			with open(path + '.1', 'rb') as f:
+				previous = f.read()
+			self.assertTrue(current.endswith(b'line 29\n'))
+			self.assertTrue(0 < len(current) <= 100 and len(previous) <= 100)
+			self.assertTrue((previous + current).endswith(b''.join(map(lambda i: f'line {i:02}\n'.encode(),
+				range(30 - (len(previous) + len(current)) // 8, 30)))))
+			self.assertEqual(list(log.tail), ['line 29'])
+
+if __name__ == '__main__':
+	unittest.main()
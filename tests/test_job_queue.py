@@ -0,0 +1,116 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import Properties, Job, JobQueue
+
+PROPS = Properties()
+
+def make_job(number: int, priority: int = 0, profile: str = None):
+	job = Job(PROPS, number, f'{number}.avi')
+	job.priority = priority
+	job.profile = profile
+	return job
+
+async def blocked(awaitable, timeout: float = 0.1):
+	'''blocked returns True if the awaitable is not done in timeout.'''
+	try:
+		await asyncio.wait_for(awaitable, timeout)
+	except asyncio.TimeoutError:
+		return True
+	return False
+
+class JobQueueTest(unittest.TestCase):
+	def test_priority_order(self):
+		async def run():
+			queue = JobQueue(10)
+			jobs = [make_job(1), make_job(2, 5), make_job(3), make_job(4, 5), make_job(5, -1)]
+			for job in jobs:
+				await queue.put(job)
+			queue.close()
+			numbers = []
+			while True:
+				job = await queue.get()
+				if job is None:
+					return numbers
+				numbers.append(job.number)
+		self.assertEqual(asyncio.run(run()), [2, 4, 1, 3, 5])
+
+	def test_reprioritize_and_remove(self):
+		async def run():
+			queue = JobQueue(10)
+			jobs = [make_job(1), make_job(2), make_job(3), make_job(4)]
+			for job in jobs:
+				await queue.put(job)
+			self.assertTrue(queue.reprioritize(jobs[2], 1))
+			self.assertTrue(queue.remove(jobs[0]))
+			self.assertFalse(queue.remove(jobs[0]))
+			self.assertFalse(queue.reprioritize(jobs[0], 2))
+			return list(map(lambda job: job.number, queue.jobs()))
+		self.assertEqual(asyncio.run(run()), [3, 2, 4])
+
+	def test_size_limits_fed_jobs_only(self):
+		async def run():
+			queue = JobQueue(2)
+			await queue.put(make_job(1))
+			await queue.put(make_job(2))
+			self.assertTrue(await blocked(queue.put(make_job(3))))
+			queue.put_nowait(make_job(4, 1))
+			self.assertEqual((await queue.get()).number, 4)
+			self.assertTrue(await blocked(queue.put(make_job(5))))
+			self.assertEqual((await queue.get()).number, 1)
+			self.assertFalse(await blocked(queue.put(make_job(6))))
+		asyncio.run(run())
+
+	def test_keep_open(self):
+		async def run():
+			queue = JobQueue(2)
+			running = [True]
+			queue.keep_open = lambda: running[0]
+			queue.close()
+			get = asyncio.ensure_future(queue.get())
+			self.assertTrue(await blocked(asyncio.shield(get)))
+			queue.put_nowait(make_job(1))
+			self.assertEqual((await get).number, 1)
+			get = asyncio.ensure_future(queue.get())
+			self.assertTrue(await blocked(asyncio.shield(get)))
+			running[0] = False
+			queue.notify()
+			self.assertIsNone(await get)
+		asyncio.run(run())
+
+	def test_capped_jobs_are_parked(self):
+		async def run():
+			queue = JobQueue(2, parked=10)
+			fast = lambda job: job.profile == 'fast'
+			await queue.put(make_job(1, profile='slow'))
+			await queue.put(make_job(2, profile='slow'))
+			put = asyncio.ensure_future(queue.put(make_job(3, profile='fast')))
+			self.assertEqual((await queue.get(fast)).number, 3)
+			await put
+			self.assertEqual(list(map(lambda job: job.number, queue.jobs())), [1, 2])
+			await queue.put(make_job(4, profile='slow'))
+			await queue.put(make_job(5, profile='slow'))
+			self.assertTrue(await blocked(queue.put(make_job(6, profile='fast'))))
+			self.assertEqual((await queue.get()).number, 1)
+			self.assertEqual((await queue.get()).number, 2)
+		asyncio.run(run())
+
+	def test_parked_jobs_are_limited(self):
+		async def run():
+			queue = JobQueue(2, parked=1)
+			fast = lambda job: job.profile == 'fast'
+			await queue.put(make_job(1, profile='slow'))
+			await queue.put(make_job(2, profile='slow'))
+			self.assertTrue(await blocked(queue.get(fast)))
+			self.assertFalse(await blocked(queue.put(make_job(3, profile='slow'))))
+			self.assertTrue(await blocked(queue.get(fast)))
+			self.assertTrue(await blocked(queue.put(make_job(4, profile='fast'))))
+			queue.clear()
+			self.assertFalse(await blocked(queue.put(make_job(5, profile='slow'))))
+		asyncio.run(run())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import Properties, plan_segments, drop_options, SEGMENT_DROPPED
+from stubs import write_stubs
+
+class DropOptionsTest(unittest.TestCase):
+	def test_stream_selection(self):
+		self.assertEqual(drop_options('-map 0 -c:v libx264 -sn -map 0:a -c:a aac', SEGMENT_DROPPED),
+			'-c:v libx264 -c:a aac')
+		self.assertEqual(drop_options('-vf "scale=1280:-2, fps=30" -an', SEGMENT_DROPPED),
+			'-vf "scale=1280:-2, fps=30"')
+
+class PlanSegmentsTest(unittest.TestCase):
+	def setUp(self):
+		self._directory = tempfile.TemporaryDirectory()
+		self.directory = self._directory.name
+		self.props = Properties()
+		self.props.ffmpeg_path, self.props.ffprobe_path = write_stubs(self.directory)
+		self.props.input_dir = self.directory
+		self.props.output_dir = os.path.join(self.directory, 'out')
+		self.props.cache = ''
+		self.props.threads = 4
+		Properties.expand_output_dir(self.props)
+
+	def tearDown(self):
+		self._directory.cleanup()
+
+	def plan(self, files: tuple, **env):
+		for filename in files:
+			open(os.path.join(self.directory, filename), 'w').close()
+		with mock.patch.dict(os.environ, env), redirect_stdout(StringIO()):
+			return plan_segments(self.props, files)
+
+	def test_split(self):
+		self.props.output_params = '-map 0 -c:v libx264 -sn -c:a aac'
+		jobs = self.plan(('a.avi',), STUB_DURATION='600')
+		parent = jobs[0].parent
+		self.assertEqual(len(jobs), 5)
+		self.assertEqual(parent.parts, jobs)
+		self.assertIs(parent.audio, jobs[0])
+		self.assertTrue(all(map(lambda job: job.number == 1 and job.parent is parent, jobs)))
+		self.assertEqual(parent.audio.command[3:-1], ['-c:v', 'libx264', '-c:a', 'aac', '-map', '0:a', '-vn', '-sn',
+			'-dn'])
+		starts = []
+		for part in jobs[1:]:
+			self.assertEqual(part.command.count('-map'), 1)
+			self.assertEqual(part.command[part.command.index('-map') + 1], '0:v:0')
+			self.assertNotIn('-sn', part.command[:part.command.index('-map')])
+			starts.append(float(part.command[part.command.index('-ss') + 1]))
+		self.assertEqual(starts, [0.0, 150.0, 300.0, 450.0])
+		self.assertEqual(jobs[1].command[jobs[1].command.index('-t') + 1], '150.000000')
+		self.assertNotIn('-t', jobs[-1].command)
+		self.assertTrue(all(map(lambda part: '.a.avi.segments' in part.output, jobs)))
+
+	def test_files_share_threads(self):
+		jobs = self.plan(('a.avi', 'b.avi'), STUB_DURATION='600', STUB_STREAMS='["video"]')
+		self.assertEqual(len(jobs), 4)
+		self.assertEqual(list(map(lambda job: job.number, jobs)), [1, 1, 2, 2])
+		self.assertTrue(all(map(lambda job: job.parent.audio is None, jobs)))
+
+	def test_short_file_is_whole(self):
+		jobs = self.plan(('a.avi',), STUB_DURATION='200')
+		self.assertEqual(len(jobs), 1)
+		self.assertIsNone(jobs[0].parts)
+
+	def test_other_streams_are_whole(self):
+		for streams in ('["video", "audio", "subtitle"]', '["video", "video", "audio"]', '["video", "data"]'):
+			with self.subTest(streams=streams):
+				jobs = self.plan(('a.avi',), STUB_DURATION='600', STUB_STREAMS=streams)
+				self.assertEqual(len(jobs), 1)
+				self.assertIsNone(jobs[0].parts)
+
+if __name__ == '__main__':
+	unittest.main()
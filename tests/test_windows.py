@@ -0,0 +1,29 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ffmpeg_queue import Properties, parse_windows
+
+class ParseWindowsTest(unittest.TestCase):
+	def test_periods(self):
+		self.assertEqual(parse_windows('09:00-13:00, 14:30-18:00'), [(540, 780), (870, 1080)])
+		self.assertEqual(parse_windows('22:00-06:00'), [(1320, 360)])
+		self.assertEqual(parse_windows('9-17'), [(540, 1020)])
+		self.assertEqual(parse_windows('18:00-24:00'), [(1080, 1440)])
+		self.assertEqual(parse_windows(''), [])
+
+	def test_bad_periods(self):
+		for string in ('24:30-06:00', '25:00-06:00', '09:60-10:00', '09:00', '09:00-10:00-11:00', 'a-b',
+				'09:00-13:00,xx'):
+			with self.subTest(string=string), self.assertRaises(ValueError):
+				parse_windows(string)
+
+	def test_bad_period_is_not_set(self):
+		props = Properties()
+		props.pause_window = '09:00-18:00'
+		props.pause_window = '24:30-06:00'
+		self.assertEqual(props.pause_window, '09:00-18:00')
+
+if __name__ == '__main__':
+	unittest.main()